@@ -0,0 +1,279 @@
+"""
+Streaming cbor reader and writer (RFC 8949, the subset device messages use)
+The compact alternative to json_stream.py: Cbor_Reader has the same interface as Json_Reader
+so replies can be decoded from the socket with either one, dumps() encodes a message to bytes
+map keys can be sent as small integers through a key table (see comms.WIRE_KEYS)
+"""
+import ustruct
+
+#major types of the initial byte (upper 3 bits)
+MAJOR_UINT = const(0)
+MAJOR_NINT = const(1)
+MAJOR_BYTES = const(2)
+MAJOR_TEXT = const(3)
+MAJOR_ARRAY = const(4)
+MAJOR_MAP = const(5)
+MAJOR_TAG = const(6)
+MAJOR_SIMPLE = const(7)
+#simple values and float sizes (additional info of major type 7)
+SIMPLE_FALSE = const(20)
+SIMPLE_TRUE = const(21)
+SIMPLE_NULL = const(22)
+SIMPLE_UNDEFINED = const(23)
+FLOAT_HALF = const(25)
+FLOAT_SINGLE = const(26)
+FLOAT_DOUBLE = const(27)
+
+#class to parse cbor from a stream, refilling a fixed size buffer with readinto
+#keys is an optional tuple, integer map keys below its length are returned as keys[key]
+#only definite lengths are supported (what dumps() and the server write), tags are skipped
+class Cbor_Reader:
+	def __init__(self, stream, buf=None, buf_size=256, keys=None):
+		self.stream = stream
+		#buffer holding the part of the stream being parsed
+		if buf is None:
+			buf = bytearray(buf_size)
+		self.buf = buf
+		self.keys = keys
+		#position of the next byte in buf, and number of valid bytes in buf
+		self.pos = 0
+		self.end = 0
+
+	#function to get the next byte of the stream (as an int), returns -1 at the end of the stream
+	def next_byte(self):
+		if self.pos >= self.end:
+			if not self.fill():
+				return -1
+		byte = self.buf[self.pos]
+		self.pos += 1
+		return byte
+
+	#function to look at the next byte without consuming it, returns -1 at the end of the stream
+	def peek_byte(self):
+		if self.pos >= self.end:
+			if not self.fill():
+				return -1
+		return self.buf[self.pos]
+
+	#function to refill the buffer from the stream, returns False at the end of the stream
+	def fill(self):
+		#a reader made by loads() has no stream, its buffer is all the data
+		if self.stream is None:
+			return False
+		count = self.stream.readinto(self.buf)
+		self.pos = 0
+		if not count:
+			self.end = 0
+			return False
+		self.end = count
+		return True
+
+	#function to check if the next value is an array (without consuming it)
+	def starts_array(self):
+		byte = self.peek_byte()
+		return byte != -1 and byte >> 5 == MAJOR_ARRAY
+
+	#function to read the initial byte and argument of the next value
+	#returns the major type, additional info and argument (a length, value or float bits)
+	def read_head(self):
+		byte = self.next_byte()
+		if byte == -1:
+			raise ValueError("cbor: unexpected end of stream")
+		info = byte & 0x1F
+		if info < 24:
+			return byte >> 5, info, info
+		if info > 27:
+			raise ValueError("cbor: indefinite length not supported")
+		#argument follows in 1, 2, 4 or 8 bytes (big endian)
+		arg = 0
+		for i in range(1 << (info - 24)):
+			byte_value = self.next_byte()
+			if byte_value == -1:
+				raise ValueError("cbor: unexpected end of stream")
+			arg = (arg << 8) | byte_value
+		return byte >> 5, info, arg
+
+	#function to read count bytes of the stream, returns a bytearray
+	def read_bytes(self, count):
+		out = bytearray(count)
+		done = 0
+		while done < count:
+			if self.pos >= self.end and not self.fill():
+				raise ValueError("cbor: unexpected end of stream")
+			size = min(count - done, self.end - self.pos)
+			out[done:done+size] = self.buf[self.pos:self.pos+size]
+			self.pos += size
+			done += size
+		return out
+
+	#function to read past count bytes of the stream
+	def skip_bytes(self, count):
+		while count:
+			if self.pos >= self.end and not self.fill():
+				raise ValueError("cbor: unexpected end of stream")
+			size = min(count, self.end - self.pos)
+			self.pos += size
+			count -= size
+
+	#function to parse the next full value from the stream
+	def load(self):
+		major, info, arg = self.read_head()
+		if major == MAJOR_UINT:
+			return arg
+		if major == MAJOR_NINT:
+			return -1 - arg
+		if major == MAJOR_BYTES:
+			return bytes(self.read_bytes(arg))
+		if major == MAJOR_TEXT:
+			return str(self.read_bytes(arg), 'utf-8')
+		if major == MAJOR_ARRAY:
+			return [self.load() for i in range(arg)]
+		if major == MAJOR_MAP:
+			value = {}
+			for i in range(arg):
+				key = self.read_key()
+				value[key] = self.load()
+			return value
+		if major == MAJOR_TAG:
+			#tags only describe the value that follows
+			return self.load()
+		return simple_value(info, arg)
+
+	#function to read past the next value without building it
+	def skip_value(self):
+		major, info, arg = self.read_head()
+		if major == MAJOR_BYTES or major == MAJOR_TEXT:
+			self.skip_bytes(arg)
+		elif major == MAJOR_ARRAY:
+			for i in range(arg):
+				self.skip_value()
+		elif major == MAJOR_MAP:
+			for i in range(2*arg):
+				self.skip_value()
+		elif major == MAJOR_TAG:
+			self.skip_value()
+
+	#generator that walks an array, yields each element as it is parsed
+	def iter_array(self):
+		for i in self.iter_elements():
+			yield self.load()
+
+	#generator that walks an array, yields the index of each element before it is parsed
+	#the caller must consume each element (load, skip_value, iter_object...) before the next one
+	def iter_elements(self):
+		major, info, arg = self.read_head()
+		if major != MAJOR_ARRAY:
+			raise ValueError("cbor: expected array")
+		for i in range(arg):
+			yield i
+
+	#generator that walks a map, yields each key
+	#the caller must consume the value of each key (load or skip_value) before the next key
+	def iter_object(self):
+		major, info, arg = self.read_head()
+		if major != MAJOR_MAP:
+			raise ValueError("cbor: expected map")
+		for i in range(arg):
+			yield self.read_key()
+
+	#function to read a map key, integer keys in the key table are returned as their name
+	def read_key(self):
+		key = self.load()
+		if self.keys is not None and isinstance(key, int) and 0 <= key < len(self.keys):
+			return self.keys[key]
+		return key
+
+#function to get the value of a major type 7 item (simple value or float)
+def simple_value(info, arg):
+	if info == SIMPLE_FALSE:
+		return False
+	if info == SIMPLE_TRUE:
+		return True
+	if info == SIMPLE_NULL or info == SIMPLE_UNDEFINED:
+		return None
+	if info == FLOAT_SINGLE:
+		return ustruct.unpack(">f", ustruct.pack(">I", arg))[0]
+	if info == FLOAT_DOUBLE:
+		return ustruct.unpack(">d", ustruct.pack(">Q", arg))[0]
+	if info == FLOAT_HALF:
+		#no half float format in ustruct, sign, 5 bit exponent and 10 bit fraction
+		exponent = (arg >> 10) & 0x1F
+		fraction = arg & 0x3FF
+		if exponent == 0:
+			value = fraction * 2.0**-24
+		elif exponent == 0x1F:
+			value = float("inf") if fraction == 0 else float("nan")
+		else:
+			value = (fraction + 1024) * 2.0**(exponent - 25)
+		return -value if arg & 0x8000 else value
+	raise ValueError("cbor: unsupported simple value " + str(info))
+
+#function to parse a whole cbor value held in memory (bytes, bytearray or memoryview)
+def loads(data, keys=None):
+	reader = Cbor_Reader(None, data, keys=keys)
+	reader.end = len(data)
+	return reader.load()
+
+#function to encode a value (dict, list, tuple, str, bytes, int, float, bool or None) as cbor
+#codes is an optional dict of map key to integer code, other keys are sent as they are
+#floats are sent in 32 bits (battery levels and the like do not need more)
+def dumps(value, codes=None):
+	out = bytearray()
+	write_value(out, value, codes)
+	return bytes(out)
+
+#function to append the initial byte (and argument bytes) of a value to out
+def write_head(out, major, arg):
+	if arg < 24:
+		out.append((major << 5) | arg)
+	elif arg < 0x100:
+		out.append((major << 5) | 24)
+		out.append(arg)
+	elif arg < 0x10000:
+		out.append((major << 5) | 25)
+		out.extend(ustruct.pack(">H", arg))
+	elif arg < 0x100000000:
+		out.append((major << 5) | 26)
+		out.extend(ustruct.pack(">I", arg))
+	else:
+		out.append((major << 5) | 27)
+		out.extend(ustruct.pack(">Q", arg))
+
+#function to append the encoding of value to out
+def write_value(out, value, codes):
+	#bools are checked before ints (True is an int)
+	if value is None:
+		out.append((MAJOR_SIMPLE << 5) | SIMPLE_NULL)
+	elif value is True:
+		out.append((MAJOR_SIMPLE << 5) | SIMPLE_TRUE)
+	elif value is False:
+		out.append((MAJOR_SIMPLE << 5) | SIMPLE_FALSE)
+	elif isinstance(value, int):
+		if value >= 0:
+			write_head(out, MAJOR_UINT, value)
+		else:
+			write_head(out, MAJOR_NINT, -1 - value)
+	elif isinstance(value, float):
+		out.append((MAJOR_SIMPLE << 5) | FLOAT_SINGLE)
+		out.extend(ustruct.pack(">f", value))
+	elif isinstance(value, str):
+		data = value.encode()
+		write_head(out, MAJOR_TEXT, len(data))
+		out.extend(data)
+	elif isinstance(value, (bytes, bytearray)):
+		write_head(out, MAJOR_BYTES, len(value))
+		out.extend(value)
+	elif isinstance(value, dict):
+		write_head(out, MAJOR_MAP, len(value))
+		for key in value:
+			if codes is not None and key in codes:
+				write_value(out, codes[key], codes)
+			else:
+				write_value(out, key, codes)
+			write_value(out, value[key], codes)
+	elif isinstance(value, (list, tuple)):
+		write_head(out, MAJOR_ARRAY, len(value))
+		for item in value:
+			write_value(out, item, codes)
+	else:
+		raise TypeError("cbor: can not encode " + str(type(value)))
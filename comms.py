@@ -3,21 +3,160 @@ This file contains all of the code handling incoming and outgoing wifi,
 blutooth, and cellular communications
 """
 import network
-import urequests
+import ujson
+import ubinascii
 import usocket as socket
-from machine import UART
-from time import sleep_ms, ticks_ms, ticks_diff
+import uselect
+import uio
+import uos
+import uasyncio
+from machine import UART, Pin
+from time import sleep_ms, ticks_ms, ticks_diff, ticks_add
 from config import communication_configuration as commconf
-from dev_funcs import printline, Recorded_Time
+from config import pin_configuration as pconf
+from dev_funcs import printline, Recorded_Time, datetime_to_epoch, epoch_to_datetime
+from json_stream import Json_Reader
+import cbor_stream
 
 
+#class with the server messages of a network interface, sent over self.http
+#shared by Dev_WiFi (an Http_Client over the wifi socket) and Dev_Cell (a Cell_Http_Client that
+#makes the requests through the modem), name is the interface printed when a message fails
+class Dev_Network:
+	def __init__(self, http, name):
+		self.http = http
+		self.name = name
+		#True if the server said it takes several answers in one reply post (see send_initial_post)
+		self.batch_replies = False
+		#buffer streamed json replies are parsed through (see Appointment_Reply)
+		self.json_buf = bytearray(commconf.HTTP_BUFFER_SIZE)
+		#Appointment_Reply of the last initial post (None if the reply was not json)
+		self.appointment_reply = None
+		#True once the server replied in the compact encoding (cbor), messages are then sent compact too
+		self.compact = False
+		#offer the compact encoding, a server that supports it replies with it
+		if commconf.COMPACT_ENCODING:
+			self.http.accept = CBOR_TYPE + ", " + JSON_TYPE
+
+	#function to send message to specified path of BASE_URL (over the kept open http connection)
+	#json is an object that is sent json encoded (or cbor encoded once the server replied in cbor),
+	#message is sent as is, the reply is decoded according to its content type
+	def send_message(self, method, path, message = None, json = None):
+		#makes request to given URL
+		printline(json)
+		message_type = JSON_TYPE
+		if json is not None:
+			if self.compact:
+				message = encode_compact(json)
+				message_type = CBOR_TYPE
+			else:
+				message = ujson.dumps(json)
+		try:
+			status, content_type, data = self.http.request(method, path, message, message_type)
+		#a compressed body that fails to decompress raises ValueError
+		except (OSError, ValueError):
+			self.http.close()
+			printline("failed message request (" + self.name + ")")
+			return "FAIL", None
+		return decode_reply(content_type, data)
+
+	#function to send initial message to server
+	#a json or cbor reply is decoded while it is read (see Appointment_Reply), appt_data is then a
+	#generator of Appointments that must be used up before the next message is sent
+	#the initial message is always json, a cbor reply switches the later messages to cbor
+	def send_initial_post(self, message_obj):
+		#post message to the server
+		printline(message_obj.get_json())
+		self.appointment_reply = None
+		try:
+			self.http.open("POST", commconf.INIT_MESSAGE_PATH, ujson.dumps(message_obj.get_json()))
+			#the encoding is settled by this reply, later replies come in the encoding of the request
+			self.http.accept = None
+			reader = None
+			if self.http.content_type.startswith(CBOR_TYPE):
+				self.compact = True
+				reader = cbor_stream.Cbor_Reader(self.http.body_stream(), self.json_buf, keys=WIRE_KEYS)
+			elif self.http.content_type.startswith(JSON_TYPE):
+				reader = Json_Reader(self.http.body_stream(), self.json_buf)
+			if reader is not None:
+				reply = Appointment_Reply(reader, self.http)
+				self.appointment_reply = reply
+				#check if the server takes batched answers
+				self.batch_replies = reply.batch_replies
+				return reply.server_date_time is not None, reply.server_date_time, reply.appointments()
+			#other replies are read whole
+			status, content_type, data = self.http.read_body()
+		except (OSError, ValueError):
+			self.http.close()
+			printline("failed message request (" + self.name + ")")
+			return False, "FAIL", None
+		#handle acquired data and check for validity
+		return handle_message_replies(*decode_reply(content_type, data))
+
+	#function to check if every appointment of the last initial post reply was read
+	#(call after appt_data is used up), the sync cursor can then be moved to the reply time
+	def sync_complete(self):
+		return self.appointment_reply is not None and self.appointment_reply.complete
+
+	#function to check if the last initial post reply listed every appointment the server has
+	#("full", not only the changes of a "delta" reply), stored appointments it did not list are gone
+	def sync_full(self):
+		return self.appointment_reply is not None and self.appointment_reply.sync != "delta"
+
+	#function to send appointment reply message to server
+	def send_appointment_reply_post(self, message_obj):
+		#path of appointment reply post location
+		url = commconf.REPLY_MESSAGE_PATH
+		#post message to the server, return type of message and reply
+		message_type, reply = self.send_message("POST", url, json=message_obj.get_json())
+		#handle acquired data and check for validity
+		success, reply, unused_var = handle_message_replies(message_type, reply)
+		#return result of handling
+		return success, reply
+
+	#function to send the answers of a message with several appointments
+	#answers go in batch posts (of at most REPLY_BATCH_SIZE) if the server advertised support for them,
+	#otherwise in one post each
+	#returns a list of [appointment_id, success], one per appointment in the message
+	def send_appointment_replies_post(self, message_obj):
+		results = []
+		if not self.batch_replies:
+			for single_message in message_obj.split(1):
+				success, reply = self.send_appointment_reply_post(single_message)
+				results.append([single_message.appointments[0].appointment_id, success])
+			return results
+		#path of appointment reply post location
+		url = commconf.REPLY_MESSAGE_PATH
+		for batch_message in message_obj.split(commconf.REPLY_BATCH_SIZE):
+			message_type, reply = self.send_message("POST", url, json=batch_message.get_json())
+			results += handle_batch_reply(message_type, reply, batch_message)
+		return results
+
 #class to handle wifi communications
-class Dev_WiFi:
-	def __init__(self, wifi_credentials):
+class Dev_WiFi(Dev_Network):
+	#last_network is the connected_network of an earlier wake (kept in the state cache, see file_funcs)
+	#network_stats is the connect history per ssid (FileIO.wifi_stats), used to rank scanned networks
+	def __init__(self, wifi_credentials, last_network=None, network_stats=None):
 		self.stored_networks = wifi_credentials
+		#stored passwords by ssid, so scan results are matched without a nested loop
+		self.passwords = {}
+		for stored_network in wifi_credentials:
+			self.passwords[stored_network["ssid"]] = stored_network["password"]
+		if network_stats is None:
+			network_stats = {}
+		self.network_stats = network_stats
+		#[ssid, connected, latency in ms] of every connect attempt, to be saved with FileIO.record_wifi_results
+		#a successful fast reconnect is not listed, it would cost a flash write on every wake
+		self.connect_results = []
 		self.websocket = None
 		self.wifi = None
 		self.timeout = 4000
+		#messages go over an http connection to BASE_URL, kept open for every message of the wake cycle
+		super().__init__(Http_Client(commconf.BASE_URL), "WIFI")
+		self.last_network = last_network
+		#network the device connected to (None until start_wifi succeeds)
+		#dict of ssid, bssid (hex string), channel and ifconfig (ip, subnet, gateway, dns)
+		self.connected_network = None
 
 	#function to start the wifi network in station mode
 	#use this function to send data to servers
@@ -26,77 +165,97 @@ class Dev_WiFi:
 		self.wifi = network.WLAN(network.STA_IF)
 		#set wifi network to active
 		self.wifi.active(True)
-		#scan for local networks
-		scanned_networks = self.wifi.scan()
-		#move through scanned_networks and stored_networks, looking for a
-		#local SSID to match one of the saved network entries
-		for scanned_network in scanned_networks:
+		#try the network from the last wake first, without a scan
+		if self.fast_connect():
+			printline("fast reconnect to " + self.connected_network["ssid"])
+			return True
+		#scan for local networks, try the stored ones best first
+		for ssid, scanned_network in self.rank_networks(self.wifi.scan()):
 			printline(scanned_network)
-			for stored_network in self.stored_networks:
-				#print(stored_network)
-				#if the network SSIDs match
-				if stored_network["ssid"] == scanned_network[0].decode("UTF-8"):
-					#connect to the local network
-					self.wifi.connect(stored_network["ssid"], stored_network["password"])
-					#set initial time we started waiting for network to connect
-					init_time = ticks_ms()
-					#wait until network is successfully connected or until timeout reached
-					while not self.wifi.isconnected() and (ticks_diff(ticks_ms(),init_time) < self.timeout):
-						pass
-					#check if connected to the network
-					if self.wifi.isconnected():
-						#if connected, return true and exit
-						return True
-		#reset wifi var to none state since the network connection failed
-		self.wifi = None
+			#connect to the local network
+			init_time = ticks_ms()
+			self.wifi.connect(ssid, self.passwords[ssid])
+			#check if connected to the network
+			connected = self.wait_for_connection(self.timeout)
+			self.connect_results.append([ssid, connected, ticks_diff(ticks_ms(), init_time)])
+			if connected:
+				#if connected, remember the access point and lease, return true and exit
+				self.connected_network = 	{
+												"ssid": ssid,
+												"bssid": ubinascii.hexlify(scanned_network[1]).decode(),
+												"channel": scanned_network[2],
+												"ifconfig": list(self.wifi.ifconfig())
+											}
+				#a restart later in this wake (see Radio_Manager) reconnects without a scan
+				self.last_network = self.connected_network
+				return True
+		#power the radio down since the network connection failed
+		self.stop_wifi()
 		#return false, indicating a failed connection to wifi
 		return False
 
-	#function to send message to specified URL
-	#message should be a JSON string
-	def send_message(self, method, url, message = None, json = None):
-		#makes request to given URL
-		printline(json)
-		try:
-			data = urequests.request(method, url, data=message, json=json)
-		except:
-			printline("failed message request (WIFI)")
-			return "FAIL", None
-		#try to return json data, if no json exists then continue
+	#function to pick the stored networks out of scan results and order them best first
+	#returns a list of [ssid, scan result], one per ssid (its strongest access point)
+	#networks are scored by signal strength (rssi, dBm), plus a bonus for the share of past
+	#connects that worked and a penalty for slow past connects (see communication_configuration)
+	def rank_networks(self, scanned_networks):
+		best = {}
+		for scanned_network in scanned_networks:
+			ssid = scanned_network[0].decode("UTF-8")
+			if ssid in self.passwords and (ssid not in best or scanned_network[3] > best[ssid][3]):
+				best[ssid] = scanned_network
+		ranked = []
+		for ssid in best:
+			stats = self.network_stats.get(ssid, {"ok": 0, "fail": 0, "latency": 0})
+			#unknown networks start at a 50% success rate
+			success_rate = (stats["ok"] + 1) / (stats["ok"] + stats["fail"] + 2)
+			score = best[ssid][3] + commconf.WIFI_RANK_SUCCESS_WEIGHT*success_rate - stats["latency"]/commconf.WIFI_RANK_LATENCY_SCALE
+			ranked.append([score, ssid])
+		ranked.sort(reverse=True)
+		return [[ssid, best[ssid]] for score, ssid in ranked]
+
+	#function to connect straight to the access point of last_network, reusing its ip lease
+	#returns False (and undoes the static ip) if there is no last network or it does not connect
+	def fast_connect(self):
+		net = self.last_network
+		if not isinstance(net, dict) or not commconf.WIFI_FAST_CONNECT:
+			return False
+		#the password is taken from the stored networks, so a removed network is not used
+		password = self.passwords.get(net["ssid"])
+		if password is None:
+			return False
+		#reuse the lease so dhcp is skipped
+		self.wifi.ifconfig(tuple(net["ifconfig"]))
+		#not every firmware lets the station channel be set, the bssid alone still skips the scan
 		try:
-			return "JSON", data.json()
-		except:
-			#try to return text data, if it doesnt exist continue
-			try:
-				return "TEXT", data.text
-			except:
-				#try to return content data, if it doesnt exist, return None
-				try:
-					return "RAW", data.content
-				except:
-					return "FAIL", None
+			self.wifi.config(channel=net["channel"])
+		except (ValueError, OSError):
+			pass
+		init_time = ticks_ms()
+		self.wifi.connect(net["ssid"], password, bssid=ubinascii.unhexlify(net["bssid"]))
+		if self.wait_for_connection(commconf.WIFI_FAST_CONNECT_TIMEOUT):
+			self.connected_network = net
+			return True
+		printline("fast reconnect failed, scanning")
+		self.connect_results.append([net["ssid"], False, ticks_diff(ticks_ms(), init_time)])
+		self.wifi.disconnect()
+		#go back to dhcp for the networks found by the scan
+		self.wifi.ifconfig('dhcp')
+		return False
 
-	#function to send initial message to server
-	def send_initial_post(self, message_obj):
-		#assemble url for initial post location
-		url = commconf.BASE_URL + commconf.INIT_MESSAGE_PATH
-		#post message to the server, return type of message and reply
-		message_type, reply = self.send_message("POST", url, json=message_obj.get_json())
-		#handle acquired data and check for validity
-		success, datetime, appt_data = handle_message_replies(message_type, reply)
-		#return result of handling
-		return success, datetime, appt_data
+	#function to wait until the network is connected or the timeout (ms) is reached
+	#returns True if connected
+	def wait_for_connection(self, timeout):
+		return wait_until(self.wifi.isconnected, timeout)
 
-	#function to send appointment reply message to server
-	def send_appointment_reply_post(self, message_obj):
-		#assemble url for appointment reply post location
-		url = commconf.BASE_URL + commconf.REPLY_MESSAGE_PATH
-		#post message to the server, return type of message and reply
-		message_type, reply = self.send_message("POST", url, json=message_obj.get_json())
-		#handle acquired data and check for validity
-		success, reply, unused_var = handle_message_replies(message_type, reply)
-		#return result of handling
-		return success, reply
+	#function to disconnect and power down the wifi radio
+	def stop_wifi(self):
+		#the connection does not survive the radio going down
+		self.http.close()
+		if self.wifi is not None:
+			self.wifi.disconnect()
+			self.wifi.active(False)
+			self.wifi = None
 
 	#function to start ESP32 access point
 	#allows the ESP32 to be accessed by logging into the wifi
@@ -113,13 +272,9 @@ class Dev_WiFi:
 			constructed_ssid += "-" + str(dev_id)
 		#configure access point with SSID and password defined in config
 		self.wifi.config(essid=constructed_ssid, password=commconf.AP_PASSWORD)
-		#set initial time we started waiting for network to start
-		init_time = ticks_ms()
 		#wait until network is successfully started or until timeout reached
-		while not self.wifi.active() and (ticks_diff(ticks_ms(),init_time) < self.timeout):
-			pass
 		#check that ap mode is actually working
-		if self.wifi.active():
+		if wait_until(self.wifi.active, self.timeout):
 			#print debug info
 			printline(self.wifi.ifconfig())
 			#start socket server
@@ -137,121 +292,338 @@ class Dev_WiFi:
 			#otherwise return false
 			return False
 
-	#function to handle webserver traffic
-	#should be run in a loop as this function is non blocking
-	def listen_serve_webserver(self, file_io_inst=None):
-		#from file_funcs import FileIO
-		#check if file_io instance is real
-		if not isinstance(file_io_inst, FileIO):
-			#if its not real, create a new file_io instance (necessary to return device info)
-			file_io_inst = FileIO()
-
-		#array to store data returned by HTML forms
-		return_data = []
-		#accept websocket connection, get connection object and address
-		conn, addr = self.websocket.accept()
-		printline("Got a connection from " + str(addr))
-		#receive 1024 bytes of data sent to server (content request)
-		request = conn.recv(1024)
-		#turn received data into a string
-		request = str(request)
-		#print request data
-  		printline("Content = %s" % request)
-  		#form an empty response
-  		response = ""
-
-  		#begin to search for keywords indicating the url path being requested
-  		#most of the paths will be within 0 to 21 characters of the start of string
-  		#if path is /favicon.ico 	(serves browser icon)
-  		if 21 > request.find("/favicon.ico") > 0:
-  			printline("favicon served : " + str(request.find("/favicon.ico")))
-  			#open favicon.ico file
-  			favi_file = open("favicon.ico", 'r')
-  			#read in data from file and update response
-  			response = favi_file.read()
-
-  		#if path is /config/	(serves config form to update system variables)
-  		elif 21 > request.find("/config/") > 0:
-  			printline("config served : " + str(request.find("/config/")))
-			#craft response to send to client
-			response = "<html>" + self.head_html() + self.config_html(file_io_inst) + "</html>"
+	#function to stop the access point and close the portal socket made by start_ap
+	def stop_ap(self):
+		if self.websocket is not None:
+			self.websocket.close()
+			self.websocket = None
+		if self.wifi is not None:
+			self.wifi.active(False)
+			self.wifi = None
+
+#class for the configuration portal served in access point mode, on the socket made by Dev_WiFi.start_ap
+#connections are served concurrently on uasyncio: the listening socket is polled for new
+#connections and each one is handled in its own task, so a phone that opens several connections
+#at once (page, favicon, prefetch) does not hold up the others
+#each connection has AP_CONNECTION_TIMEOUT seconds and is parsed as it arrives in bounded buffers
+#(see Http_Request), at most AP_MAX_CONNECTIONS are served at once (more are closed right away)
+#settings posted to /handle_config/ are saved with file_io_inst
+class Ap_Server:
+	def __init__(self, listen_socket, file_io_inst):
+		self.sock = listen_socket
+		#accept() returns right away so waiting for connections does not block the event loop
+		self.sock.setblocking(False)
+		self.file_io = file_io_inst
+		#number of connections being served
+		self.connections = 0
+		#True while the portal runs, cleared when it stops (select button or idle timeout)
+		self.running = False
+		#ticks_ms of the last connection, the portal stops after AP_IDLE_TIMEOUT without one
+		self.last_request = ticks_ms()
+		#buffer static files are read into, shared by all connections (see Static_File)
+		self.file_buf = bytearray(commconf.AP_WRITE_SIZE)
 
-		#if path is /handle_config/	(handles data from config form)
-		elif 21 > request.find("/handle_config/") > 0:
-  			printline("handle_config served : " + str(request.find("/handle_config/")))
-  			#get ssid value data from key in request string
-  			new_ssid = self.get_var_from_string(request, 'ssid')
-  			#if variable is now populated
-  			if new_ssid != "":
-  				#append this data to "return data" array
-				return_data.append({"network_ssid": new_ssid})
-			#get password value data from key in request string
-  			new_password = self.get_var_from_string(request, 'password')
-  			#if variable is now populated
-  			if new_password != "":
-  				#append this data to "return data" array
-				return_data.append({"network_password": new_password})
-			#get start quiet hour value data from key in request string
-  			new_start_quiet = self.get_var_from_string(request, 'start_quiet')
-  			#if variable is now populated
-  			if new_start_quiet != "":
-  				#append this data to "return data" array
-				return_data.append({"quiet_hour_start": new_start_quiet})
-			#get end quiet hour value data from key in request string
-  			new_end_quiet = self.get_var_from_string(request, 'end_quiet')
-  			#if variable is now populated
-  			if new_end_quiet != "":
-  				#append this data to "return data" array
-				return_data.append({"quiet_hour_end": new_end_quiet})
-
-			#craft response to send to client
-			response = "<html>" + self.head_html() + \
-			self.config_html(file_io_inst, "<h2>Your settings have been updated</h2>") + "</html>"
-
-		#if no path, serve index response
+	#function to run the portal until the select button is pressed or it is idle for AP_IDLE_TIMEOUT
+	#run with uasyncio.run(), display and buttons (optional) show the portal state and let the
+	#user stop it while connections are served
+	async def run(self, display=None, buttons=None):
+		self.running = True
+		self.last_request = ticks_ms()
+		tasks = [uasyncio.create_task(self.serve())]
+		if display is not None and buttons is not None:
+			tasks.append(uasyncio.create_task(self.watch_device(display, buttons)))
+		while self.running:
+			if ticks_diff(ticks_ms(), self.last_request) > commconf.AP_IDLE_TIMEOUT*1000:
+				printline("portal idle, stopping")
+				self.running = False
+			await uasyncio.sleep_ms(commconf.AP_POLL_INTERVAL)
+		for task in tasks:
+			task.cancel()
+
+	#function to accept connections and start a task for each one
+	async def serve(self):
+		while self.running:
+			try:
+				conn, addr = self.sock.accept()
+			except OSError:
+				#no connection waiting
+				await uasyncio.sleep_ms(commconf.AP_POLL_INTERVAL)
+				continue
+			printline("Got a connection from " + str(addr))
+			self.last_request = ticks_ms()
+			if self.connections >= commconf.AP_MAX_CONNECTIONS:
+				printline("portal busy, connection closed")
+				conn.close()
+				continue
+			self.connections += 1
+			uasyncio.create_task(self.handle(conn, addr))
+
+	#function to serve one connection, it is closed when the response is sent or it times out
+	async def handle(self, conn, addr):
+		conn.setblocking(False)
+		stream = uasyncio.StreamReader(conn)
+		try:
+			await uasyncio.wait_for(self.respond(stream), commconf.AP_CONNECTION_TIMEOUT)
+		except uasyncio.TimeoutError:
+			printline("portal connection timed out: " + str(addr))
+		except OSError as e:
+			printline("portal connection failed: " + str(e))
+		finally:
+			stream.close()
+			try:
+				await stream.wait_closed()
+			except OSError:
+				pass
+			self.connections -= 1
+
+	#function to read a request and send the response
+	async def respond(self, stream):
+		request = await self.read_request(stream)
+		if request is None:
+			return
+		printline(request.method + " " + request.path)
+		if request.status:
+			#the request could not be parsed, reply with the error
+			await self.send_response(stream, request, request.status, "text/plain", "no-store", STATUS_TEXT[request.status])
 		else:
-			#craft response to send to client
-			response = "<html>" + self.head_html() + self.index_html() + "</html>"
+			content_type, cache_control, body = self.route(request)
+			await self.send_response(stream, request, 200, content_type, cache_control, body)
 
+	#function to send a response, body is a Page, a Static_File or a str/bytes
+	#a Page or Static_File is sent with an ETag, and only the headers (304) if the browser has
+	#that version already
+	async def send_response(self, stream, request, status, content_type, cache_control, body):
+		etag = None
+		if isinstance(body, (str, bytes)):
+			size = len(body)
+		else:
+			#the size of a page is only known once it is sent, the connection close ends it
+			size = body.size
+			etag = body.etag()
+			if request.headers.get("if-none-match", "").find(etag) >= 0:
+				status = 304
+		head = "HTTP/1.1 " + str(status) + " " + STATUS_TEXT[status] + "\r\nCache-Control: " + cache_control
+		if etag is not None:
+			head += "\r\nETag: " + etag
+		if status != 304:
+			head += "\r\nContent-Type: " + content_type
+			if size is not None:
+				head += "\r\nContent-Length: " + str(size)
 		#send header data to client
-		conn.send("HTTP/1.1 200 OK\n")
-		conn.send("Content-Type: text/html\n")
-		conn.send("Connection: close\n\n")
+		stream.write((head + "\r\nConnection: close\r\n\r\n").encode())
+		await stream.drain()
+		if status == 304:
+			return
 		#send defined response to client
-		conn.sendall(response)
-		#close socket connection
-		conn.close()
-		#check if data in return array
-		if len(return_data) > 0:
-			#return populated array
-			return return_data
+		if isinstance(body, (str, bytes)):
+			await write_chunks(stream, body)
 		else:
-			#otherwise return nothing
+			await body.send(stream)
+
+	#function to read a request, fed to an Http_Request as each read arrives (AP_READ_SIZE at most)
+	#returns the Http_Request (its status is set if it is malformed or too large), None if the
+	#client closed the connection without sending anything
+	async def read_request(self, stream):
+		request = Http_Request()
+		received = False
+		while not request.done:
+			data = await stream.read(commconf.AP_READ_SIZE)
+			if not data:
+				if not received:
+					return None
+				#connection closed part way through the request
+				request.fail(400)
+				break
+			received = True
+			request.feed(data)
+		return request
+
+	#function to make the response to a parsed request
+	#returns the content type, Cache-Control and body, settings sent with the config form are saved
+	def route(self, request):
+		#files in AP_STATIC_DIR (favicon.ico and other assets) are served by name
+		static_file = Static_File.find(request.path, self.file_buf)
+		if static_file is not None:
+			printline("static file served")
+			return static_file.content_type, "max-age=" + str(commconf.AP_STATIC_MAX_AGE), static_file
+
+		#if path is /config/	(serves config form to update system variables)
+		#the stored data can change, so the browser checks its copy every time (ETag)
+		if request.path == "/config/":
+			printline("config served")
+			return "text/html", "no-cache", self.config_page()
+
+		#if path is /handle_config/	(handles data from config form)
+		if request.path == "/handle_config/":
+			printline("handle_config served")
+			#keep the config form fields that were filled in
+			return_data = {}
+			for name in ("ssid", "password", "start_quiet", "end_quiet"):
+				if request.form.get(name):
+					return_data[name] = request.form[name]
+			self.save_config(return_data)
+			return "text/html", "no-store", self.config_page("<h2>Your settings have been updated</h2>")
+
+		#if no path, serve index response (static, kept by the browser for an hour)
+		return "text/html", "max-age=3600", Page(INDEX_TEMPLATE)
+
+	#function to make the config page with the stored networks and quiet hours
+	#message is html shown at the top of the page
+	def config_page(self, message=""):
+		networks = []
+		for network in self.file_io.wifi_networks:
+			networks.append("<p>- " + html_escape(network["ssid"]) + "</p><br>")
+		quiet_hours = self.file_io.quiet_hours
+		return Page(CONFIG_TEMPLATE, 	{
+											"message": [message],
+											"networks": networks,
+											"quiet_start": [html_escape(str(quiet_hours["start_time"]))],
+											"quiet_end": [html_escape(str(quiet_hours["end_time"]))]
+										})
+
+	#function to save the settings sent with the config form
+	#a network is added when it has an ssid, quiet hours are changed when both hours are sent
+	def save_config(self, return_data):
+		with self.file_io.transaction():
+			if "ssid" in return_data:
+				self.file_io.add_wifi_network(return_data["ssid"], return_data.get("password", ""))
+			if "start_quiet" in return_data and "end_quiet" in return_data:
+				self.file_io.update_quiet_hours(return_data["start_quiet"], return_data["end_quiet"])
+
+	#function to keep the display and buttons working while the portal runs
+	#shows the number of open connections, the select button stops the portal
+	async def watch_device(self, display, buttons):
+		shown = -1
+		while self.running:
+			if buttons.read_buttons()["select"]:
+				printline("portal stopped with select button")
+				self.running = False
+			elif shown != self.connections:
+				shown = self.connections
+				display.clear(False)
+				display.print_text("Access Point Mode \n \n Connect to the device wifi, navigate to 192.168.4.1 \n \n Clients: " + \
+					str(shown) + " \n Select: exit", True, 0)
+			await uasyncio.sleep_ms(commconf.AP_POLL_INTERVAL)
+
+#class for a portal page, a template filled in with field values while it is sent
+#template is a tuple of static parts (bytes) and field names (str), fields is a dict of field
+#name to a list of html strings (text from the user must go through html_escape)
+#the static parts are module constants, made once (kept in flash when comms is frozen) and
+#sent in chunks of AP_WRITE_SIZE, so sending a page takes the same memory whatever its size
+class Page:
+	#the size of a page is not worked out before it is sent
+	size = None
+
+	def __init__(self, template, fields=None):
+		self.template = template
+		if fields is None:
+			fields = {}
+		self.fields = fields
+
+	#function to get the ETag of the page, the crc32 of its template and field values
+	def etag(self):
+		crc = 0
+		for part in self.template:
+			if isinstance(part, str):
+				for value in self.fields[part]:
+					crc = ubinascii.crc32(value.encode(), crc)
+			else:
+				crc = ubinascii.crc32(part, crc)
+		return '"' + "%08x" % (crc & 0xFFFFFFFF) + '"'
+
+	#function to send the page to a uasyncio stream
+	async def send(self, stream):
+		for part in self.template:
+			if isinstance(part, str):
+				for value in self.fields[part]:
+					stream.write(value.encode())
+					await stream.drain()
+			else:
+				await write_chunks(stream, part)
+
+#class for a file in AP_STATIC_DIR sent by the portal, read in binary through a buffer of
+#AP_WRITE_SIZE so a file of any size is sent without holding it in memory
+#the buffer is shared by all connections: each chunk is read into it and written to the stream
+#(which copies it) with no await in between, so no other task uses it part way through a chunk
+class Static_File:
+	def __init__(self, path, size, mtime, content_type, buf):
+		self.path = path
+		self.size = size
+		self.mtime = mtime
+		self.content_type = content_type
+		self.buf = buf
+
+	#function to get the Static_File for a request path, None if it is not a file in AP_STATIC_DIR
+	#only names straight in the directory with a type in STATIC_TYPES are served
+	@staticmethod
+	def find(request_path, buf):
+		name = request_path[1:]
+		if not name or "/" in name or name[0] == ".":
+			return None
+		dot = name.rfind(".")
+		if dot < 0:
+			return None
+		content_type = STATIC_TYPES.get(name[dot+1:].lower())
+		if content_type is None:
+			return None
+		path = commconf.AP_STATIC_DIR + "/" + name
+		try:
+			stat = uos.stat(path)
+		except OSError:
 			return None
+		#directories are not files
+		if stat[0] & 0x4000:
+			return None
+		return Static_File(path, stat[6], stat[8], content_type, buf)
+
+	#function to get the ETag of the file, its size and modification time
+	def etag(self):
+		return '"' + "%x-%x" % (self.size, self.mtime) + '"'
+
+	#function to send the file to a uasyncio stream
+	async def send(self, stream):
+		view = memoryview(self.buf)
+		with open(self.path, 'rb') as file:
+			while True:
+				count = file.readinto(self.buf)
+				if not count:
+					break
+				stream.write(view[:count])
+				await stream.drain()
 
-	#function to generate header html
-	def head_html(self):
-		return """
+#function to write data (str or bytes) to a uasyncio stream in chunks of AP_WRITE_SIZE
+async def write_chunks(stream, data):
+	if isinstance(data, str):
+		data = data.encode()
+	view = memoryview(data)
+	for i in range(0, len(data), commconf.AP_WRITE_SIZE):
+		stream.write(view[i:i+commconf.AP_WRITE_SIZE])
+		await stream.drain()
+
+#function to escape text for html (stored ssids and settings shown on portal pages)
+def html_escape(text):
+	return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+#portal page templates (see Page)
+PAGE_HEAD = b"""<html>
 				<head>
 					<meta name="viewport" content="width=device-width, initial-scale=1">
 				</head>
 			"""
 
-	#function to generate body html
-	def config_html(self, file_io_inst, extra_text=""):
-		wifi_networks = ""
-		for network in file_io_inst.wifi_networks:
-			wifi_networks += "<p>- " + network["ssid"] + "</p><br>"
-		quiet_hours = "<p>Quiet hours set from " + file_io_inst.quiet_hours["start_time"] + ":00 to " +\
-					file_io_inst.quiet_hours["end_time"] + ":00 hours</p><br>"
-		content = """
+INDEX_TEMPLATE = (PAGE_HEAD, b"""
+			<body>
+				<h1>Welcome to the DoccoLink Device Configuration</h1>
+				<p>If you can see this, you are in the DoccoLink Device WebServer.</p>
+				<a href="/config/">Click here to go to the configuration page</a>
+			</body>
+			</html>""")
+
+CONFIG_TEMPLATE = (PAGE_HEAD, b"""
 				<body>
-				"""
-		content += "<h3>"+extra_text+"</h3><br>" + \
-				"<h2>Current Stored Data</h2><hr><br>" + \
-				"<h3>Stored WiFi Networks</h3><br>" + wifi_networks + \
-				"<h3>Current Stored Data</h3><br>" + quiet_hours + "<hr>"\
-			"""
+				<h3>""", "message", b"""</h3><br><h2>Current Stored Data</h2><hr><br><h3>Stored WiFi Networks</h3><br>""",
+			"networks", b"""<h3>Current Stored Data</h3><br><p>Quiet hours set from """, "quiet_start", b""":00 to """,
+			"quiet_end", b""":00 hours</p><br><hr>
 					<form action="/handle_config/" method="post">
 						<h3>Network credential to add</h3>
 						<p>Add new network credentials here</p>
@@ -268,35 +640,206 @@ class Dev_WiFi:
 						<input type="submit" value="Submit">
 					</form>
 				</body>
-			"""
-		return content
+			</html>""")
 
-	#function to generate body html
-	def index_html(self):
-		return """
-			<body>
-				<h1>Welcome to the DoccoLink Device Configuration</h1>
-				<p>If you can see this, you are in the DoccoLink Device WebServer.</p>
-				<a href="/config/">Click here to go to the configuration page</a>
-			</body>
-			"""
+#reason phrases of the status codes the portal replies with
+STATUS_TEXT = 	{
+					200: "OK",
+					304: "Not Modified",
+					400: "Bad Request",
+					413: "Payload Too Large",
+					414: "URI Too Long"
+				}
+#content types of the static files the portal serves (by file extension)
+STATIC_TYPES = 	{
+					"ico": "image/x-icon",
+					"png": "image/png",
+					"jpg": "image/jpeg",
+					"svg": "image/svg+xml",
+					"css": "text/css",
+					"js": "application/javascript",
+					"html": "text/html",
+					"txt": "text/plain"
+				}
+#request headers an Http_Request keeps (lower case), the others are skipped
+KEPT_HEADERS = (b"content-length", b"content-type", b"if-none-match")
+#Http_Request parser states
+REQUEST_LINE = const(0)
+REQUEST_HEADERS = const(1)
+REQUEST_BODY = const(2)
 
-	#function to find the value in a key/value pair (formatted like name=val&2ndname=val2)
-	#takes an input string that will be searched for a keyword desired_var
-	def get_var_from_string(self, inp_string, desired_var):
-		var_loc = inp_string.find(desired_var)
-		if var_loc >= 0:
-			#offset for 'name=' characters
-			var_loc += len(desired_var)+1
-			new_value = ""
-			while var_loc+1 < len(inp_string):
-				if inp_string[var_loc] == '&':
-					break
-				new_value += inp_string[var_loc]
-				var_loc += 1
-			return new_value
+#class to parse a portal request as it arrives, feed() takes the bytes of each read in turn
+#lines are collected in a buffer of AP_LINE_SIZE bytes (longer header lines are cut off) and the
+#body in one of Content-Length bytes (at most AP_BODY_SIZE), nothing else is kept
+#once done is True, method, path, headers (KEPT_HEADERS) and form (fields of the query string and of
+#an application/x-www-form-urlencoded body, percent decoded) are set, status is 0 or the
+#error status to reply with
+class Http_Request:
+	def __init__(self):
+		self.method = ""
+		self.path = ""
+		self.headers = {}
+		self.form = {}
+		self.status = 0
+		self.done = False
+		self.state = REQUEST_LINE
+		#line being read (line_length can pass the buffer size, the rest is not kept)
+		self.line = bytearray(commconf.AP_LINE_SIZE)
+		self.line_length = 0
+		#query string of the request target
+		self.query = b""
+		#body buffer (made once Content-Length is known) and number of body bytes read
+		self.body = None
+		self.body_length = 0
+
+	#function to parse the next bytes of the request, stops once the request is done
+	def feed(self, data):
+		try:
+			i = 0
+			while i < len(data) and not self.done:
+				if self.state == REQUEST_BODY:
+					#copy as much of the body as this read holds
+					count = min(len(data) - i, len(self.body) - self.body_length)
+					self.body[self.body_length:self.body_length+count] = data[i:i+count]
+					self.body_length += count
+					i += count
+					if self.body_length == len(self.body):
+						self.finish()
+					continue
+				#copy up to the end of the line (or of the data) into the line buffer
+				end = data.find(b"\n", i)
+				stop = len(data) if end < 0 else end
+				count = min(stop - i, len(self.line) - self.line_length)
+				if count > 0:
+					self.line[self.line_length:self.line_length+count] = data[i:i+count]
+				self.line_length += stop - i
+				i = stop
+				if end >= 0:
+					i += 1
+					self.end_line()
+		except ValueError:
+			#the request line, a kept header or a form field is not utf-8 (also once percent decoded)
+			self.fail(400)
+
+	#function to handle a complete line in the line buffer
+	def end_line(self):
+		length = self.line_length
+		self.line_length = 0
+		if length > len(self.line):
+			#the request line must fit, header lines are cut off
+			if self.state == REQUEST_LINE:
+				self.fail(414)
+				return
+			length = len(self.line)
+		if length and self.line[length-1] == 0x0D:
+			length -= 1
+		line = bytes(self.line[:length])
+		if self.state == REQUEST_LINE:
+			#empty lines before the request line are allowed
+			if length:
+				self.parse_request_line(line)
+		elif length == 0:
+			#an empty line ends the headers
+			self.start_body()
 		else:
-			return None
+			colon = line.find(b":")
+			name = line[:colon].strip().lower()
+			if colon > 0 and name in KEPT_HEADERS:
+				self.headers[str(name, 'utf-8')] = str(line[colon+1:].strip(), 'utf-8')
+
+	#function to parse the request line (METHOD target HTTP/1.1)
+	def parse_request_line(self, line):
+		parts = line.split(b" ")
+		if len(parts) != 3:
+			self.fail(400)
+			return
+		self.method = str(parts[0], 'utf-8')
+		target = parts[1]
+		split = target.find(b"?")
+		if split >= 0:
+			self.query = target[split+1:]
+			target = target[:split]
+		self.path = url_decode(target, False)
+		self.state = REQUEST_HEADERS
+
+	#function to prepare the body buffer after the headers, the request is done if there is no body
+	def start_body(self):
+		try:
+			length = int(self.headers.get("content-length", "0"))
+		except ValueError:
+			self.fail(400)
+			return
+		if length < 0:
+			self.fail(400)
+		elif length > commconf.AP_BODY_SIZE:
+			self.fail(413)
+		elif length == 0:
+			self.finish()
+		else:
+			self.body = bytearray(length)
+			self.state = REQUEST_BODY
+
+	#function to end the request, parses the form fields of the query string and body
+	def finish(self):
+		if self.query:
+			self.form = parse_form(self.query)
+		if self.body is not None and self.headers.get("content-type", "").startswith("application/x-www-form-urlencoded"):
+			self.form.update(parse_form(self.body))
+		self.done = True
+
+	#function to end the request with an error status
+	def fail(self, status):
+		self.status = status
+		self.done = True
+
+#function to split form data (name=value&name2=value2) into a dict of percent decoded strings
+#done in one pass over the data, a name without '=' gets an empty value, the last of repeated names is kept
+def parse_form(data):
+	form = {}
+	start = 0
+	while start <= len(data):
+		end = data.find(b"&", start)
+		if end < 0:
+			end = len(data)
+		split = data.find(b"=", start, end)
+		if split < 0:
+			split = end
+		if split > start:
+			form[url_decode(data[start:split], True)] = url_decode(data[split+1:end], True)
+		start = end + 1
+	return form
+
+#function to percent decode part of a url or form (bytes), returns a string
+#plus is True for form data, where '+' stands for a space, bad escapes are kept as they are
+#raises a ValueError (UnicodeError) if the decoded bytes are not utf-8
+def url_decode(data, plus):
+	if data.find(b"%") < 0 and not (plus and data.find(b"+") >= 0):
+		return str(data, 'utf-8')
+	out = bytearray()
+	i = 0
+	while i < len(data):
+		byte = data[i]
+		if byte == 0x25 and i + 2 < len(data):
+			high = hex_value(data[i+1])
+			low = hex_value(data[i+2])
+			if high >= 0 and low >= 0:
+				out.append(high*16 + low)
+				i += 3
+				continue
+		if byte == 0x2B and plus:
+			byte = 0x20
+		out.append(byte)
+		i += 1
+	return str(out, 'utf-8')
+
+#function to get the value of a hex digit (a byte), -1 if it is not one
+def hex_value(byte):
+	if 0x30 <= byte <= 0x39:
+		return byte - 0x30
+	byte |= 0x20
+	if 0x61 <= byte <= 0x66:
+		return byte - 0x57
+	return -1
 
 #class to handle blutooth communications
 #was not implemented to save time
@@ -304,26 +847,966 @@ class Dev_Blutooth:
 	def __init__():
 		return None
 
-#class to handle cellular communications
-class Dev_Cell:
-	def __init__(self):
-		return None
+#class to handle cellular communications, through the modem on the CELL_TX/CELL_RX uart
+#start_cellular wakes the modem, makes sure it is registered on the network and opens the data
+#bearer, messages are then sent with the modem's http commands (see Cell_Http_Client)
+#in PSM (power saving mode) the modem keeps its registration and bearer while the device sleeps,
+#so a start after a wake is a few AT commands, the network is only searched again if it dropped
+#the modem, starting with the operator of the last registration (last_cell, from the state cache)
+#last_cell is False if no modem answered on an earlier wake (modem_missing), the modem is then
+#not woken again, so a device without a modem only waits for it once (until the cache is reset)
+#uart and wake_pin are made from pin_configuration when not given (a simulated modem can be passed)
+class Dev_Cell(Dev_Network):
+	def __init__(self, last_cell=None, uart=None, wake_pin=None):
+		#At_Modem on the modem uart (None if the cellular modem is not used)
+		self.modem = None
+		#True once the modem did not answer after the wake pulse (saved with FileIO.set_last_cell)
+		self.modem_missing = last_cell is False
+		if self.modem_missing:
+			last_cell = None
+		elif commconf.CELL_ENABLED:
+			if uart is None:
+				uart = UART(commconf.CELL_UART, commconf.CELL_BAUDRATE, tx=pconf.CELL_TX, rx=pconf.CELL_RX, timeout=0)
+			if wake_pin is None:
+				wake_pin = Pin(pconf.CELL_WAKE, Pin.OUT, value=0)
+			self.modem = At_Modem(uart)
+			self.modem.on_urc("+CEREG", self.handle_registration)
+		self.wake_pin = wake_pin
+		super().__init__(Cell_Http_Client(self.modem, commconf.BASE_URL), "CELL")
+		#operator the modem is registered on, dict of plmn (mcc and mnc) and act (access technology)
+		#saved with FileIO.set_last_cell once start_cellular succeeds
+		self.registered_network = last_cell
+		#registration status of the last +CEREG (1 registered home, 3 denied, 5 registered roaming)
+		self.registration = 0
+		#True while the modem is on (it answered AT), and once start_cellular opened the data bearer
+		#(only an attached modem is left to sleep in PSM, see stop_cellular)
+		self.powered = False
+		self.attached = False
 
+	#function to start the modem and connect to the cellular network, returns True once the
+	#data bearer is open, the modem is powered down again if it can not connect
 	def start_cellular(self):
-		return False
+		if self.modem is None:
+			return False
+		try:
+			self.wake()
+			#no echo, numbered errors, registration changes reported as +CEREG urcs
+			self.modem.pipeline(("E0", "+CMEE=1", "+CEREG=1"))
+			#a missing or locked sim can not register
+			if "+CPIN: READY" not in self.modem.command("+CPIN?"):
+				raise OSError("sim not ready")
+			self.handle_registration(find_answer(self.modem.command("+CEREG?"), "+CEREG"))
+			if not self.is_registered():
+				self.register()
+			if self.registered_network is None:
+				self.registered_network = self.read_operator()
+			self.open_bearer()
+		except (OSError, ValueError, IndexError) as e:
+			printline("cellular start failed: " + str(e))
+			self.power_down()
+			return False
+		self.attached = True
+		return True
+
+	#function to end the modem's http session, in PSM an attached modem stays registered and goes to
+	#sleep on its own (after CELL_PSM_ACTIVE), otherwise it is powered down
+	def stop_cellular(self):
+		if self.modem is None or not self.powered:
+			return
+		self.http.close()
+		if not commconf.CELL_PSM or not self.attached:
+			self.power_down()
+
+	#function to power the modem off (does nothing if it is off)
+	def power_down(self):
+		if self.powered:
+			#answered with NORMAL POWER DOWN rather than OK, so the answer is not waited for
+			self.modem.send("+CPOWD=1")
+			self.powered = False
+			self.attached = False
+
+	#function to make sure the modem answers, it is powered on or woken from PSM with a pulse on the
+	#wake pin (PWRKEY) if it does not
+	def wake(self):
+		if not self.modem.ping():
+			self.wake_pin.value(1)
+			sleep_ms(commconf.CELL_WAKE_PULSE)
+			self.wake_pin.value(0)
+			if not wait_until(self.modem.ping, commconf.CELL_BOOT_TIMEOUT):
+				self.modem_missing = True
+				raise OSError("modem not answering")
+		self.powered = True
+
+	#function to register on the network, with the operator of the last registration if it is known
+	#the power saving timers are set first, the network grants them when the modem attaches
+	def register(self):
+		commands = [power_saving_command(), edrx_command()]
+		if self.registered_network is not None:
+			#manual selection falls back to automatic (mode 4) if the operator is not found
+			commands.append('+COPS=4,2,"' + self.registered_network["plmn"] + '",' + str(self.registered_network["act"]))
+		else:
+			commands.append("+COPS=0")
+		self.modem.pipeline(commands, commconf.CELL_REGISTER_TIMEOUT)
+		self.modem.wait_for(self.registration_settled, commconf.CELL_REGISTER_TIMEOUT)
+		if not self.is_registered():
+			raise OSError("not registered (" + str(self.registration) + ")")
+		self.registered_network = self.read_operator()
+
+	#function to read the operator the modem is registered on (numeric format)
+	#returns a dict of plmn and act (see registered_network), None if the modem names no operator
+	def read_operator(self):
+		#+COPS: <mode>,<format>,"<plmn>",<act> (only +COPS: <mode> without an operator)
+		fields = find_answer(self.modem.pipeline(("+COPS=3,2", "+COPS?")), "+COPS").split(":", 1)[1].split(",")
+		if len(fields) < 4:
+			return None
+		try:
+			return {"plmn": fields[2].strip('"'), "act": int(fields[3])}
+		except ValueError:
+			return None
+
+	#function to open the data bearer (pdp context 1) the http commands use, if it is not open already
+	def open_bearer(self):
+		#+SAPBR: <cid>,<status>,"<ip>", status 1 is open
+		if find_answer(self.modem.command("+SAPBR=2,1"), "+SAPBR").split(",")[1] == "1":
+			return
+		self.modem.pipeline(('+SAPBR=3,1,"Contype","GPRS"', '+SAPBR=3,1,"APN","' + commconf.CELL_APN + '"'))
+		self.modem.command("+SAPBR=1,1", commconf.CELL_BEARER_TIMEOUT)
+
+	#function to read the registration status of a +CEREG line
+	#(the query answer is "+CEREG: <n>,<stat>", the urc is "+CEREG: <stat>")
+	def handle_registration(self, line):
+		fields = line.split(":", 1)[1].split(",")
+		if len(fields) > 1:
+			self.registration = int(fields[1])
+		else:
+			self.registration = int(fields[0])
+
+	#function to check if the modem is registered (home network or roaming)
+	def is_registered(self):
+		return self.registration == 1 or self.registration == 5
+
+	#function to check if registration is done, registered or denied by the network
+	def registration_settled(self):
+		return self.is_registered() or self.registration == 3
+
+#function to get the command that sets power saving mode (3GPP 27.007 +CPSMS)
+def power_saving_command():
+	if commconf.CELL_PSM:
+		return '+CPSMS=1,,,"' + commconf.CELL_PSM_TAU + '","' + commconf.CELL_PSM_ACTIVE + '"'
+	return "+CPSMS=0"
+
+#function to get the command that sets extended discontinuous reception (3GPP 27.007 +CEDRXS)
+def edrx_command():
+	if commconf.CELL_EDRX:
+		return "+CEDRXS=1," + str(commconf.CELL_EDRX_ACT) + ',"' + commconf.CELL_EDRX_CYCLE + '"'
+	return "+CEDRXS=0"
+
+#class for the AT command interface of the cellular modem, over a uart (or any object with write,
+#any and readinto, like a simulated modem on the host)
+#commands are given without the "AT" prefix, pipeline() sends several of them in one command line
+#that the modem answers with one final result, so a setup sequence costs one round trip
+#modem output is read a line at a time through a fixed buffer, lines that are not part of the answer
+#to a command are unsolicited result codes (urcs) and go to the handler registered for their prefix
+class At_Modem:
+	def __init__(self, uart):
+		self.uart = uart
+		#buffer modem output is read into, and the position and end of the unread bytes in it
+		self.buf = bytearray(commconf.CELL_BUFFER_SIZE)
+		self.buf_view = memoryview(self.buf)
+		self.pos = 0
+		self.end = 0
+		#urc handlers by prefix (see on_urc)
+		self.handlers = {}
+		#number of command lines sent (printed for debugging)
+		self.command_count = 0
+
+	#function to have handler(line) called with every urc that starts with prefix (like "+CEREG")
+	def on_urc(self, prefix, handler):
+		self.handlers[prefix] = handler
+
+	#function to check if the modem answers AT within CELL_PING_TIMEOUT
+	def ping(self):
+		try:
+			self.command("", commconf.CELL_PING_TIMEOUT)
+		except OSError:
+			return False
+		return True
+
+	#function to send one command and read its answer (see pipeline)
+	def command(self, command, timeout=commconf.CELL_COMMAND_TIMEOUT):
+		return self.pipeline((command,), timeout)
+
+	#function to send commands in one command line and read the answer
+	#extended commands (+...) are separated with ";", basic commands (like E0) need no separator
+	#returns the information lines of the answer, raises OSError if the modem answers with an error
+	#(the commands after the failing one are not run) or no final result arrives within timeout (ms)
+	def pipeline(self, commands, timeout=commconf.CELL_COMMAND_TIMEOUT):
+		line = "AT"
+		previous = ""
+		names = []
+		for command in commands:
+			if command[:1] == "+" and previous[:1] == "+":
+				line += ";"
+			line += command
+			previous = command
+			names.append(command_name(command))
+		self.send_line(line)
+		return self.read_answer(names, timeout)
+
+	#function to send a command without waiting for its answer
+	def send(self, command):
+		self.send_line("AT" + command)
+
+	#function to send a command that takes raw data (like +HTTPDATA), the data is written once the
+	#modem asks for it with the prompt line, returns the information lines of the answer
+	def send_data(self, command, data, prompt, timeout=commconf.CELL_COMMAND_TIMEOUT):
+		self.send_line("AT" + command)
+		deadline = ticks_add(ticks_ms(), timeout)
+		while True:
+			line = self.read_line(deadline)
+			if line is None:
+				raise OSError("modem: no prompt for " + command)
+			if line == prompt:
+				break
+			if at_error(line):
+				raise OSError("modem: " + line)
+			self.dispatch(line)
+		self.uart.write(data)
+		return self.read_answer((command_name(command),), timeout)
+
+	#function to send a command answered with raw data (like +HTTPREAD), the answer is a
+	#"+NAME: <length>" line followed by length bytes that are read into buf
+	#(bytes past the size of buf are read and dropped), returns the length of the data
+	def read_data(self, command, buf, timeout=commconf.CELL_COMMAND_TIMEOUT):
+		name = command_name(command)
+		self.send_line("AT" + command)
+		deadline = ticks_add(ticks_ms(), timeout)
+		while True:
+			line = self.read_line(deadline)
+			if line is None:
+				raise OSError("modem: no answer to " + command)
+			if at_error(line):
+				raise OSError("modem: " + line)
+			#no data to read
+			if line == "OK":
+				return 0
+			if line.startswith(name + ":"):
+				break
+			self.dispatch(line)
+		length = int(line.split(":", 1)[1])
+		size = min(length, len(buf))
+		self.read_bytes(buf, size, deadline)
+		self.read_bytes(None, length - size, deadline)
+		self.read_answer((name,), timeout)
+		return length
+
+	#function to read lines (handing urcs to their handlers) until condition() returns True or the
+	#timeout (ms) is reached, returns the last result
+	def wait_for(self, condition, timeout):
+		deadline = ticks_add(ticks_ms(), timeout)
+		while not condition():
+			line = self.read_line(deadline)
+			if line is None:
+				return condition()
+			self.dispatch(line)
+		return True
+
+	#function to write a command line
+	#output that arrived before it (like the late answer of a command that timed out) is read
+	#first, so it is not taken as the answer to this line
+	def send_line(self, line):
+		stale = self.read_line(ticks_ms())
+		while stale is not None:
+			self.dispatch(stale)
+			stale = self.read_line(ticks_ms())
+		self.uart.write((line + "\r").encode())
+		self.command_count += 1
+
+	#function to read lines up to the final result of a command, names are the commands the answer
+	#belongs to (lines starting with them are never urcs), returns the information lines
+	def read_answer(self, names, timeout):
+		deadline = ticks_add(ticks_ms(), timeout)
+		lines = []
+		while True:
+			line = self.read_line(deadline)
+			if line is None:
+				raise OSError("modem: no answer")
+			if line == "OK":
+				return lines
+			if at_error(line):
+				raise OSError("modem: " + line)
+			if not self.dispatch(line, names):
+				lines.append(line)
+
+	#function to hand a line to the handler of its urc prefix, returns True if it was a urc
+	#lines starting with one of names are answers to the command being run
+	def dispatch(self, line, names=()):
+		prefix = line.split(":", 1)[0]
+		if prefix in names:
+			return False
+		handler = self.handlers.get(prefix)
+		if handler is None:
+			return False
+		handler(line)
+		return True
+
+	#function to read the next line (without the line break) before deadline (ticks_ms)
+	#empty lines are skipped and only printable characters are kept (up to CELL_LINE_SIZE)
+	#returns None if no full line arrives in time
+	def read_line(self, deadline):
+		line = bytearray()
+		while True:
+			if self.pos >= self.end and not self.fill(deadline):
+				return None
+			byte = self.buf[self.pos]
+			self.pos += 1
+			if byte == 0x0A:
+				if line:
+					return str(line, 'utf-8')
+			elif 0x20 <= byte < 0x7F and len(line) < commconf.CELL_LINE_SIZE:
+				line.append(byte)
+
+	#function to read count bytes into buf (dropped if buf is None) before deadline (ticks_ms)
+	def read_bytes(self, buf, count, deadline):
+		done = 0
+		while done < count:
+			if self.pos >= self.end and not self.fill(deadline):
+				raise OSError("modem: data cut short")
+			size = min(count - done, self.end - self.pos)
+			if buf is not None:
+				buf[done:done+size] = self.buf_view[self.pos:self.pos+size]
+			self.pos += size
+			done += size
+
+	#function to read the modem output that has arrived into buf, waits for it until deadline
+	#returns False if nothing arrives in time
+	def fill(self, deadline):
+		while True:
+			if self.uart.any():
+				self.pos = 0
+				self.end = self.uart.readinto(self.buf) or 0
+				if self.end:
+					return True
+			if ticks_diff(deadline, ticks_ms()) <= 0:
+				return False
+			sleep_ms(commconf.CELL_POLL_INTERVAL)
+
+#function to get the name of a command ("+CEREG" for "+CEREG?" or "+CEREG=1"), answers start with it
+def command_name(command):
+	for i in range(len(command)):
+		if command[i] == "=" or command[i] == "?":
+			return command[:i]
+	return command
+
+#function to check if a line is an error result
+def at_error(line):
+	return line == "ERROR" or line.startswith("+CME ERROR") or line.startswith("+CMS ERROR")
+
+#function to find the answer line starting with name in the information lines of a command
+#raises OSError if it is missing
+def find_answer(lines, name):
+	for line in lines:
+		if line.startswith(name + ":"):
+			return line
+	raise OSError("modem: no " + name + " answer")
+
+#class for http requests made with the modem's http commands (SIMCom +HTTPINIT, +HTTPPARA,
+#+HTTPDATA, +HTTPACTION, +HTTPHEAD, +HTTPREAD), with the interface of Http_Client so a Dev_Network
+#sends its messages over either one
+#the response body stays in the modem and is read with +HTTPREAD in pieces of at most CELL_READ_SIZE
+#as the caller reads it (readinto), so a large reply is never held whole
+#the modem does not decompress, so compressed bodies are not asked for
+class Cell_Http_Client:
+	def __init__(self, modem, base_url):
+		self.modem = modem
+		self.base_url = base_url
+		#value of the Accept header, None sends none (set by Dev_Network)
+		self.accept = None
+		#True while the modem's http service is initialized
+		self.started = False
+		#status code, content type and body length of the current response, and read position in the body
+		self.status = 0
+		self.content_type = ""
+		self.length = 0
+		self.offset = 0
+		#[method, status, length] of the last +HTTPACTION urc, None while a request waits for it
+		self.action = None
+		#buffer a whole response body is collected in (see read_body), grows when needed
+		self.body_buf = bytearray(commconf.HTTP_BODY_SIZE)
+		#buffer the response headers are read into (only the content type is used)
+		self.head_buf = bytearray(commconf.CELL_HEAD_SIZE)
+		#number of requests made (printed for debugging)
+		self.request_count = 0
+		if modem is not None:
+			modem.on_urc("+HTTPACTION", self.handle_action)
+
+	#function to end the modem's http session (the next request starts a new one)
+	def close(self):
+		if self.started:
+			self.started = False
+			try:
+				self.modem.command("+HTTPTERM")
+			except OSError:
+				pass
+		self.offset = self.length
+
+	#function to make a request and read the whole response (see Http_Client.request)
+	#raises OSError if the request fails
+	def request(self, method, path, body=None, content_type="application/json"):
+		self.open(method, path, body, content_type)
+		return self.read_body()
+
+	#function to read the body of the response opened with open()
+	#returns the status code, content type and body (a memoryview of body_buf)
+	def read_body(self):
+		size = 0
+		while True:
+			#grow the body buffer when it is full
+			if size == len(self.body_buf):
+				body_buf = bytearray(2*size)
+				body_buf[:size] = self.body_buf
+				self.body_buf = body_buf
+			count = self.readinto(memoryview(self.body_buf)[size:])
+			if not count:
+				break
+			size += count
+		return self.status, self.content_type, memoryview(self.body_buf)[:size]
+
+	#function to make a request and read the status and content type of the response
+	#the body must then be read with readinto (or skipped) and finish() called
+	def open(self, method, path, body=None, content_type="application/json"):
+		if isinstance(body, str):
+			body = body.encode()
+		modem = self.modem
+		if not self.started:
+			try:
+				modem.command("+HTTPINIT")
+			except OSError:
+				#the service is still initialized from an earlier session
+				modem.command("+HTTPTERM")
+				modem.command("+HTTPINIT")
+			self.started = True
+		#bearer, url, content type and extra header lines (USERDATA) set in one command line
+		params = ['+HTTPPARA="CID",1', '+HTTPPARA="URL","' + self.base_url + path + '"']
+		if body is not None:
+			params.append('+HTTPPARA="CONTENT","' + content_type + '"')
+		if self.accept is not None:
+			params.append('+HTTPPARA="USERDATA","Accept: ' + self.accept + '"')
+		else:
+			params.append('+HTTPPARA="USERDATA",""')
+		modem.pipeline(params)
+		if body is not None:
+			modem.send_data("+HTTPDATA=" + str(len(body)) + "," + str(commconf.CELL_DATA_TIMEOUT), body, \
+				"DOWNLOAD", commconf.CELL_DATA_TIMEOUT + commconf.CELL_COMMAND_TIMEOUT)
+		#the request is made after the OK, its result comes as a +HTTPACTION urc
+		self.action = None
+		self.offset = self.length = 0
+		modem.command("+HTTPACTION=" + str(HTTP_METHODS[method]))
+		if not modem.wait_for(self.action_done, commconf.CELL_HTTP_TIMEOUT):
+			raise OSError("modem: no http response")
+		self.status = self.action[1]
+		self.request_count += 1
+		#status codes from 600 are modem errors (no network, dns failure...)
+		if self.status >= 600:
+			raise OSError("modem: http error " + str(self.status))
+		self.length = self.action[2]
+		self.content_type = self.read_content_type()
+
+	#function to read the content type from the response headers, "" if there is none
+	def read_content_type(self):
+		length = self.modem.read_data("+HTTPHEAD", self.head_buf)
+		for line in bytes(self.head_buf[:min(length, len(self.head_buf))]).split(b"\n"):
+			if line[:13].lower() == b"content-type:":
+				return str(line[13:].strip(), 'utf-8')
+		return ""
+
+	#function to store the result of a +HTTPACTION urc (+HTTPACTION: <method>,<status>,<length>)
+	def handle_action(self, line):
+		self.action = [int(field) for field in line.split(":", 1)[1].split(",")]
+
+	#function to check if the result of the request has arrived
+	def action_done(self):
+		return self.action is not None
+
+	#function to get the stream the body is read from (the modem does not send compressed bodies)
+	def body_stream(self):
+		return self
+
+	#function to read body bytes into buf (stream interface), returns 0 at the end of the body
+	def readinto(self, buf):
+		if self.offset >= self.length:
+			return 0
+		size = min(len(buf), self.length - self.offset, commconf.CELL_READ_SIZE)
+		count = self.modem.read_data("+HTTPREAD=" + str(self.offset) + "," + str(size), buf)
+		if not count:
+			raise OSError("modem: body cut short")
+		self.offset += count
+		return count
+
+	#function to end the current response (the rest of the body stays in the modem)
+	def finish(self):
+		self.offset = self.length
+
+#+HTTPACTION codes of the request methods
+HTTP_METHODS = {"GET": 0, "POST": 1, "HEAD": 2}
+
+#class for a small HTTP/1.1 client that keeps one connection to a host open (keep-alive)
+#every request of a wake cycle reuses the socket, a connection the server has closed is
+#reopened and the request sent again, call close() when the network goes down
+#
+#responses are read through preallocated buffers: the status line and headers are parsed a
+#line at a time in line_buf, and the body is read with readinto, framed by Content-Length or
+#chunked transfer encoding. request() collects the body in body_buf, open() lets the caller read
+#the body as a stream instead (body_stream, see json_stream.py) and then call finish()
+#deflate and gzip compressed bodies are asked for (Accept-Encoding) and body_stream decompresses
+#them while they are read, with a window of 2^HTTP_DEFLATE_WBITS bytes
+#the socket is non blocking (a blocking read only returns once the buffer is full), waits for
+#data are done with poll so they time out after HTTP_TIMEOUT
+class Http_Client:
+	def __init__(self, base_url):
+		#split base url into scheme, host and port
+		scheme, address = base_url.split("://", 1)
+		address = address.split("/", 1)[0]
+		self.tls = scheme == "https"
+		if ":" in address:
+			self.host, port = address.split(":", 1)
+			self.port = int(port)
+		else:
+			self.host = address
+			self.port = 443 if self.tls else 80
+		#open socket, None until the first request
+		self.sock = None
+		#poll object used to wait for the socket
+		self.poller = None
+		#bytes read from the socket and not used yet are buf[pos:end]
+		self.buf = bytearray(commconf.HTTP_BUFFER_SIZE)
+		self.buf_view = memoryview(self.buf)
+		self.pos = 0
+		self.end = 0
+		#buffer holding the current status or header line (longer lines are cut off)
+		self.line_buf = bytearray(commconf.HTTP_LINE_SIZE)
+		#buffer request() collects bodies in, grows to the largest body seen
+		self.body_buf = bytearray(commconf.HTTP_BODY_SIZE)
+		#fields of the current response
+		self.status = 0
+		self.content_type = ""
+		self.keep_alive = True
+		self.chunked = False
+		#number of chunks started in a chunked body
+		self.chunk_count = 0
+		#body bytes left (in the current chunk if chunked), BODY_TO_CLOSE if the body ends with
+		#the connection, and BODY_DONE once the body has been read
+		self.remaining = BODY_DONE
+		#media types sent in the Accept header of every request (None sends no Accept header)
+		self.accept = None
+		#content coding of the current response body (None, "deflate" or "gzip")
+		self.encoding = None
+		#compressed responses are asked for only if the firmware has uzlib
+		self.uzlib = None
+		if commconf.HTTP_COMPRESSION:
+			try:
+				import uzlib
+				self.uzlib = uzlib
+			except ImportError:
+				printline("uzlib missing, responses are not compressed")
+		#number of connections opened and requests made (printed for debugging)
+		self.connect_count = 0
+		self.request_count = 0
+
+	#function to open the connection to the host
+	def connect(self):
+		addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+		sock = socket.socket()
+		sock.settimeout(commconf.HTTP_TIMEOUT)
+		try:
+			sock.connect(addr)
+			if self.tls:
+				import ussl
+				sock = ussl.wrap_socket(sock, server_hostname=self.host)
+			sock.setblocking(False)
+		except OSError:
+			sock.close()
+			raise
+		self.sock = sock
+		self.poller = uselect.poll()
+		self.poller.register(sock, uselect.POLLIN)
+		self.pos = 0
+		self.end = 0
+		self.connect_count += 1
+
+	#function to close the connection (the next request opens a new one)
+	def close(self):
+		if self.sock is not None:
+			try:
+				self.sock.close()
+			except OSError:
+				pass
+			self.sock = None
+		self.poller = None
+		self.remaining = BODY_DONE
+
+	#function to make a request and read the whole response
+	#body is a str or bytes (sent as content_type) or None
+	#returns the status code, content type and body (a memoryview of body_buf, only valid until
+	#the next request), raises OSError if the request fails
+	def request(self, method, path, body=None, content_type="application/json"):
+		self.open(method, path, body, content_type)
+		return self.read_body()
+
+	#function to read the body of the response opened with open(), ends the response
+	#returns the status code, content type and body (as request() does), the body is decompressed
+	def read_body(self):
+		stream = self.body_stream()
+		size = 0
+		while True:
+			#grow the body buffer when it is full
+			if size == len(self.body_buf):
+				body_buf = bytearray(2*size)
+				body_buf[:size] = self.body_buf
+				self.body_buf = body_buf
+			count = stream.readinto(memoryview(self.body_buf)[size:])
+			if not count:
+				break
+			size += count
+		self.finish()
+		return self.status, self.content_type, memoryview(self.body_buf)[:size]
+
+	#function to send a request and read the status line and headers of the response
+	#the body must then be read with readinto (or skipped) and finish() called
+	def open(self, method, path, body=None, content_type="application/json"):
+		if isinstance(body, str):
+			body = body.encode()
+		#end a response the caller did not read to the end
+		if self.remaining != BODY_DONE:
+			self.finish()
+		while True:
+			reused = self.sock is not None
+			if not reused:
+				self.connect()
+			try:
+				if self.send_request(method, path, body, content_type) and self.response_started():
+					self.read_head()
+					return
+				#the write failed or the connection was closed or reset before the first byte of the response
+				if not reused:
+					raise OSError("connection closed")
+			except OSError:
+				#timeouts and errors after the response started are not retried, the server may
+				#have acted on the request
+				self.close()
+				raise
+			#the server had closed the kept open connection, the request is sent once more on a new one
+			self.close()
+
+	#function to wait for the first byte of the response, returns False if the connection was
+	#closed or reset before it, raises OSError if it does not arrive within HTTP_TIMEOUT
+	def response_started(self):
+		if self.pos < self.end:
+			return True
+		while True:
+			try:
+				count = self.sock.readinto(self.buf)
+			except OSError:
+				#a server that closed a kept open connection resets it (ECONNRESET)
+				count = 0
+			#None if no data has arrived yet
+			if count is not None:
+				break
+			self.wait(uselect.POLLIN)
+		self.pos = 0
+		self.end = count
+		return count > 0
+
+	#function to write the request, returns False if the connection is broken (a server that
+	#closed a kept open connection resets it), raises OSError if the socket can not take the
+	#request within HTTP_TIMEOUT
+	def send_request(self, method, path, body, content_type):
+		head = method + " " + path + " HTTP/1.1\r\nHost: " + self.host + "\r\nConnection: keep-alive\r\n"
+		if self.accept is not None:
+			head += "Accept: " + self.accept + "\r\n"
+		if self.uzlib is not None:
+			head += "Accept-Encoding: deflate, gzip\r\n"
+		if body is not None:
+			head += "Content-Type: " + content_type + "\r\nContent-Length: " + str(len(body)) + "\r\n"
+		#head and body go out in one write so they share a tcp segment
+		head = (head + "\r\n").encode()
+		if body is not None:
+			head += body
+		view = memoryview(head)
+		sent = 0
+		while sent < len(head):
+			try:
+				count = self.sock.write(view[sent:])
+			except OSError:
+				return False
+			#None if the socket can not take data yet
+			if count is None:
+				self.wait(uselect.POLLOUT)
+			else:
+				sent += count
+		self.request_count += 1
+		return True
+
+	#function to wait until the socket is ready (event is uselect.POLLIN or POLLOUT)
+	#raises OSError if it is not ready within HTTP_TIMEOUT
+	def wait(self, event):
+		self.poller.modify(self.sock, event)
+		if not self.poller.poll(commconf.HTTP_TIMEOUT*1000):
+			raise OSError("timed out")
+
+	#function to parse the status line and headers of a response
+	def read_head(self):
+		#status line ("HTTP/1.1 200 OK"), the code starts after the first space
+		length = self.read_line()
+		self.status = 0
+		i = 0
+		while i < length and self.line_buf[i] != 0x20:
+			i += 1
+		i += 1
+		while i < length and 0x30 <= self.line_buf[i] <= 0x39:
+			self.status = self.status*10 + self.line_buf[i] - 0x30
+			i += 1
+		#headers, only the ones that frame the body or say how to decode it are kept
+		self.content_type = ""
+		self.encoding = None
+		self.keep_alive = True
+		self.chunked = False
+		self.chunk_count = 0
+		self.remaining = BODY_TO_CLOSE
+		while True:
+			length = self.read_line()
+			if length == 0:
+				break
+			if self.header_is(b"content-length:", length):
+				self.remaining = self.parse_int(15, length, 10)
+			elif self.header_is(b"content-type:", length):
+				self.content_type = str(self.line_buf[13:length], 'utf-8').strip()
+			elif self.header_is(b"transfer-encoding:chunked", length):
+				self.chunked = True
+			elif self.header_is(b"content-encoding:deflate", length):
+				self.encoding = "deflate"
+			elif self.header_is(b"content-encoding:gzip", length):
+				self.encoding = "gzip"
+			elif self.header_is(b"connection:close", length):
+				self.keep_alive = False
+		if self.chunked:
+			#size of the first chunk is read by readinto
+			self.remaining = 0
+		elif self.remaining == 0:
+			self.remaining = BODY_DONE
+		elif self.remaining == BODY_TO_CLOSE:
+			#the body ends when the server closes the connection
+			self.keep_alive = False
+
+	#function to check if the line in line_buf starts with name (lower case, spaces in the line are ignored)
+	def header_is(self, name, length):
+		j = 0
+		for i in range(length):
+			if j == len(name):
+				return True
+			byte = self.line_buf[i]
+			#letters compare in lower case
+			if 0x41 <= byte <= 0x5A:
+				byte += 0x20
+			if byte == name[j]:
+				j += 1
+			elif byte != 0x20:
+				return False
+		return j == len(name)
+
+	#function to parse a number in line_buf from position start, skips spaces, stops at other bytes
+	def parse_int(self, start, length, base):
+		value = 0
+		for i in range(start, length):
+			digit = self.line_buf[i] | 0x20
+			if 0x30 <= digit <= 0x39:
+				value = value*base + digit - 0x30
+			elif base == 16 and 0x61 <= digit <= 0x66:
+				value = value*base + digit - 0x57
+			elif digit != 0x20 or value:
+				break
+		return value
+
+	#function to read one line (without the line break) into line_buf, returns its length
+	#raises OSError if the connection closes before the line ends
+	def read_line(self):
+		length = 0
+		while True:
+			if self.pos >= self.end:
+				self.fill()
+			byte = self.buf[self.pos]
+			self.pos += 1
+			if byte == 0x0A:
+				return min(length, len(self.line_buf))
+			#carriage returns are dropped
+			if byte != 0x0D:
+				if length < len(self.line_buf):
+					self.line_buf[length] = byte
+				length += 1
+
+	#function to refill buf from the socket, raises OSError if the connection was closed
+	def fill(self):
+		count = self.read_socket(self.buf)
+		if not count:
+			raise OSError("connection closed")
+		self.pos = 0
+		self.end = count
+
+	#function to read what the socket has (at least 1 byte) into buf, returns 0 if the connection was closed
+	def read_socket(self, buf):
+		count = self.sock.readinto(buf)
+		#None if no data has arrived yet
+		while count is None:
+			self.wait(uselect.POLLIN)
+			count = self.sock.readinto(buf)
+		return count
+
+	#function to get the stream the body of the current response is read from (readinto)
+	#this client for identity bodies, a decompressing stream over it for compressed bodies
+	#(zlib wbits: deflate bodies have a zlib header, 16 + wbits reads the gzip header)
+	def body_stream(self):
+		if self.encoding is None:
+			return self
+		wbits = commconf.HTTP_DEFLATE_WBITS
+		if self.encoding == "gzip":
+			wbits += 16
+		return self.uzlib.DecompIO(Http_Body(self), wbits)
+
+	#function to read body bytes into buf (stream interface), returns 0 at the end of the body
+	#the bytes are as sent, compressed bodies are read through body_stream()
+	def readinto(self, buf):
+		if self.remaining == BODY_DONE:
+			return 0
+		if self.chunked and self.remaining == 0:
+			#line break after the data of the previous chunk
+			if self.chunk_count:
+				self.read_line()
+			#size line of the next chunk (hex, extensions after ';' are ignored)
+			self.remaining = self.parse_int(0, self.read_line(), 16)
+			self.chunk_count += 1
+			if self.remaining == 0:
+				#skip trailers up to the empty line
+				while self.read_line():
+					pass
+				self.remaining = BODY_DONE
+				return 0
+		count = len(buf)
+		if self.remaining != BODY_TO_CLOSE:
+			count = min(count, self.remaining)
+		if self.pos < self.end:
+			#use bytes already read with the headers first
+			count = min(count, self.end - self.pos)
+			buf[:count] = self.buf_view[self.pos:self.pos+count]
+			self.pos += count
+		else:
+			count = self.read_socket(memoryview(buf)[:count])
+			if not count:
+				if self.remaining == BODY_TO_CLOSE:
+					self.remaining = BODY_DONE
+					return 0
+				raise OSError("connection closed")
+		if self.remaining != BODY_TO_CLOSE:
+			self.remaining -= count
+			if self.remaining == 0 and not self.chunked:
+				self.remaining = BODY_DONE
+		return count
+
+	#function to end the current response, skips any body that was not read
+	#the connection is closed if the server asked for it (or the body ended with the connection)
+	def finish(self):
+		if self.keep_alive:
+			try:
+				#line_buf is free once the headers are read
+				while self.readinto(self.line_buf):
+					pass
+			except OSError:
+				self.keep_alive = False
+		if not self.keep_alive:
+			self.close()
+		self.remaining = BODY_DONE
+
+#class to give the body of a response the native stream interface uzlib.DecompIO reads from
+class Http_Body(uio.IOBase):
+	def __init__(self, http):
+		self.http = http
+
+	#function to read body bytes into buf, returns 0 at the end of the body
+	def readinto(self, buf):
+		return self.http.readinto(buf)
+
+#remaining value of a body that ends when the connection closes, and of a body that has been read
+BODY_TO_CLOSE = const(-1)
+BODY_DONE = const(-2)
+
+#class to keep a network radio powered only while it is needed
+#takes the start function (returns True once connected) and stop function of a network interface
+#(Dev_WiFi.start_wifi/stop_wifi or Dev_Cell.start_cellular/stop_cellular)
+#main.py powers the radio down while the user interacts and calls up() before each message,
+#a restart of Dev_WiFi uses the fast reconnect so it is short
+class Radio_Manager:
+	def __init__(self, start_func, stop_func):
+		self.start_func = start_func
+		self.stop_func = stop_func
+		#True while the radio is up
+		self.on = False
+		#True once a start failed, the radio is not retried in the same wake
+		self.failed = False
+		#time (ticks_ms) the radio was last powered up, and total ms it was on before that
+		self.on_time = 0
+		self.total_on_ms = 0
+
+	#function to make sure the radio is up and connected, returns True if it is
+	def up(self):
+		if self.on:
+			return True
+		if self.failed:
+			return False
+		self.on_time = ticks_ms()
+		self.on = True
+		if not self.start_func():
+			self.failed = True
+			self.down()
+		return self.on
+
+	#function to power the radio down (does nothing if it is down)
+	def down(self):
+		if self.on:
+			self.stop_func()
+			self.on = False
+			self.total_on_ms += ticks_diff(ticks_ms(), self.on_time)
+
+	#function to get the time (in ms) the radio has been on during this wake
+	def radio_on_ms(self):
+		if self.on:
+			return self.total_on_ms + ticks_diff(ticks_ms(), self.on_time)
+		return self.total_on_ms
+
+#function to wait until condition() returns True or the timeout (ms) is reached, returns the last result
+#sleeps between checks so the cpu is idle while the radio works
+def wait_until(condition, timeout):
+	#set initial time we started waiting
+	init_time = ticks_ms()
+	while not condition():
+		if ticks_diff(ticks_ms(),init_time) >= timeout:
+			return condition()
+		sleep_ms(commconf.RADIO_POLL_INTERVAL)
+	return True
 
 #function to handle device message replies
 #takes message type argument and string reply
 #returns True or false (indicating successful message) and datetime, list of Appointments and/or reply
 def handle_message_replies(message_type, reply):
+	#a cbor reply holds the same fields as json, with times in seconds
+	if message_type == "CBOR":
+		message_type, reply = "JSON", convert_datetimes(reply, wire_datetime)
 	#check if message type is JSON
 	if message_type == "JSON":
-		#try to get datetime from reply (in initial message without appt)
-		try:
-			datetime = reply["server_date_time"]
-			return True, datetime, None
-		#otherwise try to get datetime from array (in initial message with appt)
-		except:
+		#get datetime from reply (in initial message without appt)
+		if isinstance(reply, dict):
+			datetime = reply.get("server_date_time")
+			return datetime is not None, datetime, None
+		#otherwise get datetime from array (in initial message with appt)
+		else:
 			datetime = reply[0]["server_date_time"]
 			#create empty list of appointments
 			appointments = []
@@ -333,7 +1816,7 @@ def handle_message_replies(message_type, reply):
 				tappt = reply[i+1]["fields"]
 				#make new Appointment object from data and append that to the list
 				appointments.append(Appointment(tappt["appointment_ID"], \
-					tappt["answer"], tappt["appointment_start_date_time"], tappt["cancelled"]))
+					tappt.get("answer"), tappt.get("appointment_start_date_time"), tappt.get("cancelled", False)))
 			#return true, datetime and list of Appointment objects
 			return True, datetime, appointments
 
@@ -364,6 +1847,166 @@ def handle_message_replies(message_type, reply):
 	if message_type == "FAIL":
 		return False, "FAIL", None
 
+#function to decode a reply body according to its content type
+#returns the message type ("JSON", "CBOR", "TEXT", "RAW" or "FAIL") and the decoded reply
+def decode_reply(content_type, data):
+	#return cbor data (keys are already turned back into names)
+	if content_type.startswith(CBOR_TYPE):
+		try:
+			return "CBOR", cbor_stream.loads(data, WIRE_KEYS)
+		except ValueError:
+			printline("malformed cbor reply")
+			return "FAIL", None
+	#return json data
+	if content_type.startswith(JSON_TYPE):
+		try:
+			return "JSON", ujson.loads(bytes(data))
+		except ValueError:
+			printline("malformed json reply")
+			return "FAIL", None
+	#return text data
+	if content_type.startswith("text/"):
+		return "TEXT", str(data, 'utf-8')
+	#return raw content otherwise
+	return "RAW", bytes(data)
+
+#media types of the two message encodings
+JSON_TYPE = "application/json"
+CBOR_TYPE = "application/cbor"
+
+#map keys of the compact encoding, a key is sent as its position in this tuple
+#(new keys are only ever added at the end, every key below 24 takes one byte)
+WIRE_KEYS = (
+				"device_id", "device_password", "device_battery_level", "appointment_id", "answer",
+				"response_date_time", "answers", "sync", "cursor", "count", "digest", "server_date_time",
+				"batch_replies", "fields", "appointment_ID", "appointment_start_date_time", "cancelled",
+				"results", "success"
+			)
+#key to code lookup used when encoding
+WIRE_KEY_CODES = {key: code for code, key in enumerate(WIRE_KEYS)}
+#keys whose values are datetimes, sent as seconds since 2000-01-01 in the compact encoding
+WIRE_DATETIME_KEYS = ("response_date_time", "cursor", "server_date_time", "appointment_start_date_time")
+
+#function to encode a message object in the compact encoding (cbor), returns bytes
+def encode_compact(message):
+	return cbor_stream.dumps(convert_datetimes(message, datetime_to_epoch), WIRE_KEY_CODES)
+
+#function to turn a datetime of the compact encoding (seconds) into a datetime string
+#strings (json) and None are returned as they are
+def wire_datetime(value):
+	if isinstance(value, int):
+		return epoch_to_datetime(value)
+	return value
+
+#function to copy a decoded message with convert applied to every datetime value
+#(datetime_to_epoch to encode, wire_datetime to decode)
+def convert_datetimes(value, convert):
+	if isinstance(value, dict):
+		converted = {}
+		for key in value:
+			if key in WIRE_DATETIME_KEYS and value[key] is not None:
+				converted[key] = convert(value[key])
+			else:
+				converted[key] = convert_datetimes(value[key], convert)
+		return converted
+	if isinstance(value, list):
+		return [convert_datetimes(item, convert) for item in value]
+	return value
+
+#fields of an appointment request that the device uses, every other field is skipped unread
+APPOINTMENT_FIELDS = ("appointment_ID", "appointment_start_date_time", "answer", "cancelled")
+
+#class to decode an initial post reply while it is read from a stream
+#reader is a Json_Reader or a cbor_stream.Cbor_Reader (keys translated with WIRE_KEYS)
+#the reply is an object holding server_date_time, or a list of that object followed by one
+#object per appointment request (see the formats below)
+#server_date_time (and the batch_replies flag) are read on creation, appointments() then yields
+#one Appointment at a time, so only one appointment is ever held in memory
+#http (optional) is the Http_Client the stream comes from, its response is ended after the last appointment
+class Appointment_Reply:
+	def __init__(self, reader, http=None):
+		self.reader = reader
+		self.http = http
+		self.server_date_time = None
+		self.batch_replies = False
+		#"delta" if the reply only holds changes made after the sync cursor, "full" otherwise
+		self.sync = "full"
+		#True once appointments() has read every appointment
+		self.complete = False
+		#generator over the list elements, None for the reply without appointments
+		self.elements = None
+		if reader.starts_array():
+			self.elements = reader.iter_elements()
+			#the first element holds server_date_time
+			for i in self.elements:
+				self.read_header()
+				break
+		else:
+			self.read_header()
+
+	#function to read the object holding server_date_time
+	def read_header(self):
+		for key in self.reader.iter_object():
+			if key == "server_date_time":
+				self.server_date_time = wire_datetime(self.reader.load())
+			elif key == "batch_replies":
+				self.batch_replies = self.reader.load() is True
+			elif key == "sync":
+				self.sync = self.reader.load()
+			else:
+				self.reader.skip_value()
+
+	#generator that yields the Appointments of the reply as they are read
+	#a reply that breaks off or is malformed ends the appointments (the ones read are kept)
+	def appointments(self):
+		try:
+			if self.elements is not None:
+				for i in self.elements:
+					yield self.read_appointment()
+			self.complete = True
+		except (OSError, ValueError, KeyError):
+			printline("appointment reply broken off")
+			if self.http is not None:
+				self.http.close()
+		if self.http is not None:
+			self.http.finish()
+
+	#function to read one appointment request object, only APPOINTMENT_FIELDS are decoded
+	#only appointment_ID is required, a delta reply can send a cancellation without the other fields
+	def read_appointment(self):
+		fields = {}
+		for key in self.reader.iter_object():
+			if key == "fields":
+				for field in self.reader.iter_object():
+					if field in APPOINTMENT_FIELDS:
+						fields[field] = self.reader.load()
+					else:
+						self.reader.skip_value()
+			else:
+				self.reader.skip_value()
+		return Appointment(fields["appointment_ID"], fields.get("answer"), \
+			wire_datetime(fields.get("appointment_start_date_time")), fields.get("cancelled", False))
+
+#function to handle the reply to a batch answer post
+#returns a list of [appointment_id, success] for every appointment in the message,
+#appointments the reply does not list as successful are not successful
+def handle_batch_reply(message_type, reply, message_obj):
+	accepted = {}
+	if message_type in ("JSON", "CBOR") and isinstance(reply, dict):
+		results = reply.get("results")
+		if not isinstance(results, list):
+			results = []
+		for result in results:
+			#entries that are not objects with an appointment_id are skipped
+			if isinstance(result, dict) and result.get("appointment_id") is not None:
+				accepted[str(result.get("appointment_id"))] = result.get("success") is True
+	else:
+		printline("unexpected batch reply: " + str(reply))
+	results = []
+	for appt in message_obj.appointments:
+		results.append([appt.appointment_id, accepted.get(str(appt.appointment_id), False)])
+	return results
+
 """
 Device message JSON format
 Initial Appt request (via "/getappointments/alpha/v1" path):
@@ -400,6 +2043,29 @@ JSON response with appt:
 	    }
 	]
 
+Initial message with a sync cursor (delta sync):
+	{
+		"device_id": "838458",
+		"device_password": "heyaedin",
+		"device_battery_level": 80.4,
+		"sync": {"cursor": "2021-03-25T08:58:29.270", "count": 2, "digest": "5f1d7a3c"}
+	}
+	cursor is the server_date_time of the last reply the device stored in full, count and digest
+	describe the ids of the stored appointments that are not cancelled: digest is the crc32 (8 hex
+	digits) of the sorted ids written as "86179341,86179342,"
+	if the cursor is known and the digest matches, the server replies with only the appointments
+	added, changed or cancelled after the cursor and marks the reply as a delta, otherwise it
+	sends every appointment as usual ("sync": "full" or no sync key)
+	{
+		'server_date_time': '2021-03-25T09:10:02.118',
+		'sync': 'delta'
+	}
+	a cancellation in a delta reply only needs the id:
+	[
+		{'server_date_time': '2021-03-25T09:10:02.118', 'sync': 'delta'},
+		{"fields": {"appointment_ID": 86179341, "cancelled": true}}
+	]
+
 Appointment update (via "devicemessagehandler/alpha/v1/" path):
 	{
     	"device_id": "838458",
@@ -409,6 +2075,41 @@ Appointment update (via "devicemessagehandler/alpha/v1/" path):
     	"response_date_time": "2020-12-24 17:00:00",
     	"device_battery_level": 80.4
 	}
+
+Batch reply support is advertised in the initial response:
+	{
+		'server_date_time': '2021-03-25T08:58:29.270',
+		'batch_replies': true
+	}
+
+Batched appointment update (via "devicemessagehandler/alpha/v1/" path):
+	{
+		"device_id": "838458",
+		"device_password": "heyaedin",
+		"device_battery_level": 80.4,
+		"answers": [
+			{"appointment_id": "86179341", "answer": 1, "response_date_time": "2020-12-24 17:00:00"},
+			{"appointment_id": "86179342", "answer": 0, "response_date_time": "2020-12-24 17:05:00"}
+		]
+	}
+
+JSON response to a batched update:
+	{
+		"results": [
+			{"appointment_id": "86179341", "success": true},
+			{"appointment_id": "86179342", "success": false}
+		]
+	}
+
+Compact encoding (cbor, RFC 8949):
+	the device sends "Accept: application/cbor, application/json" with the initial post, a server
+	that supports the compact encoding replies to it with "Content-Type: application/cbor" and the
+	device then sends its replies with that content type too (the initial post stays json), the
+	server replies to a message in the encoding it was sent in
+	messages hold the same fields as json, map keys are sent as their position in WIRE_KEYS and
+	datetimes (WIRE_DATETIME_KEYS) as seconds since 2000-01-01, so the appointment update above is
+	{0: "838458", 1: "heyaedin", 2: 80.4, 3: "86179341", 4: 1, 5: 661712400}
+	keys that are not in WIRE_KEYS are sent as strings
 """
 class Dev_Message:
 	#all messages need a device id, device password, and battery level value
@@ -417,42 +2118,64 @@ class Dev_Message:
 		self.device_id = dev_id
 		self.device_password = server_pass
 		self.battery_level = batt_level
-		#set appointments to none for now, will be added with function
-		self.appointment = None
+		#appointments whose newest answer is sent with this message, added with function
+		self.appointments = []
+		#sync cursor and digest of the stored appointments, added with function
+		self.sync = None
 
 	#compile device message data into json obj
 	def get_json(self):
-		#if there is an appointment object
-		if self.appointment is not None:
-			newest_answer = None
-			highest_answer = 0
-			for answer in self.appointment.answers:
-				if answer["number"] > highest_answer:
-					newest_answer = answer
-					highest_answer = answer["number"]
-
-			#include appointment information in formatted JSON message (appt update format)
-			formatted_json ={ 	
-								"device_id": self.device_id,
-								"device_password": self.device_password,
-								"appointment_id": self.appointment.appointment_id,
-								"answer": newest_answer["answer"],
-								"response_date_time": newest_answer["time_answered"],
-								"device_battery_level": self.battery_level
-							}
-		else:
-			#if there is no appointment object
-			#create regular JSON message (initial message format)
-			formatted_json ={ 	
-								"device_id": self.device_id,
-								"device_password": self.device_password,
-								"device_battery_level": self.battery_level
-							}
+		#create regular JSON message (initial message format)
+		formatted_json ={ 	
+							"device_id": self.device_id,
+							"device_password": self.device_password,
+							"device_battery_level": self.battery_level
+						}
+		#include appointment information in formatted JSON message (appt update format)
+		if len(self.appointments) == 1:
+			formatted_json.update(get_answer_json(self.appointments[0]))
+		#more than one appointment is sent as a list (batch reply format)
+		elif self.appointments:
+			formatted_json["answers"] = [get_answer_json(appt) for appt in self.appointments]
+		#include the sync cursor (initial message with delta sync)
+		if self.sync is not None:
+			formatted_json["sync"] = self.sync
 		return formatted_json
 
+	#function to ask the server for the appointment changes made after cursor only
+	#cursor is the server_date_time of the last stored reply and digest is [count, crc32] of the
+	#stored appointment ids (see FileIO.get_sync_cursor and get_sync_digest)
+	def include_sync_cursor(self, cursor, digest):
+		if cursor is not None:
+			self.sync = {"cursor": cursor, "count": digest[0], "digest": digest[1]}
+
 	#function to add appointment information to this message
+	#can be called more than once, the message is then sent in the batch reply format
 	def include_appointment_answer(self, appointment_obj):
-		self.appointment = appointment_obj
+		self.appointments.append(appointment_obj)
+
+	#function to split this message into messages of at most size appointments each
+	def split(self, size):
+		messages = []
+		for i in range(0, len(self.appointments), size):
+			message = Dev_Message(self.device_id, self.device_password, self.battery_level)
+			message.appointments = self.appointments[i:i+size]
+			messages.append(message)
+		return messages
+
+#function to get the answer fields of an appointment reply (its newest answer)
+def get_answer_json(appointment_obj):
+	newest_answer = None
+	highest_answer = 0
+	for answer in appointment_obj.answers:
+		if answer["number"] > highest_answer:
+			newest_answer = answer
+			highest_answer = answer["number"]
+	return 	{
+				"appointment_id": appointment_obj.appointment_id,
+				"answer": newest_answer["answer"],
+				"response_date_time": newest_answer["time_answered"]
+			}
 
 #class to store appointment information in a cleanly formatted way
 class Appointment:
@@ -50,11 +50,138 @@ class communication_configuration:
 	INIT_MESSAGE_PATH	= "/getappointments/alpha/v1/"
 	#URL path where appointment reminder replies will be sent
 	REPLY_MESSAGE_PATH 	= "/devicemessagehandler/alpha/v1/"
+	#maximum number of appointment answers sent in one batch reply post
+	REPLY_BATCH_SIZE	= const(8)
+	#time (in seconds) a server connection waits for data before the request fails
+	HTTP_TIMEOUT		= const(10)
+	#size (in bytes) of the buffer responses are read from the socket through
+	HTTP_BUFFER_SIZE	= const(256)
+	#longest status or header line (in bytes) that is kept, longer lines are cut off
+	HTTP_LINE_SIZE		= const(128)
+	#initial size (in bytes) of the buffer a response body is collected in (grows when needed)
+	HTTP_BODY_SIZE		= const(512)
+	#ask for deflate or gzip compressed responses (only if the firmware has uzlib)
+	HTTP_COMPRESSION	= True
+	#window (2^n bytes) responses are decompressed with (zlib wbits 8 to 15), 15 (32 KB) is the
+	#window standard deflate and gzip compress with, a smaller window saves memory but only
+	#decodes replies the server compressed with a window no larger than it (zlib wbits set)
+	HTTP_DEFLATE_WBITS	= const(15)
+	#offer the server the compact message encoding (cbor, see comms.WIRE_KEYS), json is used
+	#if the server does not reply with it
+	COMPACT_ENCODING	= True
 
 	#access point specific variables
 	#access point ssid that is shown when user trys to connect to wifi network
 	AP_SSID				= "Doccolink-Device"
 	AP_PASSWORD			= ""
+	#most portal connections served at once, more are closed right away
+	AP_MAX_CONNECTIONS	= const(4)
+	#time (in seconds) a portal connection has to send its request and take the response
+	AP_CONNECTION_TIMEOUT	= const(5)
+	#most bytes read from a portal connection at a time
+	AP_READ_SIZE		= const(256)
+	#longest request line (in bytes) a portal request may have, longer header lines are cut off
+	AP_LINE_SIZE		= const(256)
+	#largest portal request body (in bytes), larger ones are refused
+	AP_BODY_SIZE		= const(1024)
+	#most bytes written to a portal connection at a time (pages are sent in chunks of this size)
+	AP_WRITE_SIZE		= const(256)
+	#directory of the files the portal serves as they are (favicon.ico, images, css)
+	AP_STATIC_DIR		= "static"
+	#time (in seconds) browsers keep static files before checking them again
+	AP_STATIC_MAX_AGE	= const(604800)
+	#time (in seconds) without a connection after which the portal stops
+	AP_IDLE_TIMEOUT		= const(600)
+	#time (in ms) between checks for new connections and button presses while the portal runs
+	AP_POLL_INTERVAL	= const(50)
+
+	#wifi station variables
+	#connect straight to the access point of the last wake (same bssid and ip lease) before scanning
+	WIFI_FAST_CONNECT	= True
+	#time (in ms) to wait for the fast connect before falling back to a scan
+	WIFI_FAST_CONNECT_TIMEOUT	= const(1500)
+	#ranking of scanned networks, score is rssi (dBm) + WEIGHT*(share of connects that worked)
+	#- (average connect time in ms)/SCALE, so a network that always works gets up to 20 dB
+	#and every second of average connect time costs 4 dB
+	WIFI_RANK_SUCCESS_WEIGHT	= const(20)
+	WIFI_RANK_LATENCY_SCALE		= const(250)
+	#time (in ms) slept between checks while waiting for a radio to connect
+	RADIO_POLL_INTERVAL	= const(20)
+
+	#cellular modem variables
+	#try the cellular modem before wifi, set True on boards fitted with a modem
+	#(off by default so a board without one never spends a wake pulse and boot timeout looking for it)
+	CELL_ENABLED		= False
+	#access point name of the cellular data network (given by the sim provider)
+	CELL_APN			= "internet"
+	#uart the modem is connected to, and its baud rate
+	CELL_UART			= const(2)
+	CELL_BAUDRATE		= const(115200)
+	#size (in bytes) of the buffer modem output is read through, and longest modem line kept
+	CELL_BUFFER_SIZE	= const(256)
+	CELL_LINE_SIZE		= const(128)
+	#most response body bytes read from the modem at a time
+	CELL_READ_SIZE		= const(256)
+	#size (in bytes) of the buffer response headers are read into (only the content type is used)
+	CELL_HEAD_SIZE		= const(512)
+	#time (in ms) a command waits for its final result
+	CELL_COMMAND_TIMEOUT	= const(2000)
+	#time (in ms) the modem has to answer AT when checking if it is awake
+	CELL_PING_TIMEOUT	= const(300)
+	#length (in ms) of the wake pin pulse that powers the modem on or wakes it from PSM
+	CELL_WAKE_PULSE		= const(1000)
+	#time (in ms) the modem has to answer after the wake pulse
+	CELL_BOOT_TIMEOUT	= const(10000)
+	#time (in ms) to wait for network registration (only when the modem is not registered)
+	CELL_REGISTER_TIMEOUT	= const(60000)
+	#time (in ms) to wait for the data bearer to open
+	CELL_BEARER_TIMEOUT	= const(30000)
+	#time (in ms) the modem waits for the body of a request, and the response to a request
+	CELL_DATA_TIMEOUT	= const(5000)
+	CELL_HTTP_TIMEOUT	= const(30000)
+	#time (in ms) slept between checks for modem output
+	CELL_POLL_INTERVAL	= const(10)
+	#power saving mode, the modem stays registered while the device sleeps (3GPP 27.007 +CPSMS)
+	#timers are 3 unit bits and 5 value bits, periodic update (T3412) every 10 hours (010 x 1),
+	#active time (T3324) of 10 seconds after the last message before the modem sleeps (000 x 5)
+	CELL_PSM			= True
+	CELL_PSM_TAU		= "01000001"
+	CELL_PSM_ACTIVE		= "00000101"
+	#extended discontinuous reception while the device is awake (3GPP 27.007 +CEDRXS)
+	#access technology 4 (LTE-M) with a paging cycle of 81.92 seconds (0101)
+	CELL_EDRX			= True
+	CELL_EDRX_ACT		= const(4)
+	CELL_EDRX_CYCLE		= "0101"
+
+#class to store options for how device data is kept on flash (see file_funcs.py)
+class storage_configuration:
+	#storage backend used by FileIO for the appointments section
+	#(device_info.json, wifi_params.json and clock.json are small and always rewritten)
+	#"snapshot" rewrites all appointments on every commit
+	#"journal" appends small mutation records to appointments.journal and compacts periodically
+	BACKEND				= "snapshot"
+	#size (in bytes) appointments.journal may grow to before it is compacted into a snapshot
+	JOURNAL_COMPACT_SIZE		= const(4096)
+	#format appointments are stored in
+	#"json" keeps them in appointments.json
+	#"packed" stores fixed width binary records in appointments.bin that are decoded when used
+	#appointments stored in the other format are still read, and are moved to this one by FileIO
+	#when it loads them ("packed") or next writes them ("json"), no separate conversion is needed
+	APPOINTMENT_FORMAT		= "json"
+	#size (in bytes) of the buffer json files are read and written through
+	#peak memory used to read or write a file does not grow past this with the file size
+	STREAM_BUFFER_SIZE		= const(256)
+	#maximum number of appointments with answers waiting to be sent to the server
+	#the oldest answer is dropped when an answer for another appointment is queued while full
+	OUTBOX_SIZE			= const(32)
+	#retention policy, applied whenever the appointments are written
+	#passed appointments are removed once all their answers have been sent
+	#maximum number of appointments stored, passed ones (still waiting to send an answer) are
+	#dropped oldest first, upcoming ones are always kept (the server would send them again)
+	MAX_APPOINTMENTS		= const(64)
+	#maximum number of answers kept per appointment, only sent answers that were replaced by a
+	#newer answer to the same reminder are removed (so up to one answer per reminder is always kept)
+	MAX_ANSWERS			= const(6)
 
 #class to store any and all extra parameters
 class extra_params:
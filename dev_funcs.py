@@ -45,6 +45,77 @@ def printline(string_to_print):
 	else:
 		pass
 
+#number of days between 1970-01-01 and 2000-01-01 (micropython epoch starts in 2000)
+EPOCH_2000_DAYS = const(10957)
+
+#function to get the number of days since 2000-01-01 for a date
+#works for any date without using the time module (proleptic gregorian calendar)
+def days_from_date(year, month, day):
+	#move january and february to the end of the previous year (leap day is last)
+	if month <= 2:
+		year -= 1
+	era = year // 400
+	year_of_era = year - era*400
+	if month > 2:
+		day_of_year = (153*(month-3) + 2)//5 + day-1
+	else:
+		day_of_year = (153*(month+9) + 2)//5 + day-1
+	day_of_era = year_of_era*365 + year_of_era//4 - year_of_era//100 + day_of_year
+	#days since 1970-01-01, then shift to 2000-01-01
+	return era*146097 + day_of_era - 719468 - EPOCH_2000_DAYS
+
+#function to get the date for a number of days since 2000-01-01, returns (year, month, day)
+def date_from_days(days):
+	days += 719468 + EPOCH_2000_DAYS
+	era = days // 146097
+	day_of_era = days - era*146097
+	year_of_era = (day_of_era - day_of_era//1460 + day_of_era//36524 - day_of_era//146096)//365
+	day_of_year = day_of_era - (365*year_of_era + year_of_era//4 - year_of_era//100)
+	month_index = (5*day_of_year + 2)//153
+	day = day_of_year - (153*month_index + 2)//5 + 1
+	if month_index < 10:
+		month = month_index + 3
+	else:
+		month = month_index - 9
+	year = year_of_era + era*400
+	if month <= 2:
+		year += 1
+	return year, month, day
+
+#function to turn a datetime string (formatted like "2021-03-25T08:27:30.969")
+#into seconds since 2000-01-01, fractions of a second are dropped
+def datetime_to_epoch(datetime_string):
+	#split string into time and date sections
+	if datetime_string.find('T') >= 0:
+		split_data = datetime_string.split('T')
+	else:
+		split_data = datetime_string.split(' ')
+	#split date information
+	pdate = split_data[0].split('-')
+	#split time information
+	ptime = split_data[1].split(':')
+	days = days_from_date(int(pdate[0]), int(pdate[1]), int(pdate[2]))
+	return days*86400 + int(ptime[0])*3600 + int(ptime[1])*60 + int(float(ptime[2]))
+
+#function to turn seconds since 2000-01-01 into a datetime string
+#string is formatted the same as Recorded_Time.get_datetime_string
+def epoch_to_datetime(seconds):
+	year, month, day = date_from_days(seconds // 86400)
+	seconds = seconds % 86400
+	values = (month, day, seconds // 3600, (seconds // 60) % 60, seconds % 60)
+	#zero pad every field to 2 digits
+	padded = []
+	for value in values:
+		if value < 10:
+			padded.append("0" + str(value))
+		else:
+			padded.append(str(value))
+	return str(year) + "-" + padded[0] + "-" + padded[1] + "T" + padded[2] + ":" + \
+		padded[3] + ":" + padded[4] + ".000"
+
+#hours before an appointment that reminders 1, 2 and 3 are given (see check_if_appt_reminder_necessary)
+REMINDER_HOURS = (48, 24, 5)
+
 #class to act as a datetime object since it doesnt exist in time module
 #takes a string (formatted like "2021-03-25T08:27:30.969")
 class Recorded_Time:
@@ -2,30 +2,183 @@
 File input and output functions
 """
 import ujson as json
-from dev_funcs import printline, Recorded_Time
+import uos
+import ustruct
+import ubinascii
+from time import ticks_ms, ticks_diff
+from config import storage_configuration as storeconf
+from dev_funcs import printline, Recorded_Time, datetime_to_epoch, epoch_to_datetime, REMINDER_HOURS
 from comms import Appointment
+from json_stream import Json_Reader, Json_Writer
 
-#class to store data imported from local json config file
+#device data is split into sections that are stored in their own files (see make_stores)
+#a section is only read from flash the first time it is used, and a mutation only rewrites
+#the section it changes, so saving the time before deepsleep does not rewrite wifi credentials
+#or appointments
+#
+#section each mutation record changes, keyed by the record op
+RECORD_SECTIONS = 	{
+						"time": "clock",
+						"sync": "clock",
+						"quiet": "device_info",
+						"add": "appointments",
+						"remove": "appointments",
+						"cancel": "appointments",
+						"update": "appointments",
+						"answer": "appointments",
+						"clear_answers": "appointments",
+						"sent": "appointments",
+						"trim_answers": "appointments",
+						"add_wifi": "wifi_params",
+						"remove_wifi": "wifi_params",
+						"wifi_result": "wifi_stats",
+						"queue": "outbox",
+						"ack": "outbox"
+					}
+
+#class to store data imported from local json config files
+#the parsed data is kept in memory and is the authoritative copy of the device state,
+#mutations change it in place and are written back to flash with a single write per section
+#every mutation is described by a small record (a list like ["cancel", 111111]) so a
+#storage backend can persist either the full section or only the records (see Journal_Store)
+#
+#a State_Cache can be passed in to keep the hot state (time, next reminder, unsent answers,
+#last network) in memory that survives deepsleep, a timer wake with nothing due then reads
+#nothing but device_info and the clock (its generation must match the cache) from flash
 class FileIO:
-	def __init__(self):
-		#build all of the variables from data.json file
-		self.load_local_vars()
+	def __init__(self, stores=None, cache=None):
+		#storage backend for each section (built from config if not passed in)
+		if stores is None:
+			stores = make_stores()
+		self.stores = stores
+		#number of open transactions, writes are deferred until this drops back to 0
+		self.transaction_depth = 0
+		#loaded sections (section name to section data), filled in by section()
+		self.data = {}
+		#mutation records per section that have not been written yet
+		self.pending_records = {}
+		#index of appointment_id to position in the appointments list (kept current by apply_record)
+		#positions are used so packed appointments (see Packed_Appointments) are only decoded when used
+		self.appointment_index = {}
+		#index of appointment_id to number of unsent answers, only holds appointments with unsent answers
+		self.unsent_index = {}
+		#buffer reused by every streamed json read and write (see json_stream.py)
+		self.stream_buffer = bytearray(storeconf.STREAM_BUFFER_SIZE)
+		#flash write statistics for this wake cycle (see print_io_stats)
+		self.write_count = 0
+		self.bytes_written = 0
+		self.write_time = 0
+		#retained state cache (see State_Cache), None keeps all state on flash
+		self.cache = cache
+		#state read from the cache, None if there is no cache or it failed validation
+		self.cached_state = None
+		#ssid of the network the device last connected with (see set_last_network)
+		self.last_network = None
+		#cellular operator the modem last registered on (see set_last_cell)
+		self.last_cell = None
+		#split a data.json written by older firmware into section files
+		#the cache is not used after a migration, it describes the old files
+		if not self.migrate_legacy_data() and cache is not None:
+			self.cached_state = cache.load()
+			if self.cached_state is None:
+				printline("state cache invalid, reading state from flash")
+			#a cache saved with another generation of the clock section than the one on flash
+			#(files changed without the cache, like a copy over USB) describes other state
+			elif self.cached_state["gen"] != self.section("clock").get("gen", 0):
+				printline("state cache out of date, reading state from flash")
+				self.cached_state = None
 		#print the device data after import
 		self.print_dev_data()
 
+	#local variables, each one loads its section from flash the first time it is used
+	@property
+	def dev_id(self):
+		return self.section("device_info")["dev_id"]
+
+	@property
+	def server_pass(self):
+		return self.section("device_info")["server_pass"]
+
+	@property
+	def firm_version(self):
+		return self.section("device_info")["firm_version"]
+
+	@property
+	def quiet_hours(self):
+		return self.section("device_info")["quiet_hours"]
+
+	@property
+	def wifi_networks(self):
+		return self.section("wifi_params")
+
+	@property
+	def wifi_stats(self):
+		return self.section("wifi_stats")
+
+	@property
+	def appointments(self):
+		return self.section("appointments")
+
+	@property
+	def outbox(self):
+		return self.section("outbox")
+
+	@property
+	def last_known_time(self):
+		return self.section("clock")["last_known_time"]
+
+	#function to get a section of device data, reads it from flash on first use
+	def section(self, name):
+		if name not in self.data:
+			value = self.stores[name].load(self)
+			#backends that replay records have already set the section
+			if name not in self.data:
+				self.set_section(name, value)
+		return self.data[name]
+
+	#function to replace a section in memory (rebuilds the appointment indexes if needed)
+	def set_section(self, name, value):
+		self.data[name] = value
+		if name == "appointments":
+			self.build_indexes()
+
+	#function to drop all loaded sections so they are read from flash again when next used
+	#pending changes are written first
 	def load_local_vars(self):
-		#read in unparsed json data
-		unparsed_data = self.read_in_file()
-		#parse json data into dict objects
-		pdata = json.loads(unparsed_data)
-		#assign parsed json data to local variables
-		self.dev_id = pdata["device_info"]["dev_id"]
-		self.server_pass = pdata["device_info"]["server_pass"]
-		self.firm_version = pdata["device_info"]["firm_version"]
-		self.wifi_networks = pdata["wifi_params"]
-		self.appointments = pdata["appointments"]
-		self.last_known_time = pdata["device_info"]["last_known_time"]
-		self.quiet_hours = pdata["device_info"]["quiet_hours"]
+		self.commit()
+		self.data = {}
+
+	#function to rebuild the appointment indexes from the appointments list
+	#reads ids and answer flags without decoding packed appointments
+	def build_indexes(self):
+		appointments = self.data["appointments"]
+		self.appointment_index = {}
+		self.unsent_index = {}
+		for i in range(len(appointments)):
+			appt_id = appointment_id_at(appointments, i)
+			#the index keeps the first record if an id was stored twice (same as the old linear search)
+			if appt_id not in self.appointment_index:
+				self.appointment_index[appt_id] = i
+				unsent = appointment_unsent_at(appointments, i)
+				if unsent:
+					self.unsent_index[appt_id] = unsent
+
+	#function to get the appointment record (dict) for an id, returns None if not stored
+	def find_appointment(self, appointment_id):
+		appointments = self.appointments
+		position = self.appointment_index.get(appointment_id)
+		if position is None:
+			return None
+		return appointments[position]
+
+	#function to recount the unsent answers of one appointment record
+	#appointments only hold a few answers so this is constant time
+	def update_unsent_index(self, appt):
+		unsent = count_unsent(appt)
+		if unsent:
+			self.unsent_index[appt["appointment_id"]] = unsent
+		elif appt["appointment_id"] in self.unsent_index:
+			del self.unsent_index[appt["appointment_id"]]
 
 	#function to print basic device info
 	def print_dev_data(self):
@@ -35,6 +188,319 @@ class FileIO:
 		#print constructed string
 		print(ts)
 
+	#function to print flash write statistics gathered since this object was created
+	def print_io_stats(self):
+		printline("flash writes: " + str(self.write_count) + " | bytes written: " + \
+		str(self.bytes_written) + " | write time: " + str(self.write_time) + " ms")
+
+	#function to start a transaction, use as "with dev_info.transaction():"
+	#every mutation made inside the with block is written to flash once, when the block exits
+	def transaction(self):
+		return File_Transaction(self)
+
+	#function to open a transaction without a with block, must be paired with end()
+	def begin(self):
+		self.transaction_depth += 1
+
+	#function to close a transaction opened with begin(), writes once the outermost one closes
+	def end(self):
+		if self.transaction_depth > 0:
+			self.transaction_depth -= 1
+		if self.transaction_depth == 0:
+			self.commit()
+
+	#function to apply a mutation record to the in memory data and persist it
+	#the write is deferred if a transaction is open
+	def mutate(self, record):
+		self.add_record(record)
+		#write immediately if not inside a transaction
+		if self.transaction_depth == 0:
+			self.commit()
+
+	#function to apply a mutation record and keep it for the next commit
+	def add_record(self, record):
+		#change the in memory data
+		self.apply_record(record)
+		#keep the record so the storage backend of its section can persist it
+		section_name = RECORD_SECTIONS[record[0]]
+		if section_name not in self.pending_records:
+			self.pending_records[section_name] = []
+		self.pending_records[section_name].append(record)
+
+	#function to write pending in memory changes to flash (does nothing if no changes)
+	#only sections that were changed are written
+	#the state cache is cleared before the writes and saved after them, so a power loss
+	#part way through leaves no cache and the next wake reads flash
+	def commit(self):
+		if not self.pending_records:
+			return
+		if self.cache is not None:
+			self.cache.clear()
+		#the retention policy runs when the appointments are written anyway
+		if "appointments" in self.pending_records:
+			self.prune_appointments()
+		for name in self.pending_records:
+			#let the storage backend decide how to persist the changes
+			self.stores[name].commit(self, self.data[name], self.pending_records[name])
+		self.pending_records = {}
+		if self.cache is not None:
+			self.save_state_cache()
+
+	#function to apply the retention policy (see storage_configuration) to the appointments
+	#removes passed appointments once all their answers are sent, trims old answers and drops
+	#passed appointments over MAX_APPOINTMENTS, the changes are added as records so they are
+	#written (or journaled) together with the commit that called this
+	#upcoming appointments are never dropped, the server would send them again on every sync
+	def prune_appointments(self):
+		appointments = self.appointments
+		now = datetime_to_epoch(self.last_known_time)
+		removed = []
+		#[time, appointment_id] of passed appointments that still have unsent answers
+		passed = []
+		for i in range(len(appointments)):
+			appt_id = appointment_id_at(appointments, i)
+			appt_time = appointment_time_at(appointments, i)
+			#appointments that have not started yet are kept
+			if appt_time < now:
+				if appointment_unsent_at(appointments, i):
+					passed.append([appt_time, appt_id])
+				else:
+					removed.append(appt_id)
+			#packed records hold one answer per reminder, so only json appointments can grow
+			if not isinstance(appointments, Packed_Appointments) and len(appointments[i]["answers"]) > storeconf.MAX_ANSWERS:
+				self.add_record(["trim_answers", appt_id, storeconf.MAX_ANSWERS])
+		#over the size limit, drop passed appointments (oldest first)
+		extra = len(appointments) - len(removed) - storeconf.MAX_APPOINTMENTS
+		if extra > 0:
+			passed.sort()
+			for appt_time, appt_id in passed[:extra]:
+				printline("appointment store full, dropping appt " + str(appt_id))
+				removed.append(appt_id)
+				#its queued answer can not be sent anymore
+				self.add_record(["ack", appt_id, None])
+		#one record for all of them, so the indexes are only rebuilt once
+		if removed:
+			self.add_record(["remove"] + removed)
+
+	#function to write the hot state to the state cache
+	#values that need the appointments are taken from the old cache if appointments are not loaded
+	def save_state_cache(self):
+		clock = self.section("clock")
+		state = 	{
+						"gen": clock.get("gen", 0),
+						"last_known_time": clock["last_known_time"],
+						"next_due": self.get_next_reminder_time(),
+						"unsent": self.get_unsent_count(),
+						"network": self.get_last_network(),
+						"cell": self.get_last_cell(),
+						"cursor": clock.get("sync_cursor"),
+						"digest": self.get_sync_digest()
+					}
+		self.cache.save(state)
+		self.cached_state = state
+
+	#function to get when the next reminder (or removal of a passed or cancelled appointment) is due
+	#returns seconds since 2000 (see dev_funcs.datetime_to_epoch), or None if nothing is stored
+	def get_next_reminder_time(self):
+		if "appointments" not in self.data and self.cached_state is not None:
+			return self.cached_state["next_due"]
+		appointments = self.appointments
+		next_due = None
+		for i in range(len(appointments)):
+			due = appointment_due_at(appointments, i)
+			if next_due is None or due < next_due:
+				next_due = due
+		return next_due
+
+	#function to get the number of appointment answers waiting in the outbox
+	def get_unsent_count(self):
+		if "outbox" not in self.data and self.cached_state is not None:
+			return self.cached_state["unsent"]
+		return len(self.outbox)
+
+	#function to get the sync cursor, the server_date_time of the last initial post reply that was
+	#stored in full (see set_sync_cursor), None if the device has not synced yet
+	def get_sync_cursor(self):
+		return self.section("clock").get("sync_cursor")
+
+	#function to save the sync cursor, the server then only sends appointment changes made after it
+	#only call this once every appointment of the reply is stored
+	def set_sync_cursor(self, server_date_time):
+		self.mutate(["sync", server_date_time])
+
+	#function to get the digest of the stored appointments sent with the sync cursor
+	#returns [count, crc32 (8 hex digits)] of the ids of the appointments that are not cancelled,
+	#sorted and written as "id,id,...,", the server sends every appointment again if it does not match
+	def get_sync_digest(self):
+		if "appointments" not in self.data and self.cached_state is not None:
+			return self.cached_state["digest"]
+		appointments = self.appointments
+		ids = []
+		for i in range(len(appointments)):
+			if not appointment_cancelled_at(appointments, i):
+				ids.append(int(appointment_id_at(appointments, i)))
+		ids.sort()
+		crc = 0
+		for appt_id in ids:
+			crc = ubinascii.crc32(str(appt_id).encode() + b",", crc)
+		return [len(ids), "%08x" % (crc & 0xFFFFFFFF)]
+
+	#function to record the network the device connected with, saved in the state cache
+	#(Dev_WiFi.connected_network, a dict of ssid, bssid, channel and ip lease)
+	def set_last_network(self, ssid):
+		self.last_network = ssid
+
+	#function to get the network the device last connected with, None if not known
+	def get_last_network(self):
+		if self.last_network is None and self.cached_state is not None:
+			return self.cached_state["network"]
+		return self.last_network
+
+	#function to record the cellular operator the modem registered on, saved in the state cache
+	#(Dev_Cell.registered_network, a dict of plmn and access technology), False if no modem answered
+	def set_last_cell(self, operator):
+		self.last_cell = operator
+
+	#function to get the cellular operator the modem last registered on, None if not known
+	#(False if no modem answered, see Dev_Cell)
+	def get_last_cell(self):
+		if self.last_cell is None and self.cached_state is not None:
+			return self.cached_state["cell"]
+		return self.last_cell
+
+	#function to apply a single mutation record to the in memory data
+	#used by mutate() and when a storage backend replays its journal
+	#appointment records are found through appointment_index, which is kept current here
+	def apply_record(self, record):
+		op = record[0]
+		if op not in RECORD_SECTIONS:
+			printline("unknown file record: " + str(record))
+			return
+		#section the record changes (loaded if this is the first use)
+		section = self.section(RECORD_SECTIONS[op])
+		#appointment record the mutation targets (None for non appointment records or unknown ids)
+		appt = None
+		if RECORD_SECTIONS[op] == "appointments" and record[1] in self.appointment_index:
+			appt = self.find_appointment(record[1])
+		#["time", datetime_string]
+		if op == "time":
+			section["last_known_time"] = record[1]
+			#generation of the clock, copied into the state cache
+			section["gen"] = section.get("gen", 0) + 1
+		#["sync", server_date_time]
+		elif op == "sync":
+			section["sync_cursor"] = record[1]
+		#["quiet", start, end]
+		elif op == "quiet":
+			section["quiet_hours"] = {"start_time": record[1], "end_time": record[2]}
+		#["add", appointment_id, appointment_date_time]
+		elif op == "add":
+			new_appt = 	{
+							"appointment_id": record[1],
+							"appointment_date_time": record[2],
+							"answers" : [],
+							"cancelled" : False
+						}
+			section.append(new_appt)
+			#the index keeps the first record if an id is added twice (same as the old linear search)
+			if appt is None:
+				self.appointment_index[record[1]] = len(section)-1
+		#["remove", appointment_id, ...], any number of ids
+		elif op == "remove":
+			removed = {}
+			for appt_id in record[1:]:
+				if appt_id in self.appointment_index:
+					removed[appt_id] = True
+			if removed:
+				#remove every record with these ids (duplicates could have been stored), last first
+				for i in range(len(section)-1, -1, -1):
+					if appointment_id_at(section, i) in removed:
+						del section[i]
+				#positions after the removed records have moved
+				self.build_indexes()
+		#["cancel", appointment_id]
+		elif op == "cancel":
+			if appt is not None:
+				appt["cancelled"] = True
+		#["update", appointment_id, appointment_date_time, cancelled]
+		elif op == "update":
+			if appt is not None:
+				appt["appointment_date_time"] = record[2]
+				appt["cancelled"] = record[3]
+		#["answer", appointment_id, answer, time_answered, number]
+		elif op == "answer":
+			if appt is not None:
+				appt["answers"].append({
+										"answer": record[2],
+										"time_answered": record[3],
+										"number": record[4],
+										"sent": False
+										})
+				self.update_unsent_index(appt)
+		#["clear_answers", appointment_id]
+		elif op == "clear_answers":
+			if appt is not None:
+				appt["answers"] = []
+				self.update_unsent_index(appt)
+		#["sent", appointment_id, number, status]
+		elif op == "sent":
+			if appt is not None:
+				for answer in appt["answers"]:
+					if record[2] == answer["number"]:
+						answer["sent"] = record[3]
+					#older unsent answers were coalesced into the sent one (see Outbox)
+					elif record[3] and answer["number"] < record[2] and answer["sent"] == False:
+						answer["sent"] = True
+				self.update_unsent_index(appt)
+		#["trim_answers", appointment_id, max_answers]
+		elif op == "trim_answers":
+			if appt is not None:
+				answers = appt["answers"]
+				i = 0
+				while len(answers) > record[2] and i < len(answers):
+					#only sent answers replaced by a newer answer to the same reminder are dropped
+					replaced = False
+					for later in answers[i+1:]:
+						if later["number"] == answers[i]["number"]:
+							replaced = True
+					if replaced and answers[i]["sent"]:
+						del answers[i]
+					else:
+						i += 1
+				self.update_unsent_index(appt)
+		#["add_wifi", ssid, password]
+		elif op == "add_wifi":
+			section.append({"ssid": record[1], "password": record[2]})
+		#["remove_wifi", ssid]
+		elif op == "remove_wifi":
+			for i in range(len(section)-1, -1, -1):
+				if section[i]["ssid"] == record[1]:
+					del section[i]
+		#["wifi_result", ssid, connected, latency_ms]
+		elif op == "wifi_result":
+			if record[1] not in section:
+				section[record[1]] = {"ok": 0, "fail": 0, "latency": 0}
+			stats = section[record[1]]
+			if record[2]:
+				#running average that follows the recent connects
+				if stats["ok"]:
+					stats["latency"] = (stats["latency"]*3 + record[3]) // 4
+				else:
+					stats["latency"] = record[3]
+				stats["ok"] += 1
+			else:
+				stats["fail"] += 1
+			#halve the counts so old results fade out
+			if stats["ok"] + stats["fail"] > WIFI_STATS_LIMIT:
+				stats["ok"] //= 2
+				stats["fail"] //= 2
+		#["queue", appointment_id, number]
+		elif op == "queue":
+			section.push(record[1], record[2])
+		#["ack", appointment_id, number], number is None to drop the entry whatever its answer
+		elif op == "ack":
+			section.ack(record[1], record[2])
+
 	#function to update time in json file with current time
 	#takes a Recorded_Time instance (preferred) or a string (not as good)
 	#no formatting, if time is rewritten incorrectly it could cause a failure
@@ -49,76 +515,77 @@ class FileIO:
 			#otherwise write new_time with current_time object or string
 			#this is where failure could happen, use cautiously
 			new_time = current_time
-
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
 		#rewrite last_known_time
-		read_in_data["device_info"]["last_known_time"] = new_time
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
+		self.mutate(["time", new_time])
 
 	def update_quiet_hours(self, start=None, end=None):
-		#define new quiet hours json
-		quiet_hours = 	{
-								"start_time": start,
-								"end_time": end
-							}
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#rewrite old unmodified quiet hours entry (preserves all data)
-		read_in_data["device_info"]["quiet_hours"] = quiet_hours
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
+		#rewrite quiet hours entry
+		self.mutate(["quiet", start, end])
 
 	#function takes an Appointment object and adds appointment to appointments object
 	def add_appointment(self, new_appt):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the appointment data
-		appointments = read_in_data["appointments"]
-		#create new JSON of new appt to add
-		appt_to_add = 	{
-							"appointment_id": int(new_appt.appointment_id),
-							"appointment_date_time": new_appt.appointment_date_time,
-							"answers" : [],
-							"cancelled" : False
-						}
 		#append new appointment onto appointment JSON obj
-		appointments.append(appt_to_add)
-		#rewrite old unmodified appointment entry (preserves all data)
-		read_in_data["appointments"] = appointments
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
+		self.mutate(["add", int(new_appt.appointment_id), new_appt.appointment_date_time])
+
+	#function to merge a list of Appointment objects sent by the server into the stored appointments
+	#new appointments are added, stored ones are updated (time, cancellation) and keep their answers,
+	#cancellations of appointments that are not stored are ignored
+	#only changes are recorded and they are written once, so a sync that repeats stored
+	#appointments writes nothing
+	#a delta sync can send a cancellation without its time (appointment_date_time None)
+	#returns a dict with the ids of every appointment in the list (see remove_unlisted_appointments)
+	def reconcile_appointments(self, new_appts):
+		listed = {}
+		with self.transaction():
+			for new_appt in new_appts:
+				appt_id = int(new_appt.appointment_id)
+				listed[appt_id] = True
+				appt = self.find_appointment(appt_id)
+				if appt is None:
+					if not new_appt.cancelled and new_appt.appointment_date_time is not None:
+						printline("new appt " + str(appt_id) + " added to system")
+						self.mutate(["add", appt_id, new_appt.appointment_date_time])
+					continue
+				new_time = new_appt.appointment_date_time
+				if new_time is None:
+					new_time = appt["appointment_date_time"]
+				#times are compared as seconds, packed appointments store them in another format
+				if appt["cancelled"] != new_appt.cancelled or \
+				datetime_to_epoch(appt["appointment_date_time"]) != datetime_to_epoch(new_time):
+					printline("appt " + str(appt_id) + " changed, updating system")
+					self.mutate(["update", appt_id, new_time, new_appt.cancelled])
+		return listed
+
+	#function to remove the stored appointments a full sync did not list (listed is returned by
+	#reconcile_appointments), the server no longer has them
+	#appointments with unsent answers are kept until the answers are sent
+	def remove_unlisted_appointments(self, listed):
+		appointments = self.appointments
+		removed = []
+		for i in range(len(appointments)):
+			appt_id = appointment_id_at(appointments, i)
+			if appt_id not in listed and appt_id not in self.unsent_index:
+				printline("appt " + str(appt_id) + " not listed by the server, removing")
+				removed.append(appt_id)
+		if removed:
+			self.mutate(["remove"] + removed)
 
 	#function to remove an appointment from the json file
 	#takes an appointment id as an arg, does not return anything
 	def remove_appointment(self, appointment_id):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the appointment data
-		appointments = read_in_data["appointments"]
-		#make empty dict of appointments that can be filled by loop
-		remaining_appts = []
-		#search through appointments for matching id
-		for appt in appointments:
-			if appt["appointment_id"] != appointment_id:
-				remaining_appts.append(appt)
-		#rewrite old unmodified appointment entry (preserves all other data)
-		read_in_data["appointments"] = remaining_appts
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
-
-	#function to get appoint data stored in data.json
+		with self.transaction():
+			self.mutate(["remove", appointment_id])
+			#an unsent answer of a removed appointment can not be sent anymore
+			self.mutate(["ack", appointment_id, None])
+
+	#function to get appoint data stored in the appointments section
 	#returns None (if no appts) or an array of Appointment objects
 	def get_appointments(self, appt_id=None):
 		if appt_id:
-			for appt in self.appointments:
-				if appt["appointment_id"] == appt_id:
-					return Appointment(appt["appointment_id"],appt["answers"],appt["appointment_date_time"], appt["cancelled"])
+			#look up the appointment record in the index
+			appt = self.find_appointment(appt_id)
+			if appt is not None:
+				return Appointment(appt["appointment_id"],appt["answers"],appt["appointment_date_time"], appt["cancelled"])
 			return None
 		else:
 			#create new array for resulting objects
@@ -137,7 +604,7 @@ class FileIO:
 		appts_arr = []
 		#go through appointments json
 		for appt in self.appointments:
-			if appt.cancelled:
+			if appt["cancelled"]:
 				#create new appointment with json data
 				new_appt = Appointment(appt["appointment_id"],appt["answers"],appt["appointment_date_time"], appt["cancelled"])
 				#add newly created Appointment obj to list to return
@@ -145,151 +612,872 @@ class FileIO:
 		#return the array
 		return appts_arr
 
+	#function to get the answers waiting in the outbox, in the order they should be sent
+	#returns a list of [Appointment, answer_number], one per appointment (the unsent answers
+	#of an appointment are coalesced into its newest one, which is the answer a message carries)
 	def get_unsent_appointment_answers(self):
 		appts_arr = []
-		#go through appointments json
-		for appt in self.appointments:
-			for answer in appt["answers"]:
-				if answer["sent"] == False:
-					#create new appointment with json data
-					new_appt = Appointment(appt["appointment_id"],appt["answers"],appt["appointment_date_time"], appt["cancelled"])
-					highest_answer = 0
-					for i in appt["answers"]:
-						if i["number"] > highest_answer:
-							highest_answer = i["number"]
-					#add newly created Appointment obj to list to return
-					appts_arr.append([new_appt,highest_answer])
+		for entry in self.outbox:
+			appt = self.find_appointment(entry[0])
+			if appt is not None:
+				#create new appointment with json data
+				new_appt = Appointment(appt["appointment_id"],appt["answers"],appt["appointment_date_time"], appt["cancelled"])
+				appts_arr.append([new_appt, entry[1]])
 		#return the array
 		return appts_arr
 
+	#function to get the oldest entry of the outbox ([appointment_id, answer_number]), None if empty
+	def peek_unsent_answer(self):
+		return self.outbox.peek()
+
+	#function to build the outbox from the unsent answers stored with the appointments
+	#used when there is no outbox file yet (first start after a firmware update)
+	def build_outbox(self):
+		outbox = Outbox()
+		appointments = self.appointments
+		for i in range(len(appointments)):
+			if appointment_unsent_at(appointments, i):
+				appt = appointments[i]
+				for answer in appt["answers"]:
+					if answer["sent"] == False:
+						outbox.push(appt["appointment_id"], answer["number"])
+		return outbox
+
+	#function to get the next appointment that has not been cancelled, returns an Appointment or None
+	#only compares start times, so packed appointments other than the result are never decoded
+	def get_next_appointment(self):
+		appointments = self.appointments
+		next_position = None
+		next_time = 0
+		for i in range(len(appointments)):
+			appt_time = appointment_time_at(appointments, i)
+			if (next_position is None or appt_time < next_time) and not appointment_cancelled_at(appointments, i):
+				next_position = i
+				next_time = appt_time
+		if next_position is None:
+			return None
+		appt = appointments[next_position]
+		return Appointment(appt["appointment_id"],appt["answers"],appt["appointment_date_time"], appt["cancelled"])
+
 	#function adds an appointment answer to the specified appt
 	#takes an appt id (int), an answer (True,False,None), and a Recorded_Time object
 	def new_appointment_answer(self, appointment_id, answer, currtime, answer_number):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the appointment data
-		appointments = read_in_data["appointments"]
-		#search through appointments for matching id
-		for appt in appointments:
-			if appt["appointment_id"] == appointment_id:
-				currtime.update_time()
-				new_answer = 	{
-								"answer": answer,
-								"time_answered": currtime.get_datetime_string(),
-								"number": answer_number,
-								"sent": False
-								}
-				appt["answers"].append(new_answer)
-		#rewrite old unmodified appointment entry (preserves all other data)
-		read_in_data["appointments"] = appointments
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
+		#get the current time, stored in the record so a journal replay gives the same answer
+		currtime.update_time()
+		with self.transaction():
+			self.mutate(["answer", appointment_id, answer, currtime.get_datetime_string(), answer_number])
+			#an answer dropped from a full outbox is never sent, it is marked as sent (given up)
+			#so its appointment does not wait for it before it can be removed
+			dropped = self.outbox.overflow(appointment_id)
+			if dropped is not None:
+				self.mutate(["sent", dropped[0], dropped[1], True])
+			#queue the answer to be sent to the server
+			self.mutate(["queue", appointment_id, answer_number])
 
 	def cancel_appointment(self, appointment_id):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the appointment data
-		appointments = read_in_data["appointments"]
-		#search through appointments for matching id
-		for appt in appointments:
-			if appt["appointment_id"] == appointment_id:
-				appt["cancelled"] = True
-		#rewrite old unmodified appointment entry (preserves all other data)
-		read_in_data["appointments"] = appointments
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
+		self.mutate(["cancel", appointment_id])
 
 	def remove_appointment_answer(self, appointment_id):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the appointment data
-		appointments = read_in_data["appointments"]
-		#search through appointments for matching id
-		for appt in appointments:
-			if appt["appointment_id"] == appointment_id:
-				appt["answers"] = []
-		#rewrite old unmodified appointment entry (preserves all other data)
-		read_in_data["appointments"] = appointments
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
+		with self.transaction():
+			self.mutate(["clear_answers", appointment_id])
+			self.mutate(["ack", appointment_id, None])
 
 	#updates answer status (change sent status from false to true)
+	#a sent answer is taken out of the outbox, together with older answers it was coalesced with
 	def update_appointment_answer_status(self, appointment_id, status, number):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the appointment data
-		appointments = read_in_data["appointments"]
-		#search through appointments for matching id
-		for appt in appointments:
-			if appt["appointment_id"] == appointment_id:
-				for answer in appt["answers"]:
-					if number == answer["number"]:
-						answer["sent"] = status
-						
-		#rewrite old unmodified appointment entry (preserves all other data)
-		read_in_data["appointments"] = appointments
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
-
+		with self.transaction():
+			self.mutate(["sent", appointment_id, number, status])
+			if status:
+				self.mutate(["ack", appointment_id, number])
 
-		#function takes an ssid, password, adds wifi network to wifi params
+	#function takes an ssid, password, adds wifi network to wifi params
 	def add_wifi_network(self, ssid, password):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the "wifi_params" section of json data
-		wifi_networks = read_in_data["wifi_params"]
-		#create new JSON of new wifi network to add
-		network_to_add ={
-							"ssid": ssid,
-							"password" : password
-						}
-		#append new network onto wifi_networks JSON obj
-		wifi_networks.append(network_to_add)
-		#rewrite old unmodified wifi_params entry (preserves all other data)
-		read_in_data["wifi_params"] = wifi_networks
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
+		self.mutate(["add_wifi", ssid, password])
+
+	#function to save the connect attempts of a Dev_WiFi (connect_results) in one write
+	#the statistics are used to rank networks on the next scan (see Dev_WiFi.rank_networks)
+	def record_wifi_results(self, results):
+		with self.transaction():
+			for ssid, connected, latency in results:
+				self.mutate(["wifi_result", ssid, connected, latency])
 
 	#function to remove a wifi network entry from the json file
 	#takes a wifi ssid an arg, does not return anything
 	def remove_wifi_network(self, ssid):
-		#read in data from file
-		read_in_data = json.loads(self.read_in_file())
-		#isolate the "wifi_params" section of json data
-		wifi_networks = read_in_data["wifi_params"]
-		#make empty dict of remaining networks that can be filled by loop
-		remaining_networks = []
-		#search through wifi_networks for matching ssid
-		for wifi_network in wifi_networks:
-			if wifi_network["ssid"] != ssid:
-				remaining_networks.append(wifi_network)
-		#rewrite old unmodified appointment entry (preserves all data)
-		read_in_data["wifi_params"] = remaining_networks
-		#dump the json data to the file saver func, reload local vars from json file
-		self.write_to_file(json.dumps(read_in_data))
-		self.load_local_vars()
-
-	#function reads in data.json file and returns unmodified string
-	def read_in_file(self):
-		#create file object pointing to json config file
-		loc_file = open('data.json', 'r')
-		#read in unparsed json data, close file
-		unparsed_data = loc_file.read()
-		loc_file.close()
-		#return resulting unparsed data
-		return unparsed_data
+		self.mutate(["remove_wifi", ssid])
+
+	#function to split a data.json file from older firmware into section files
+	#any data.journal that belongs to it is replayed first, both files are removed afterwards
+	#returns True if a data.json was migrated
+	def migrate_legacy_data(self, file_name='data.json', journal_name='data.journal'):
+		try:
+			legacy = self.read_json(file_name)
+		except OSError:
+			#no legacy file, device already uses section files
+			return False
+		printline("splitting " + file_name + " into section files")
+		device_info = legacy["device_info"]
+		#the clock has its own section
+		self.set_section("clock", {"last_known_time": device_info.pop("last_known_time")})
+		self.set_section("device_info", device_info)
+		self.set_section("wifi_params", legacy["wifi_params"])
+		#appointments may already be packed in appointments.bin
+		appointments = legacy["appointments"]
+		if appointments == "packed":
+			appointments = read_packed_appointments("appointments.bin")[0]
+			if appointments is None:
+				appointments = []
+		appointments = configured_format(appointments)
+		self.set_section("appointments", appointments)
+		#replay the legacy journal if it belongs to this data.json
+		try:
+			journal = open(journal_name, 'r')
+			header = parse_journal_line(journal.readline())
+			if header is not None and header[0] == "gen" and header[1] == legacy.get("journal_gen", 0):
+				record = parse_journal_line(journal.readline())
+				while record is not None:
+					self.apply_record(record)
+					record = parse_journal_line(journal.readline())
+			journal.close()
+		except OSError:
+			pass
+		#write every section as a full snapshot, then remove the legacy files
+		for name in self.data:
+			self.stores[name].snapshot(self, self.data[name])
+		#the session continues with the packed records just written, not the decoded dicts
+		if isinstance(appointments, Packed_Appointments):
+			appointments.repack()
+			self.build_indexes()
+		remove_file(journal_name)
+		remove_file(file_name)
+		return True
+
+	#function to parse a json file straight from flash through the stream buffer
+	#the file text is never held in memory as a whole
+	def read_json(self, file_name):
+		loc_file = open(file_name, 'rb')
+		try:
+			return Json_Reader(loc_file, self.stream_buffer).load()
+		finally:
+			loc_file.close()
 
-	#function to rewrite json file
-	#WILL OVERWRITE ALL JSON DATA, READ DATA, MODIFY, THEN WRITE
-	def write_to_file(self, new_file_text):
+	#function to serialize a value straight into a json file through the stream buffer
+	#WILL OVERWRITE ALL FILE DATA, USE mutate() OR commit() INSTEAD OF CALLING DIRECTLY
+	def write_json(self, value, file_name):
+		#record time the write started
+		init_time = ticks_ms()
+		loc_file = open(file_name, 'wb')
+		try:
+			writer = Json_Writer(loc_file, self.stream_buffer)
+			writer.dump(value)
+			written = writer.close()
+		finally:
+			loc_file.close()
+		#update write statistics
+		self.write_count += 1
+		self.bytes_written += written
+		self.write_time += ticks_diff(ticks_ms(), init_time)
+
+	#function to rewrite a file (or append to it when mode is 'a')
+	#WILL OVERWRITE ALL FILE DATA, USE mutate() OR commit() INSTEAD OF CALLING DIRECTLY
+	def write_to_file(self, new_file_text, file_name, mode='w'):
+		#record time the write started
+		init_time = ticks_ms()
 		#create file object pointing to json config file
-		loc_file = open('data.json', 'w')
+		loc_file = open(file_name, mode)
 		#write data to file
 		loc_file.write(new_file_text)
 		#close file
-		loc_file.close()
\ No newline at end of file
+		loc_file.close()
+		#update write statistics
+		self.write_count += 1
+		self.bytes_written += len(new_file_text)
+		self.write_time += ticks_diff(ticks_ms(), init_time)
+
+#class returned by FileIO.transaction(), groups mutations into one flash write
+#transactions can be nested, only the outermost one writes
+class File_Transaction:
+	def __init__(self, file_io_inst):
+		self.file_io = file_io_inst
+
+	def __enter__(self):
+		#open transaction on the FileIO instance
+		self.file_io.begin()
+		return self.file_io
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		#close transaction, write once if this was the outermost one
+		#changes are committed even on an exception, each mutation is complete on its own
+		self.file_io.end()
+		#do not suppress exceptions
+		return False
+
+#class to hold appointment answers that still have to be sent to the server, oldest first
+#entries are [appointment_id, answer_number], an appointment has at most one entry, a newer
+#answer replaces the number of the entry already queued (messages always carry the newest answer)
+#acked entries are set to None and skipped by moving head, so peek, push and ack are constant time
+#when storage_configuration.OUTBOX_SIZE entries are queued the oldest one is dropped
+#(FileIO.new_appointment_answer marks its answer as given up, see overflow)
+class Outbox:
+	def __init__(self, entries=None, size=None):
+		if entries is None:
+			entries = []
+		if size is None:
+			size = storeconf.OUTBOX_SIZE
+		self.entries = entries
+		self.size = size
+		#position of the oldest entry that may still be live
+		self.head = 0
+		#index of appointment_id to position in entries
+		self.index = {}
+		for i in range(len(entries)):
+			self.index[entries[i][0]] = i
+
+	#number of live entries
+	def __len__(self):
+		return len(self.index)
+
+	def __iter__(self):
+		for i in range(self.head, len(self.entries)):
+			if self.entries[i] is not None:
+				yield self.entries[i]
+
+	#function to get the oldest live entry, None if the outbox is empty
+	def peek(self):
+		while self.head < len(self.entries) and self.entries[self.head] is None:
+			self.head += 1
+		if self.head < len(self.entries):
+			return self.entries[self.head]
+		return None
+
+	#function to queue an answer, coalesced with an entry already queued for the appointment
+	def push(self, appointment_id, number):
+		position = self.index.get(appointment_id)
+		if position is not None:
+			if number > self.entries[position][1]:
+				self.entries[position][1] = number
+			return
+		#drop the oldest entry if the outbox is full
+		if len(self.index) >= self.size:
+			oldest = self.peek()
+			printline("outbox full, dropping answer for appt " + str(oldest[0]))
+			self.remove(oldest[0])
+		self.index[appointment_id] = len(self.entries)
+		self.entries.append([appointment_id, number])
+
+	#function to get the entry push() would drop to queue an answer for appointment_id
+	#returns None if the outbox has room or already holds an entry for the appointment
+	def overflow(self, appointment_id):
+		if appointment_id in self.index or len(self.index) < self.size:
+			return None
+		return self.peek()
+
+	#function to take the entry of an appointment out once its answer (number) has been sent
+	#the entry stays if a newer answer was queued after the one that was sent
+	def ack(self, appointment_id, number):
+		position = self.index.get(appointment_id)
+		if position is None:
+			return
+		if number is None or self.entries[position][1] <= number:
+			self.remove(appointment_id)
+
+	#function to remove the entry of an appointment
+	def remove(self, appointment_id):
+		self.entries[self.index.pop(appointment_id)] = None
+
+	#function to drop removed entries from memory
+	def compact(self):
+		self.entries = list(self)
+		self.head = 0
+		self.index = {}
+		for i in range(len(self.entries)):
+			self.index[self.entries[i][0]] = i
+
+#header of the state cache: magic bytes, payload length and crc32 of the payload
+CACHE_HEADER = "<4sHI"
+CACHE_HEADER_SIZE = const(10)
+CACHE_MAGIC = b"DLS1"
+#keys every cached state must have
+CACHE_KEYS = ("gen", "last_known_time", "next_due", "unsent", "network", "cell", "cursor", "digest")
+
+#class to keep the hot device state in memory that survives deepsleep
+#the state is a dict (see FileIO.save_state_cache) stored as json behind a header with a
+#checksum, the memory itself is provided by a backend (RTC_Cache_Backend on the device,
+#Memory_Cache_Backend for testing) with read() and write(data) functions
+#gen is the generation of the clock section the state was saved with, FileIO discards a state
+#whose gen does not match the clock section on flash
+class State_Cache:
+	def __init__(self, backend):
+		self.backend = backend
+
+	#function to read the state, returns None if there is none or it fails validation
+	def load(self):
+		raw = self.backend.read()
+		if not raw or len(raw) < CACHE_HEADER_SIZE:
+			return None
+		magic, length, crc = ustruct.unpack_from(CACHE_HEADER, raw, 0)
+		payload = raw[CACHE_HEADER_SIZE:CACHE_HEADER_SIZE+length]
+		#check the state is complete and was not damaged
+		if magic != CACHE_MAGIC or len(payload) != length or ubinascii.crc32(payload) != crc:
+			return None
+		try:
+			state = json.loads(str(payload, 'utf-8'))
+		except ValueError:
+			return None
+		for key in CACHE_KEYS:
+			if key not in state:
+				return None
+		return state
+
+	#function to store the state
+	def save(self, state):
+		payload = json.dumps(state).encode()
+		self.backend.write(ustruct.pack(CACHE_HEADER, CACHE_MAGIC, len(payload), ubinascii.crc32(payload)) + payload)
+
+	#function to remove the state, load() returns None until it is saved again
+	def clear(self):
+		self.backend.write(b"")
+
+#state cache backend that uses the RTC memory of the ESP32 (kept during deepsleep, 2048 bytes)
+#the memory is only trusted after a deepsleep wake, other resets can leave old contents behind
+class RTC_Cache_Backend:
+	def __init__(self):
+		import machine
+		self.machine = machine
+		self.rtc = machine.RTC()
+
+	#function to read the stored bytes, returns None if the device did not wake from deepsleep
+	def read(self):
+		if self.machine.reset_cause() != self.machine.DEEPSLEEP_RESET:
+			return None
+		return self.rtc.memory()
+
+	#function to store bytes (must fit in the 2048 bytes of RTC memory)
+	def write(self, data):
+		self.rtc.memory(data)
+
+#state cache backend that keeps the bytes in a variable, used to test without a device
+class Memory_Cache_Backend:
+	def __init__(self):
+		self.data = b""
+
+	def read(self):
+		return self.data
+
+	def write(self, data):
+		self.data = bytes(data)
+
+#function to create the storage backend of every section, as selected in config
+def make_stores():
+	if storeconf.BACKEND == "journal":
+		appointment_store = Journal_Store()
+	else:
+		appointment_store = Appointment_Store()
+	return 	{
+				"device_info": Snapshot_Store("device_info.json"),
+				"wifi_params": Snapshot_Store("wifi_params.json"),
+				"clock": Snapshot_Store("clock.json"),
+				"wifi_stats": Snapshot_Store("wifi_stats.json", dict),
+				"outbox": Outbox_Store("outbox.json"),
+				"appointments": appointment_store
+			}
+
+#storage backend that stores a section as one json file and rewrites it on every commit
+#the file is written as a .tmp file and renamed over the old one, so a power loss part way
+#through a write leaves either the old or the new file complete
+#default is a function that creates the section when there is no file yet or the file can not
+#be parsed (None if it must exist)
+class Snapshot_Store:
+	def __init__(self, file_name, default=None):
+		self.file_name = file_name
+		self.default = default
+
+	#function to read and parse the section file, returns the section data
+	def load(self, file_io_inst):
+		try:
+			return self.read(file_io_inst)
+		except (OSError, ValueError):
+			if self.default is None:
+				raise
+			return self.default()
+
+	#function to parse the section file, finishes a write that was interrupted before its rename
+	def read(self, file_io_inst):
+		tmp_name = self.file_name + ".tmp"
+		try:
+			file_io_inst.read_json(tmp_name)
+			replace_file(tmp_name, self.file_name)
+		except (OSError, ValueError):
+			#no .tmp file, or one that was not written completely (the section file is intact)
+			pass
+		return file_io_inst.read_json(self.file_name)
+
+	#function to persist the section, the mutation records are not needed for a full snapshot
+	def commit(self, file_io_inst, value, records):
+		self.snapshot(file_io_inst, value)
+
+	#function to write the full section
+	def snapshot(self, file_io_inst, value):
+		self.write(file_io_inst, value)
+
+	#function to write a value to the .tmp file and rename it over the section file
+	def write(self, file_io_inst, value):
+		file_io_inst.write_json(value, self.file_name + ".tmp")
+		replace_file(self.file_name + ".tmp", self.file_name)
+
+#storage backend for the outbox section, stores the live entries as a json list
+class Outbox_Store(Snapshot_Store):
+	#function to read the outbox, builds it from the appointments if there is no usable outbox file
+	def load(self, file_io_inst):
+		try:
+			return Outbox(self.read(file_io_inst))
+		except (OSError, ValueError):
+			outbox = file_io_inst.build_outbox()
+			self.snapshot(file_io_inst, outbox)
+			return outbox
+
+	#function to write the live entries (acked entries are dropped from memory too)
+	def snapshot(self, file_io_inst, value):
+		value.compact()
+		self.write(file_io_inst, value.entries)
+
+#storage backend for the appointments section
+#appointments are stored in appointments.json, or in appointments.bin when
+#storage_configuration.APPOINTMENT_FORMAT is "packed" (see Packed_Appointments)
+#every snapshot has a generation number, and is written to a .tmp file that is renamed over
+#the old snapshot, a complete .tmp file left by a power loss is picked up on the next load
+#a journal left by Journal_Store is replayed on load and folded into the next snapshot,
+#so switching the backend in config never loses records
+#
+#the first line of the journal is ["gen", n] and must match the snapshot generation,
+#a snapshot gets the next generation before the journal is removed so a power loss between
+#the two writes can never replay old records twice
+class Appointment_Store(Snapshot_Store):
+	def __init__(self, json_name='appointments.json', packed_name='appointments.bin', journal_name='appointments.journal'):
+		self.json_name = json_name
+		self.packed_name = packed_name
+		self.journal_name = journal_name
+		#generation of the current snapshot
+		self.gen = 0
+		#current size of the journal file, 0 if it does not exist
+		self.journal_size = 0
+		#True if the snapshot was read from appointments.json (see migrate)
+		self.json_read = False
+
+	#function to load the snapshot and replay the journal on top of it
+	def load(self, file_io_inst):
+		appointments = self.read_snapshot(file_io_inst)
+		#section and indexes must be reachable by apply_record while replaying
+		file_io_inst.set_section("appointments", appointments)
+		self.journal_size = 0
+		try:
+			journal = open(self.journal_name, 'r')
+		except OSError:
+			#no journal, snapshot is complete
+			return self.migrate(file_io_inst, appointments)
+		#check the journal belongs to this snapshot
+		header = parse_journal_line(journal.readline())
+		if header is not None and header[0] == "gen" and header[1] == self.gen:
+			replayed = 0
+			self.journal_size = len(json.dumps(header)) + 1
+			while True:
+				line = journal.readline()
+				record = parse_journal_line(line)
+				#stop at the end of the file or at a torn (partially written) line
+				if record is None:
+					#appending after a torn line would hide new records, compact on next commit
+					if line:
+						self.journal_size = JOURNAL_DAMAGED
+					break
+				file_io_inst.apply_record(record)
+				self.journal_size += len(line)
+				replayed += 1
+			printline("journal records replayed: " + str(replayed))
+		else:
+			#a stale journal is dropped by the next snapshot
+			self.journal_size = JOURNAL_DAMAGED
+		journal.close()
+		return self.migrate(file_io_inst, appointments)
+
+	#function to move appointments read from appointments.json to appointments.bin when the packed
+	#format is selected in config, run once the journal is replayed so no record is lost
+	#the session then uses the packed records instead of the decoded dicts, returns the appointments
+	def migrate(self, file_io_inst, appointments):
+		if not self.json_read or not isinstance(appointments, Packed_Appointments):
+			return appointments
+		printline("moving appointments to " + self.packed_name)
+		self.snapshot(file_io_inst, appointments)
+		self.json_read = False
+		appointments.repack()
+		file_io_inst.build_indexes()
+		return appointments
+
+	#function to read the newest snapshot, returns the appointments in the format selected in config
+	def read_snapshot(self, file_io_inst):
+		#look for the configured format first, an older snapshot may use the other one
+		if storeconf.APPOINTMENT_FORMAT == "packed":
+			candidates = ((self.packed_name, True), (self.json_name, False))
+		else:
+			candidates = ((self.json_name, False), (self.packed_name, True))
+		appointments = None
+		self.json_read = False
+		for file_name, packed in candidates:
+			#finish a snapshot write that was interrupted before its rename
+			if self.read_file(file_io_inst, file_name + ".tmp", packed)[0] is not None:
+				replace_file(file_name + ".tmp", file_name)
+			appointments, self.gen = self.read_file(file_io_inst, file_name, packed)
+			if appointments is not None:
+				self.json_read = not packed
+				break
+		if appointments is None:
+			printline("no stored appointments")
+			appointments, self.gen = [], 0
+		return configured_format(appointments)
+
+	#function to read one snapshot file, returns the appointments and generation
+	#returns None and 0 if the file is missing or incomplete
+	def read_file(self, file_io_inst, file_name, packed):
+		if packed:
+			return read_packed_appointments(file_name)
+		try:
+			snapshot = file_io_inst.read_json(file_name)
+		except (OSError, ValueError):
+			return None, 0
+		return snapshot["appointments"], snapshot["gen"]
+
+	def commit(self, file_io_inst, value, records):
+		self.snapshot(file_io_inst, value)
+
+	#function to write a new snapshot with the next generation number, discards any journal
+	def snapshot(self, file_io_inst, value):
+		self.gen += 1
+		if isinstance(value, Packed_Appointments):
+			file_name, other_name = self.packed_name, self.json_name
+			file_io_inst.write_to_file(value.pack(self.gen), file_name + ".tmp", 'wb')
+		else:
+			file_name, other_name = self.json_name, self.packed_name
+			file_io_inst.write_json({"gen": self.gen, "appointments": value}, file_name + ".tmp")
+		replace_file(file_name + ".tmp", file_name)
+		#remove a snapshot in the other format so it can never be read instead of this one
+		remove_file(other_name)
+		#the journal no longer matches the snapshot (it is ignored even if removing fails)
+		if self.journal_size:
+			remove_file(self.journal_name)
+			self.journal_size = 0
+
+#storage backend for the appointments section that appends mutation records to the journal
+#instead of rewriting the snapshot, the journal is folded into a new snapshot (compacted)
+#once it grows past storage_configuration.JOURNAL_COMPACT_SIZE
+class Journal_Store(Appointment_Store):
+	def __init__(self, json_name='appointments.json', packed_name='appointments.bin', journal_name='appointments.journal', compact_size=None):
+		super().__init__(json_name, packed_name, journal_name)
+		#journal size (in bytes) that triggers a compaction
+		if compact_size is None:
+			compact_size = storeconf.JOURNAL_COMPACT_SIZE
+		self.compact_size = compact_size
+
+	#function to append the mutation records, or compact if the journal is too large
+	def commit(self, file_io_inst, value, records):
+		#build the text to append
+		new_text = ""
+		for record in records:
+			new_text += json.dumps(record) + "\n"
+		if self.journal_size == JOURNAL_DAMAGED or self.journal_size + len(new_text) > self.compact_size:
+			printline("compacting journal (" + str(self.journal_size) + " bytes)")
+			self.snapshot(file_io_inst, value)
+		else:
+			#start a new journal with a header if there isnt one yet
+			if self.journal_size == 0:
+				new_text = json.dumps(["gen", self.gen]) + "\n" + new_text
+			file_io_inst.write_to_file(new_text, self.journal_name, 'a')
+			self.journal_size += len(new_text)
+
+#journal_size value of a journal that must not be appended to (stale or torn last line)
+JOURNAL_DAMAGED = const(-1)
+
+#connect attempts counted per network before the counts are halved (see apply_record)
+WIFI_STATS_LIMIT = const(32)
+
+#function to parse one journal line, returns None for an empty or damaged line
+def parse_journal_line(line):
+	if not line or line[-1] != "\n":
+		return None
+	try:
+		return json.loads(line)
+	except ValueError:
+		return None
+
+#header of appointments.bin: magic bytes, snapshot generation and number of records
+PACKED_HEADER = "<4sII"
+PACKED_HEADER_SIZE = const(12)
+PACKED_MAGIC = b"DLA2"
+#header used by the first version of appointments.bin (no record count)
+PACKED_MAGIC_V1 = b"DLA1"
+PACKED_HEADER_V1_SIZE = const(8)
+#one packed appointment record (24 bytes, little endian):
+#appointment_id, start time, appointment flags, flags of answers 1-3, times of answers 1-3
+#times are seconds since 2000-01-01 (see dev_funcs.datetime_to_epoch)
+PACKED_FORMAT = "<IIBBBBIII"
+PACKED_SIZE = const(24)
+#number of answers a record holds (one per reminder, answer numbers 1-3)
+PACKED_ANSWERS = const(3)
+#appointment flag bits
+FLAG_CANCELLED = const(1)
+#answer flag bits
+ANSWER_PRESENT = const(1)
+ANSWER_SET = const(2)
+ANSWER_YES = const(4)
+ANSWER_SENT = const(8)
+
+#class that holds appointments as fixed width packed records and acts like the appointments list
+#records are only decoded into appointment dicts (same layout as in appointments.json) when
+#accessed, decoded dicts are kept so changes made to them are packed again by pack()
+#answer numbers outside 1-3 can not be stored and are dropped when packing
+class Packed_Appointments:
+	def __init__(self, raw=b""):
+		#packed records as read from appointments.bin (without header)
+		self.raw = raw
+		#one entry per appointment, the offset of its record in raw or its decoded dict
+		self.items = list(range(0, len(raw), PACKED_SIZE))
+
+	#function to build packed appointments from a list of appointment dicts
+	@staticmethod
+	def from_list(appointments):
+		packed = Packed_Appointments()
+		for appt in appointments:
+			packed.append(appt)
+		return packed
+
+	def __len__(self):
+		return len(self.items)
+
+	#function to get the appointment dict at position i, decodes the record on first access
+	def __getitem__(self, i):
+		item = self.items[i]
+		if isinstance(item, int):
+			item = self.decode(item)
+			self.items[i] = item
+		return item
+
+	def __delitem__(self, i):
+		del self.items[i]
+
+	def __iter__(self):
+		for i in range(len(self.items)):
+			yield self[i]
+
+	def append(self, appt):
+		self.items.append(appt)
+
+	#function to get the appointment id at position i without decoding the record
+	def id_at(self, i):
+		item = self.items[i]
+		if isinstance(item, int):
+			return ustruct.unpack_from("<I", self.raw, item)[0]
+		return item["appointment_id"]
+
+	#function to get the start time (seconds since 2000) at position i without decoding the record
+	def time_at(self, i):
+		item = self.items[i]
+		if isinstance(item, int):
+			return ustruct.unpack_from("<I", self.raw, item+4)[0]
+		return datetime_to_epoch(item["appointment_date_time"])
+
+	#function to check if the appointment at position i is cancelled without decoding the record
+	def cancelled_at(self, i):
+		item = self.items[i]
+		if isinstance(item, int):
+			return bool(self.raw[item+8] & FLAG_CANCELLED)
+		return item["cancelled"]
+
+	#function to count unsent answers at position i without decoding the record
+	def unsent_at(self, i):
+		item = self.items[i]
+		if isinstance(item, int):
+			unsent = 0
+			for n in range(PACKED_ANSWERS):
+				flags = self.raw[item+9+n]
+				if flags & ANSWER_PRESENT and not flags & ANSWER_SENT:
+					unsent += 1
+			return unsent
+		return count_unsent(item)
+
+	#function to get when the appointment at position i is due (see reminder_due_time)
+	#without decoding the record
+	def due_at(self, i):
+		item = self.items[i]
+		if isinstance(item, int):
+			if self.raw[item+8] & FLAG_CANCELLED:
+				return 0
+			highest_answer = 0
+			for n in range(PACKED_ANSWERS):
+				if self.raw[item+9+n] & ANSWER_PRESENT:
+					highest_answer = n+1
+			return due_time(ustruct.unpack_from("<I", self.raw, item+4)[0], highest_answer)
+		return reminder_due_time(item)
+
+	#function to decode the record at offset into an appointment dict
+	def decode(self, offset):
+		fields = ustruct.unpack_from(PACKED_FORMAT, self.raw, offset)
+		answers = []
+		for n in range(PACKED_ANSWERS):
+			flags = fields[3+n]
+			if flags & ANSWER_PRESENT:
+				answer = None
+				if flags & ANSWER_SET:
+					answer = bool(flags & ANSWER_YES)
+				answers.append({
+								"answer": answer,
+								"time_answered": epoch_to_datetime(fields[6+n]),
+								"number": n+1,
+								"sent": bool(flags & ANSWER_SENT)
+								})
+		return 	{
+					"appointment_id": fields[0],
+					"appointment_date_time": epoch_to_datetime(fields[1]),
+					"answers": answers,
+					"cancelled": bool(fields[2] & FLAG_CANCELLED)
+				}
+
+	#function to pack the decoded records again so they are read from raw like stored ones
+	#(done once they are written, answer numbers outside 1-3 are dropped as in the file)
+	def repack(self):
+		self.raw = bytes(self.pack()[PACKED_HEADER_SIZE:])
+		self.items = list(range(0, len(self.raw), PACKED_SIZE))
+
+	#function to pack all appointments (with header) into a bytearray, ready to write to flash
+	#records that were never decoded are copied over unchanged
+	def pack(self, gen=0):
+		buf = bytearray(PACKED_HEADER_SIZE + len(self.items)*PACKED_SIZE)
+		ustruct.pack_into(PACKED_HEADER, buf, 0, PACKED_MAGIC, gen, len(self.items))
+		offset = PACKED_HEADER_SIZE
+		for item in self.items:
+			if isinstance(item, int):
+				buf[offset:offset+PACKED_SIZE] = self.raw[item:item+PACKED_SIZE]
+			else:
+				self.encode_into(buf, offset, item)
+			offset += PACKED_SIZE
+		return buf
+
+	#function to pack one appointment dict into buf at offset
+	@staticmethod
+	def encode_into(buf, offset, appt):
+		answer_flags = [0]*PACKED_ANSWERS
+		answer_times = [0]*PACKED_ANSWERS
+		for answer in appt["answers"]:
+			n = answer["number"]-1
+			if 0 <= n < PACKED_ANSWERS:
+				flags = ANSWER_PRESENT
+				if answer["answer"] is not None:
+					flags |= ANSWER_SET
+					if answer["answer"]:
+						flags |= ANSWER_YES
+				if answer["sent"]:
+					flags |= ANSWER_SENT
+				answer_flags[n] = flags
+				answer_times[n] = datetime_to_epoch(answer["time_answered"])
+		flags = 0
+		if appt["cancelled"]:
+			flags |= FLAG_CANCELLED
+		ustruct.pack_into(PACKED_FORMAT, buf, offset, appt["appointment_id"],
+			datetime_to_epoch(appt["appointment_date_time"]), flags,
+			answer_flags[0], answer_flags[1], answer_flags[2],
+			answer_times[0], answer_times[1], answer_times[2])
+
+#function to convert appointments (a list or Packed_Appointments) to the format selected in
+#storage_configuration.APPOINTMENT_FORMAT
+def configured_format(appointments):
+	if storeconf.APPOINTMENT_FORMAT == "packed":
+		if not isinstance(appointments, Packed_Appointments):
+			return Packed_Appointments.from_list(appointments)
+	elif isinstance(appointments, Packed_Appointments):
+		return list(appointments)
+	return appointments
+
+#function to read a packed appointments file, returns Packed_Appointments and the generation
+#returns None and 0 if the file is missing, damaged or incomplete
+def read_packed_appointments(file_name):
+	try:
+		loc_file = open(file_name, 'rb')
+	except OSError:
+		return None, 0
+	raw = loc_file.read()
+	loc_file.close()
+	if raw[0:4] == PACKED_MAGIC and len(raw) >= PACKED_HEADER_SIZE:
+		magic, gen, count = ustruct.unpack_from(PACKED_HEADER, raw, 0)
+		#an incomplete write has fewer records than the header says
+		if len(raw) != PACKED_HEADER_SIZE + count*PACKED_SIZE:
+			printline("packed appointments incomplete: " + file_name)
+			return None, 0
+		return Packed_Appointments(raw[PACKED_HEADER_SIZE:]), gen
+	if raw[0:4] == PACKED_MAGIC_V1 and len(raw) >= PACKED_HEADER_V1_SIZE:
+		return Packed_Appointments(raw[PACKED_HEADER_V1_SIZE:]), ustruct.unpack_from("<I", raw, 4)[0]
+	printline("packed appointments damaged: " + file_name)
+	return None, 0
+
+#function to replace file new_name with file old_name (rename does not overwrite on every filesystem)
+def replace_file(old_name, new_name):
+	remove_file(new_name)
+	uos.rename(old_name, new_name)
+
+#function to remove a file if it exists
+def remove_file(file_name):
+	try:
+		uos.remove(file_name)
+	except OSError:
+		pass
+
+#function to count unsent answers of an appointment dict
+def count_unsent(appt):
+	unsent = 0
+	for answer in appt["answers"]:
+		if answer["sent"] == False:
+			unsent += 1
+	return unsent
+
+#function to get when an appointment next needs the device awake (seconds since 2000)
+#that is when the window of the reminder after the highest answer opens, or the appointment time
+#once all reminders are answered (it is removed then), cancelled appointments are due right away
+def reminder_due_time(appt):
+	if appt["cancelled"]:
+		return 0
+	highest_answer = 0
+	for answer in appt["answers"]:
+		if answer["number"] > highest_answer:
+			highest_answer = answer["number"]
+	return due_time(datetime_to_epoch(appt["appointment_date_time"]), highest_answer)
+
+#function to get the due time of an appointment at appt_time (seconds since 2000) that has
+#answers up to number highest_answer (see reminder_due_time)
+def due_time(appt_time, highest_answer):
+	if highest_answer >= len(REMINDER_HOURS):
+		return appt_time
+	#an hour early, check_if_appt_reminder_necessary compares whole hours
+	return appt_time - (REMINDER_HOURS[highest_answer]+1)*3600
+
+#functions to read fields of the appointment at position i of an appointments list or
+#Packed_Appointments, packed records are not decoded
+def appointment_id_at(appointments, i):
+	if isinstance(appointments, Packed_Appointments):
+		return appointments.id_at(i)
+	return appointments[i]["appointment_id"]
+
+def appointment_time_at(appointments, i):
+	if isinstance(appointments, Packed_Appointments):
+		return appointments.time_at(i)
+	return datetime_to_epoch(appointments[i]["appointment_date_time"])
+
+def appointment_cancelled_at(appointments, i):
+	if isinstance(appointments, Packed_Appointments):
+		return appointments.cancelled_at(i)
+	return appointments[i]["cancelled"]
+
+def appointment_unsent_at(appointments, i):
+	if isinstance(appointments, Packed_Appointments):
+		return appointments.unsent_at(i)
+	return count_unsent(appointments[i])
+
+def appointment_due_at(appointments, i):
+	if isinstance(appointments, Packed_Appointments):
+		return appointments.due_at(i)
+	return reminder_due_time(appointments[i])
@@ -0,0 +1,312 @@
+"""
+Streaming json reader and writer
+Parses json straight from a stream (file or socket) and serializes straight into one,
+through a small fixed size buffer, so the full json text is never held in memory
+"""
+import ujson as json
+
+#byte values used by the parser
+QUOTE = const(0x22)
+BACKSLASH = const(0x5C)
+COMMA = const(0x2C)
+COLON = const(0x3A)
+OPEN_BRACE = const(0x7B)
+CLOSE_BRACE = const(0x7D)
+OPEN_BRACKET = const(0x5B)
+CLOSE_BRACKET = const(0x5D)
+#characters that can be part of a json number
+NUMBER_BYTES = set(b"+-0123456789.eE")
+#json escape characters and the byte they stand for
+ESCAPES = {0x62: 0x08, 0x66: 0x0C, 0x6E: 0x0A, 0x72: 0x0D, 0x74: 0x09}
+#ranges of the high and low halves of a surrogate pair, and the utf-8 of U+FFFD (replacement character)
+HIGH_SURROGATE = const(0xD800)
+LOW_SURROGATE = const(0xDC00)
+SURROGATE_END = const(0xE000)
+REPLACEMENT = b"\xef\xbf\xbd"
+
+#class to parse json from a stream, refilling a fixed size buffer with readinto
+#load() parses one full value, iter_array() and iter_object() walk a container one element
+#at a time so the caller can handle (or skip) each element before the next one is read
+#a buffer can be passed in so one bytearray is reused by every reader and writer
+class Json_Reader:
+	def __init__(self, stream, buf=None, buf_size=256):
+		self.stream = stream
+		#buffer holding the part of the stream being parsed
+		if buf is None:
+			buf = bytearray(buf_size)
+		self.buf = buf
+		#position of the next byte in buf, and number of valid bytes in buf
+		self.pos = 0
+		self.end = 0
+
+	#function to get the next byte of the stream (as an int), returns -1 at the end of the stream
+	def next_byte(self):
+		if self.pos >= self.end:
+			if not self.fill():
+				return -1
+		byte = self.buf[self.pos]
+		self.pos += 1
+		return byte
+
+	#function to look at the next byte without consuming it, returns -1 at the end of the stream
+	def peek_byte(self):
+		if self.pos >= self.end:
+			if not self.fill():
+				return -1
+		return self.buf[self.pos]
+
+	#function to refill the buffer from the stream, returns False at the end of the stream
+	def fill(self):
+		count = self.stream.readinto(self.buf)
+		self.pos = 0
+		#non blocking streams return None when no data is ready yet, treated as the end
+		if not count:
+			self.end = 0
+			return False
+		self.end = count
+		return True
+
+	#function to skip whitespace, returns the next byte without consuming it
+	def skip_space(self):
+		byte = self.peek_byte()
+		while byte in (0x20, 0x09, 0x0A, 0x0D):
+			self.pos += 1
+			byte = self.peek_byte()
+		return byte
+
+	#function to check if the next value is an array (without consuming it)
+	def starts_array(self):
+		return self.skip_space() == OPEN_BRACKET
+
+	#function to consume the next non whitespace byte, raises ValueError if it is not expected
+	def expect(self, expected):
+		byte = self.skip_space()
+		if byte != expected:
+			raise ValueError("json: expected " + chr(expected) + " got " + str(byte))
+		self.pos += 1
+
+	#function to parse the next full value from the stream
+	def load(self):
+		byte = self.skip_space()
+		if byte == OPEN_BRACE:
+			value = {}
+			for key in self.iter_object():
+				value[key] = self.load()
+			return value
+		if byte == OPEN_BRACKET:
+			value = []
+			for item in self.iter_array():
+				value.append(item)
+			return value
+		if byte == QUOTE:
+			return self.read_string()
+		if byte == 0x74:
+			self.read_literal(b"true")
+			return True
+		if byte == 0x66:
+			self.read_literal(b"false")
+			return False
+		if byte == 0x6E:
+			self.read_literal(b"null")
+			return None
+		if byte == -1:
+			raise ValueError("json: unexpected end of stream")
+		return self.read_number()
+
+	#function to read past the next value without building it (strings are not decoded)
+	def skip_value(self):
+		byte = self.skip_space()
+		if byte == OPEN_BRACE:
+			for key in self.iter_object():
+				self.skip_value()
+		elif byte == OPEN_BRACKET:
+			for i in self.iter_elements():
+				self.skip_value()
+		elif byte == QUOTE:
+			self.pos += 1
+			byte = self.next_byte()
+			while byte != QUOTE:
+				if byte == -1:
+					raise ValueError("json: unterminated string")
+				#the escaped byte can be a quote
+				if byte == BACKSLASH:
+					self.next_byte()
+				byte = self.next_byte()
+		else:
+			#numbers and literals are small
+			self.load()
+
+	#generator that walks an array, yields each element as it is parsed
+	def iter_array(self):
+		for i in self.iter_elements():
+			yield self.load()
+
+	#generator that walks an array, yields the index of each element before it is parsed
+	#the caller must consume each element (load, skip_value, iter_object...) before the next one
+	def iter_elements(self):
+		self.expect(OPEN_BRACKET)
+		if self.skip_space() == CLOSE_BRACKET:
+			self.pos += 1
+			return
+		i = 0
+		while True:
+			yield i
+			i += 1
+			byte = self.skip_space()
+			self.pos += 1
+			if byte == CLOSE_BRACKET:
+				return
+			if byte != COMMA:
+				raise ValueError("json: bad array")
+
+	#generator that walks an object, yields each key
+	#the caller must consume the value of each key (load or skip_value) before the next key
+	def iter_object(self):
+		self.expect(OPEN_BRACE)
+		if self.skip_space() == CLOSE_BRACE:
+			self.pos += 1
+			return
+		while True:
+			self.skip_space()
+			key = self.read_string()
+			self.expect(COLON)
+			yield key
+			byte = self.skip_space()
+			self.pos += 1
+			if byte == CLOSE_BRACE:
+				return
+			if byte != COMMA:
+				raise ValueError("json: bad object")
+
+	#function to parse a string (including quotes), handles escapes
+	#characters outside the basic plane are escaped as a surrogate pair (\ud83d\ude00), the two
+	#halves are combined into one character, a half without the other becomes U+FFFD
+	def read_string(self):
+		self.expect(QUOTE)
+		out = bytearray()
+		#high surrogate of the last \u escape, waiting for its low surrogate (0 if none)
+		high = 0
+		while True:
+			byte = self.next_byte()
+			escaped = byte == BACKSLASH
+			code = -1
+			if escaped:
+				byte = self.next_byte()
+				if byte == 0x75:
+					code = self.read_code()
+			if high and not LOW_SURROGATE <= code < SURROGATE_END:
+				out.extend(REPLACEMENT)
+				high = 0
+			if not escaped:
+				if byte == QUOTE:
+					return str(out, 'utf-8')
+				if byte == -1:
+					raise ValueError("json: unterminated string")
+				out.append(byte)
+			elif code < 0:
+				out.append(ESCAPES.get(byte, byte))
+			elif high:
+				out.extend(chr(0x10000 + ((high - HIGH_SURROGATE) << 10) + code - LOW_SURROGATE).encode())
+				high = 0
+			elif HIGH_SURROGATE <= code < LOW_SURROGATE:
+				high = code
+			elif LOW_SURROGATE <= code < SURROGATE_END:
+				out.extend(REPLACEMENT)
+			else:
+				#\uXXXX escape, encoded back to utf-8
+				out.extend(chr(code).encode())
+
+	#function to read the 4 hex digits of a \u escape, returns the code
+	def read_code(self):
+		code = 0
+		for i in range(4):
+			code = code*16 + int(chr(self.next_byte()), 16)
+		return code
+
+	#function to parse a number, returns an int or a float
+	def read_number(self):
+		out = bytearray()
+		byte = self.peek_byte()
+		while byte != -1 and byte in NUMBER_BYTES:
+			out.append(byte)
+			self.pos += 1
+			byte = self.peek_byte()
+		text = str(out, 'utf-8')
+		if not text:
+			raise ValueError("json: unexpected byte " + str(byte))
+		for char in ".eE":
+			if char in text:
+				return float(text)
+		return int(text)
+
+	#function to consume a literal (true, false, null)
+	def read_literal(self, literal):
+		for expected in literal:
+			if self.next_byte() != expected:
+				raise ValueError("json: bad literal")
+
+#class to serialize json straight into a stream through a fixed size buffer
+#the buffer is written to the stream every time it fills up, call close() to write the rest
+class Json_Writer:
+	def __init__(self, stream, buf=None, buf_size=256):
+		self.stream = stream
+		#buffer collecting serialized text before it is written to the stream
+		if buf is None:
+			buf = bytearray(buf_size)
+		self.buf = buf
+		self.view = memoryview(buf)
+		#number of bytes in buf, and number of bytes written to the stream so far
+		self.used = 0
+		self.written = 0
+
+	#function to serialize a value (dict, list, tuple, str, number, bool or None)
+	def dump(self, value):
+		if isinstance(value, dict):
+			self.write(b"{")
+			first = True
+			for key in value:
+				if not first:
+					self.write(b", ")
+				first = False
+				self.write(json.dumps(str(key)))
+				self.write(b": ")
+				self.dump(value[key])
+			self.write(b"}")
+		elif isinstance(value, (list, tuple)):
+			self.write(b"[")
+			first = True
+			for item in value:
+				if not first:
+					self.write(b", ")
+				first = False
+				self.dump(item)
+			self.write(b"]")
+		else:
+			#scalars are small, ujson escapes strings and formats numbers
+			self.write(json.dumps(value))
+
+	#function to add text (str or bytes) to the buffer, writing the buffer out when it is full
+	def write(self, text):
+		if isinstance(text, str):
+			text = text.encode()
+		size = len(self.buf)
+		offset = 0
+		while offset < len(text):
+			count = min(len(text) - offset, size - self.used)
+			self.buf[self.used:self.used+count] = text[offset:offset+count]
+			self.used += count
+			offset += count
+			if self.used == size:
+				self.flush()
+
+	#function to write the buffered text to the stream
+	def flush(self):
+		if self.used:
+			self.stream.write(self.view[:self.used])
+			self.written += self.used
+			self.used = 0
+
+	#function to write anything left in the buffer, returns the total number of bytes written
+	def close(self):
+		self.flush()
+		return self.written
@@ -20,11 +20,11 @@ from display import Display
 ssd = Display()		#create object for OLED display
 ssd.activate()		#activate display
 
-from file_funcs import FileIO
+from file_funcs import FileIO, State_Cache, RTC_Cache_Backend
 from config import extra_params as params
 import dev_funcs
 #create some objects for use within the program
-dev_info = FileIO()	#get all of the device info from data.json
+dev_info = FileIO(cache=State_Cache(RTC_Cache_Backend()))	#get device info (sections are read from flash when first used, hot state from RTC memory after deepsleep)
 dev_time = dev_funcs.Recorded_Time(dev_info.last_known_time)	#create time object from last known time
 
 #put something on display if device was woken with interrupt
@@ -57,8 +57,16 @@ if button_state["yes"] and button_state["no"] and not button_state["select"]:
 	ssd.print_text("Access Point Mode \n \n Connect to the device wifi, navigate to 192.168.4.1", True, 0)
 	ssd.update()
 	printline("AP Mode selected")
-	update
-	sleep(10)
+	#serve the configuration portal until select is pressed or nobody connects for a while
+	network_interface = comms.Dev_WiFi(dev_info.wifi_networks)
+	if network_interface.start_ap(dev_info.dev_id):
+		import uasyncio
+		ap_server = comms.Ap_Server(network_interface.websocket, dev_info)
+		uasyncio.run(ap_server.run(ssd, button))
+		network_interface.stop_ap()
+	else:
+		printline("access point failed to start")
+		sleep(10)
 
 #if yes, no and select buttons are pressed
 #this leads to UART control
@@ -80,27 +88,43 @@ else:
 	#boolean to show whether network, server had successful connections
 	connected_to_network = False
 	connected_to_server = False
+	#connect attempts of the wifi interface, filled in while it is used
+	wifi_results = None
 
 	#connect to cellular network by constructing cellular comms object
-	network_interface = comms.Dev_Cell()
+	#(registers with the operator of the last wake if the modem lost its registration)
+	network_interface = comms.Dev_Cell(dev_info.get_last_cell())
+	#radio manager powers the network down while the user interacts and back up to send messages
+	radio = comms.Radio_Manager(network_interface.start_cellular, network_interface.stop_cellular)
 	#check if cellular services have been successfully started
-	if network_interface.start_cellular():
+	if radio.up():
 		connected_to_network = True
 		printline("cellular started successfully")
+		#remember the operator in the state cache for a fast registration next wake
+		dev_info.set_last_cell(network_interface.registered_network)
 
 	#if the cellular device doesnt start, we need to connect with WiFi
 	else:
+		#a device without a modem does not wait for it again on the next wakes
+		if network_interface.modem_missing:
+			dev_info.set_last_cell(False)
 		#start wifi object
-		network_interface = comms.Dev_WiFi(dev_info.wifi_networks)
+		network_interface = comms.Dev_WiFi(dev_info.wifi_networks, dev_info.get_last_network(), dev_info.wifi_stats)
+		wifi_results = network_interface.connect_results
+		radio = comms.Radio_Manager(network_interface.start_wifi, network_interface.stop_wifi)
 		#check if wifi services have been successfully started
-		if network_interface.start_wifi():
+		if radio.up():
 			connected_to_network = True
 			printline("WiFi started successfully")
+			#remember the access point and lease in the state cache for a fast reconnect next wake
+			dev_info.set_last_network(network_interface.connected_network)
 
 	#check if we connected to either cellular or wifi (have the same functionality)
 	if connected_to_network:
 		#construct initial device message to be sent to server
 		mess = comms.Dev_Message(dev_info.dev_id, dev_info.server_pass, batt.get_batt_level())
+		#ask only for the appointment changes since the last sync
+		mess.include_sync_cursor(dev_info.get_sync_cursor(), dev_info.get_sync_digest())
 		#get new appointment data by sendinging initial post
 		success, datetime, appt_data = network_interface.send_initial_post(mess)
 		printline(str(success) + " connection| " + str(datetime))
@@ -110,19 +134,29 @@ else:
 			connected_to_server = True
 			#remake device time object with new datetime from server 
 			dev_time = dev_funcs.Recorded_Time(datetime)
-			#check if we need to update appointment data (only if we have a new appt)
-			if appt_data is not None:
-				#iter through new appointments and add them to file system
-				for appt in appt_data:
-					if appt.cancelled:
-						printline("appt " + str(appt.appointment_id) + " is cancelled, updating system")
-						dev_info.cancel_appointment(appt.appointment_id)
-					else:
-						printline("new appt " + str(appt.appointment_id) + " added to system")
-						dev_info.add_appointment(appt)
+			#merge the server appointments into the file system (one flash write, none if nothing changed)
+			#the cursor moves to this reply once every appointment of it is stored
+			with dev_info.transaction():
+				listed = {}
+				if appt_data is not None:
+					listed = dev_info.reconcile_appointments(appt_data)
+				if network_interface.sync_complete():
+					#a full reply lists every appointment, stored ones it does not list are removed
+					if network_interface.sync_full():
+						dev_info.remove_unlisted_appointments(listed)
+					dev_info.set_sync_cursor(datetime)
 
 	#check appointments and see if any reminders need to be made
-	curr_appointments = dev_info.get_appointments()
+	#appointments are only read from flash when something is due (known from the state cache after deepsleep)
+	next_due = dev_info.get_next_reminder_time()
+	if next_due is not None and next_due <= dev_funcs.datetime_to_epoch(dev_time.get_datetime_string()):
+		curr_appointments = dev_info.get_appointments()
+	else:
+		printline("no appointments due")
+		curr_appointments = []
+	#the radio is not needed while the user reads and answers reminders
+	if curr_appointments:
+		radio.down()
 	#var to store state of whether user has used device while awake
 	user_answered = True
 	for appt in curr_appointments:
@@ -237,7 +271,11 @@ else:
 										mess = comms.Dev_Message(dev_info.dev_id, dev_info.server_pass, batt.get_batt_level())
 										updated_appt = dev_info.get_appointments(appt.appointment_id)
 										mess.include_appointment_answer(updated_appt)
-										success, reply = network_interface.send_appointment_reply_post(mess)
+										#bring the radio back up just for the reply
+										success, reply = False, None
+										if radio.up():
+											success, reply = network_interface.send_appointment_reply_post(mess)
+										radio.down()
 										printline("reply: " + str(success))
 										printline(reply)
 										if success:
@@ -278,18 +316,33 @@ else:
 	#if the user answered a message or interacted with device
 	#if user_answered:
 
-	#check for any appointment answers that have not been sent yet
-	unsent_appts = dev_info.get_unsent_appointment_answers()
-	for appt in unsent_appts:
+	#send the answers waiting in the outbox (one per appointment, oldest first)
+	unsent_appts = []
+	if dev_info.get_unsent_count() and radio.up():
+		unsent_appts = dev_info.get_unsent_appointment_answers()
+	#status updates are held in memory and written together with the sleep time below
+	dev_info.begin()
+	if unsent_appts:
+		#put every unsent answer in one message (sent batched if the server supports it)
 		mess = comms.Dev_Message(dev_info.dev_id, dev_info.server_pass, batt.get_batt_level())
-		mess.include_appointment_answer(appt[0])
-		success, reply = network_interface.send_appointment_reply_post(mess)
-
-		if success:
-			printline("unsent message sent to server was successful " + str(appt[0].appointment_id))
-			dev_info.update_appointment_answer_status(appt[0].appointment_id, True, appt[1])
-		else:
-			printline("unsent message sent to server was unsuccessful: " + str(appt[0].appointment_id))
+		#answer number of each appointment, to mark the right answer as sent
+		answer_numbers = {}
+		for appt in unsent_appts:
+			mess.include_appointment_answer(appt[0])
+			answer_numbers[appt[0].appointment_id] = appt[1]
+		for appointment_id, success in network_interface.send_appointment_replies_post(mess):
+			if success:
+				printline("unsent message sent to server was successful " + str(appointment_id))
+				dev_info.update_appointment_answer_status(appointment_id, True, answer_numbers[appointment_id])
+			else:
+				printline("unsent message sent to server was unsuccessful: " + str(appointment_id))
+	#power the radio down before sleep
+	radio.down()
+	printline("radio on: " + str(radio.radio_on_ms()) + " ms")
+	#save how the connect attempts of this wake went (including reconnects to send answers),
+	#used to rank networks on the next scan
+	if wifi_results:
+		dev_info.record_wifi_results(wifi_results)
 
 """
 Prepare for sleepmode
@@ -300,6 +353,9 @@ ssd.deactivate()
 #save current time
 dev_time.update_time()
 dev_info.update_last_known_time(dev_time)
+#write all pending changes to flash in one pass
+dev_info.end()
+dev_info.print_io_stats()
 
 printline("set wake and go to sleep")
 #set the esp32 to wake if select button is pressed or yes/no pressed together
@@ -0,0 +1,98 @@
+"""
+Benchmark of the appointment id index in FileIO (run with "python tests/bench_appointments.py")
+Stores of 10, 100 and 1000 appointments are written to a temporary directory, and lookups through
+the index are timed against a linear scan of the appointments list (how they were found before)
+MAX_APPOINTMENTS is raised above the largest store so the retention policy removes nothing
+"""
+import os
+import sys
+import json
+import tempfile
+import time
+
+#host setup shared with the tests (module names, const, ticks functions)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest
+from config import storage_configuration as storeconf
+from file_funcs import FileIO
+from dev_funcs import Recorded_Time
+
+#numbers of stored appointments that are timed
+SIZES = (10, 100, 1000)
+#number of lookups timed for each size
+LOOKUPS = 1000
+#number of appointments answered for each size (in one transaction)
+ANSWERS = 10
+#id of the first stored appointment
+FIRST_ID = 100
+
+#function to write the section files of a device with count appointments
+def write_sections(count):
+	appointments = []
+	for i in range(count):
+		appointments.append({"appointment_id": FIRST_ID+i, "appointment_date_time": "2021-04-30T12:00:00", "answers": [], "cancelled": False})
+	sections = 	{
+					"device_info.json": {"dev_id": "838458", "server_pass": "heyaedin", "firm_version": "1.0", "quiet_hours": {"start_time": "22", "end_time": "7"}},
+					"clock.json": {"last_known_time": "2021-03-28T10:00:00.000"},
+					"wifi_params.json": [],
+					"appointments.json": {"gen": 1, "appointments": appointments}
+				}
+	for name in sections:
+		with open(name, 'w') as loc_file:
+			json.dump(sections[name], loc_file)
+
+#function to find an appointment by scanning the list (the lookup the index replaced)
+def scan_appointments(appointments, appointment_id):
+	for appt in appointments:
+		if appt["appointment_id"] == appointment_id:
+			return appt
+	return None
+
+#function to time one store size, returns the timings in microseconds
+def bench(count):
+	write_sections(count)
+	start = time.ticks_us()
+	file_io_inst = FileIO()
+	appointments = file_io_inst.appointments
+	load = time.ticks_diff(time.ticks_us(), start)
+	#ids spread over the whole store, the last one is the worst case of the scan
+	ids = []
+	for i in range(LOOKUPS):
+		ids.append(FIRST_ID + (i*7919) % count)
+	start = time.ticks_us()
+	for appointment_id in ids:
+		file_io_inst.find_appointment(appointment_id)
+	index = time.ticks_diff(time.ticks_us(), start)
+	start = time.ticks_us()
+	for appointment_id in ids:
+		scan_appointments(appointments, appointment_id)
+	scan = time.ticks_diff(time.ticks_us(), start)
+	#answers are looked up through the index, written once when the transaction closes
+	start = time.ticks_us()
+	with file_io_inst.transaction():
+		for i in range(min(ANSWERS, count)):
+			file_io_inst.new_appointment_answer(ids[i], True, Recorded_Time("2021-03-28T10:00:00.000"), 1)
+	answer = time.ticks_diff(time.ticks_us(), start)
+	start = time.ticks_us()
+	file_io_inst.get_unsent_appointment_answers()
+	unsent = time.ticks_diff(time.ticks_us(), start)
+	return load, index/LOOKUPS, scan/LOOKUPS, answer, unsent
+
+def main():
+	storeconf.MAX_APPOINTMENTS = max(SIZES)
+	results = []
+	cwd = os.getcwd()
+	with tempfile.TemporaryDirectory() as work_dir:
+		os.chdir(work_dir)
+		try:
+			for count in SIZES:
+				results.append([count] + list(bench(count)))
+		finally:
+			os.chdir(cwd)
+	print()
+	print("appointments   load us   index lookup us   scan lookup us   " + str(ANSWERS) + " answers us   unsent us")
+	for count, load, index, scan, answer, unsent in results:
+		print("%12d %9d %17.2f %16.2f %13d %11d" % (count, load, index, scan, answer, unsent))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,102 @@
+"""
+Benchmark of compressed responses (run with "python tests/bench_compression.py")
+Initial post replies with 1, 10 and 50 Django style appointment records are sent by a local mock
+server as identity, deflate and gzip bodies, in json and (for 50) in cbor, and read by a Dev_Network
+The body bytes on the wire and the time to parse the reply (host CPython, best of 5, only the
+relative numbers carry over to the device) are compared
+"""
+import json
+import os
+import sys
+import time
+import zlib
+
+#host setup shared with the tests (module names, const, ticks functions, uzlib)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest
+import comms
+from config import communication_configuration as commconf
+from mock_server import Mock_Server, response
+
+#numbers of appointments in the reply, and how many times each reply is parsed
+SIZES = (1, 10, 50)
+RUNS = 5
+
+#function to build an initial post reply of count appointment records, with the fields a Django
+#serializer sends (the device only reads the ones in comms.APPOINTMENT_FIELDS)
+def initial_reply(count):
+	reply = [{"server_date_time": "2021-03-28T10:05:00.000", "sync": "full", "batch_replies": True}]
+	for i in range(count):
+		reply.append({"model": "appointments.appointment", "pk": 100+i, "fields": {
+						"appointment_ID": 100+i, "appointment_start_date_time": "2021-04-01T12:00:00",
+						"appointment_end_date_time": "2021-04-01T12:30:00", "cancelled": False,
+						"appointment_type": "consultation", "clinic": "Docco Clinic", "doctor": "Dr. Example",
+						"location": "Room 2", "created": "2021-03-01T09:00:00", "last_modified": "2021-03-20T15:00:00"
+					}})
+	return reply
+
+#function to compress body with encoding ("identity", "deflate" or "gzip") the way a server would,
+#with the window of HTTP_DEFLATE_WBITS
+def compress(body, encoding):
+	if encoding == "identity":
+		return body
+	wbits = commconf.HTTP_DEFLATE_WBITS
+	if encoding == "gzip":
+		wbits += 16
+	compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+	return compressor.compress(body) + compressor.flush()
+
+#function to read the reply of count appointments in body_type ("json" or "cbor") sent with encoding
+#returns the body bytes on the wire and the best parse time in microseconds
+def bench(count, body_type, encoding):
+	reply = initial_reply(count)
+	if body_type == "cbor":
+		body, content_type = comms.encode_compact(reply), comms.CBOR_TYPE
+	else:
+		body, content_type = json.dumps(reply).encode(), comms.JSON_TYPE
+	body = compress(body, encoding)
+	if encoding == "identity":
+		sent = response(body, content_type=content_type)
+	else:
+		sent = response(body, content_type=content_type, encoding=encoding)
+	server = Mock_Server(reply_with(sent))
+	best = None
+	try:
+		network = comms.Dev_Network(comms.Http_Client(server.url), "BENCH")
+		mess = comms.Dev_Message("838458", "heyaedin", 3.7)
+		for i in range(RUNS):
+			start = time.ticks_us()
+			success, datetime, appt_data = network.send_initial_post(mess)
+			appointments = list(appt_data)
+			elapsed = time.ticks_diff(time.ticks_us(), start)
+			assert success and len(appointments) == count and network.sync_complete()
+			if best is None or elapsed < best:
+				best = elapsed
+		network.http.close()
+	finally:
+		server.close()
+	#every run used one kept open connection
+	assert server.connections == 1
+	return len(body), best
+
+#function to make a handler that answers every request with sent
+def reply_with(sent):
+	def handler(request):
+		return sent
+	return handler
+
+def main():
+	comms.printline = conftest.quiet
+	commconf.HTTP_COMPRESSION = True
+	cases = [[count, "json"] for count in SIZES] + [[SIZES[-1], "cbor"]]
+	print()
+	print("appts  body   identity          deflate          gzip")
+	for count, body_type in cases:
+		line = "%-6d %-6s" % (count, body_type)
+		for encoding in ("identity", "deflate", "gzip"):
+			size, best = bench(count, body_type, encoding)
+			line += " %6d B %5.2f ms" % (size, best/1000)
+		print(line)
+
+if __name__ == "__main__":
+	main()
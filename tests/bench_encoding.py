@@ -0,0 +1,103 @@
+"""
+Benchmark of the compact message encoding (run with "python tests/bench_encoding.py")
+A device talks to a local mock server once with json and once with the compact encoding (cbor):
+an initial post answered with 10 appointments, a single appointment answer, a batch of 8 answers
+and the batch results reply. The body sizes sent each way are compared
+"""
+import json
+import os
+import sys
+
+#host setup shared with the tests (module names, const, ticks functions)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest
+import comms
+import cbor_stream
+from config import communication_configuration as commconf
+from mock_server import Mock_Server, response
+
+#number of appointments in the initial reply, and of answers in the batch
+APPOINTMENTS = 10
+BATCH = 8
+
+#class for a server that answers in the encoding the device asked for, and records the size of
+#every body: sizes maps a message name to its body size
+class Encoding_Server(Mock_Server):
+	def __init__(self):
+		super().__init__(self.answer)
+		self.sizes = {}
+
+	#function to answer a request of the device
+	def answer(self, request):
+		compact = comms.CBOR_TYPE in request.headers.get("accept", "") or request.headers.get("content-type", "").startswith(comms.CBOR_TYPE)
+		if request.path == commconf.INIT_MESSAGE_PATH:
+			return self.reply("initial reply", initial_reply(), compact)
+		if compact:
+			message = comms.convert_datetimes(cbor_stream.loads(request.body, comms.WIRE_KEYS), comms.wire_datetime)
+		else:
+			message = json.loads(request.body)
+		if "answers" in message:
+			self.sizes["batch of " + str(len(message["answers"])) + " answers"] = len(request.body)
+			results = []
+			for answer in message["answers"]:
+				results.append({"appointment_id": str(answer["appointment_id"]), "success": True})
+			return self.reply("batch results reply", {"results": results}, compact)
+		self.sizes["single appointment answer"] = len(request.body)
+		return response(b"The device message was successfully sent!", content_type="text/plain")
+
+	#function to encode reply, recording its size under name
+	def reply(self, name, reply, compact):
+		if compact:
+			body = comms.encode_compact(reply)
+			content_type = comms.CBOR_TYPE
+		else:
+			body = json.dumps(reply).encode()
+			content_type = comms.JSON_TYPE
+		self.sizes[name] = len(body)
+		return response(body, content_type=content_type)
+
+#function to build the initial post reply with APPOINTMENTS appointments
+def initial_reply():
+	reply = [{"server_date_time": "2021-03-28T10:05:00.000", "sync": "full", "batch_replies": True}]
+	for i in range(APPOINTMENTS):
+		reply.append({"fields": {"appointment_ID": 100+i, "appointment_start_date_time": "2021-04-01T12:00:00", "cancelled": False}})
+	return reply
+
+#function to make a message with an answer to each of count appointments
+def answers_message(count):
+	mess = comms.Dev_Message("838458", "heyaedin", 3.7)
+	for i in range(count):
+		answers = [{"answer": True, "time_answered": "2021-03-28T10:00:00.000", "number": 1, "sent": False}]
+		mess.include_appointment_answer(comms.Appointment(100+i, answers, "2021-04-01T12:00:00"))
+	return mess
+
+#function to run the messages of the benchmark, compact selects the compact encoding
+#returns the body sizes by message name
+def bench(compact):
+	commconf.COMPACT_ENCODING = compact
+	server = Encoding_Server()
+	try:
+		network = comms.Dev_Network(comms.Http_Client(server.url), "BENCH")
+		mess = comms.Dev_Message("838458", "heyaedin", 3.7)
+		success, datetime, appt_data = network.send_initial_post(mess)
+		assert success and len(list(appt_data)) == APPOINTMENTS
+		assert network.send_appointment_reply_post(answers_message(1))[0]
+		assert network.send_appointment_replies_post(answers_message(BATCH)) == [[100+i, True] for i in range(BATCH)]
+		network.http.close()
+	finally:
+		server.close()
+	return server.sizes
+
+def main():
+	comms.printline = conftest.quiet
+	commconf.HTTP_COMPRESSION = False
+	json_sizes = bench(False)
+	cbor_sizes = bench(True)
+	print()
+	print("message                               json    cbor")
+	print("%-36s %5d %7d" % ("initial reply, " + str(APPOINTMENTS) + " appointments", json_sizes["initial reply"], cbor_sizes["initial reply"]))
+	for name in ("single appointment answer", "batch of " + str(BATCH) + " answers", "batch results reply"):
+		print("%-36s %5d %7d" % (name, json_sizes[name], cbor_sizes[name]))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,100 @@
+"""
+Benchmark of the streamed json section files (run with "python tests/bench_json_stream.py")
+appointments.json files of 10, 100 and 1000 appointments are read with json.loads(read()) and
+with Json_Reader, and written with json.dumps and with Json_Writer, in a temporary directory
+The heap (tracemalloc) used beyond the parsed result is compared, with the 256 byte buffer
+of storage_configuration.STREAM_BUFFER_SIZE
+"""
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+#host setup shared with the tests (module names, const, ticks functions)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest
+from config import storage_configuration as storeconf
+from device_files import appointment
+from json_stream import Json_Reader, Json_Writer
+
+#numbers of appointments in the file that are measured
+SIZES = (10, 100, 1000)
+
+#function to make the appointments section of count appointments
+def appointments_section(count):
+	appointments = []
+	for i in range(count):
+		answers = [[1, True], [2, False]] if i % 2 else []
+		appointments.append(appointment(100+i, "2021-04-10T12:00:00", answers))
+	return {"gen": 1, "appointments": appointments}
+
+#function to run func while tracing the heap, returns the heap peak beyond what is still
+#allocated when func returns (the parsed result), in bytes
+def extra_heap(func):
+	tracemalloc.start()
+	#the result is kept until the heap is measured
+	result = func()
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del result
+	return peak - current
+
+def read_loads():
+	with open("appointments.json") as loc_file:
+		return json.loads(loc_file.read())
+
+def read_stream():
+	with open("appointments.json", "rb") as loc_file:
+		return Json_Reader(loc_file, bytearray(storeconf.STREAM_BUFFER_SIZE)).load()
+
+#function to write section with json.dumps
+def write_dumps(section):
+	with open("appointments.json", "w") as loc_file:
+		loc_file.write(json.dumps(section))
+
+#function to write section with Json_Writer
+def write_stream(section):
+	with open("appointments.json", "wb") as loc_file:
+		writer = Json_Writer(loc_file, bytearray(storeconf.STREAM_BUFFER_SIZE))
+		writer.dump(section)
+		writer.close()
+
+#function to measure one file size, returns the file size and the extra heap of each method
+def bench(count):
+	section = appointments_section(count)
+	write_stream(section)
+	#both readers give the same result
+	assert read_loads() == read_stream() == section
+	size = os.stat("appointments.json").st_size
+	results = [size]
+	results.append(extra_heap(read_loads))
+	results.append(extra_heap(read_stream))
+	results.append(extra_heap(bind_section(write_dumps, section)))
+	results.append(extra_heap(bind_section(write_stream, section)))
+	return results
+
+#function to make a function without arguments that calls func with section
+def bind_section(func, section):
+	def call():
+		func(section)
+	return call
+
+def main():
+	results = []
+	cwd = os.getcwd()
+	with tempfile.TemporaryDirectory() as work_dir:
+		os.chdir(work_dir)
+		try:
+			for count in SIZES:
+				results.append([count] + bench(count))
+		finally:
+			os.chdir(cwd)
+	print()
+	print("heap used beyond the result, in bytes")
+	print("appointments   file bytes   json.loads   Json_Reader   json.dumps   Json_Writer")
+	for count, size, loads, reader, dumps, writer in results:
+		print("%12d %12d %12d %13d %12d %13d" % (count, size, loads, reader, dumps, writer))
+
+if __name__ == "__main__":
+	main()
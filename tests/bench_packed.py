@@ -0,0 +1,77 @@
+"""
+Benchmark of the packed appointments format (run with "python tests/bench_packed.py")
+Stores of 10, 100 and 1000 appointments are written as appointments.json and as appointments.bin
+in a temporary directory, and the heap peak (tracemalloc) and time of a boot that loads them
+and finds the next due reminder are compared
+MAX_APPOINTMENTS is raised above the largest store so the retention policy removes nothing
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+#host setup shared with the tests (module names, const, ticks functions)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest
+import file_funcs
+from config import storage_configuration as storeconf
+from device_files import appointment, make_file_io
+
+#numbers of stored appointments that are measured
+SIZES = (10, 100, 1000)
+
+#function to write a store of count appointments in both formats
+def write_store(count):
+	appointments = []
+	for i in range(count):
+		#every other appointment has a sent answer to its first reminder
+		answers = [[1, True]] if i % 2 else []
+		appointments.append(appointment(100+i, "2021-04-10T12:00:00", answers))
+	#the packed store of the previous size would be read instead of the new appointments.json
+	file_funcs.remove_file("appointments.bin")
+	storeconf.APPOINTMENT_FORMAT = "json"
+	make_file_io(appointments)
+	with open("appointments.json") as loc_file:
+		json_snapshot = loc_file.read()
+	#loading in packed mode moves the appointments to appointments.bin and removes appointments.json
+	storeconf.APPOINTMENT_FORMAT = "packed"
+	file_funcs.FileIO().appointments
+	with open("appointments.json", "w") as loc_file:
+		loc_file.write(json_snapshot)
+
+#function to boot in the given format, returns the heap peak in bytes, the time in microseconds
+#and the size of the file read
+def bench(appointment_format):
+	storeconf.APPOINTMENT_FORMAT = appointment_format
+	file_name = "appointments.bin" if appointment_format == "packed" else "appointments.json"
+	tracemalloc.start()
+	start = time.ticks_us()
+	file_io_inst = file_funcs.FileIO()
+	file_io_inst.get_next_reminder_time()
+	elapsed = time.ticks_diff(time.ticks_us(), start)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return peak, elapsed, os.stat(file_name).st_size
+
+def main():
+	file_funcs.printline = conftest.quiet
+	storeconf.MAX_APPOINTMENTS = max(SIZES)
+	results = []
+	cwd = os.getcwd()
+	with tempfile.TemporaryDirectory() as work_dir:
+		os.chdir(work_dir)
+		try:
+			for count in SIZES:
+				write_store(count)
+				for appointment_format in ("json", "packed"):
+					results.append([count, appointment_format] + list(bench(appointment_format)))
+		finally:
+			os.chdir(cwd)
+	print()
+	print("appointments   format   file bytes   heap peak bytes   boot us")
+	for count, appointment_format, peak, elapsed, size in results:
+		print("%12d   %-6s %12d %17d %9d" % (count, appointment_format, size, peak, elapsed))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the portal request parser (run with "python tests/bench_portal_parser.py")
+Form posts of 1, 4 and 16 KB (4 fields with long percent encoded values) are read with the field
+lookup the portal used before Http_Request (get_var_from_string below), with parse_form, and fed
+to an Http_Request in AP_READ_SIZE reads
+Times are host CPython, best of 5, only the relative numbers carry over to the device
+AP_BODY_SIZE is raised above the largest body so no post is refused
+"""
+import os
+import sys
+import time
+
+#host setup shared with the tests (module names, const, ticks functions)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest
+import comms
+from config import communication_configuration as commconf
+
+#body sizes in bytes, names of the form fields, and how many times each parse is run
+SIZES = (1024, 4096, 16384)
+FIELDS = ("ssid", "password", "server_url", "note")
+RUNS = 5
+
+#function to find the value in a key/value pair (formatted like name=val&2ndname=val2)
+#the lookup of the portal before Http_Request, kept here as the baseline
+def get_var_from_string(inp_string, desired_var):
+	var_loc = inp_string.find(desired_var)
+	if var_loc >= 0:
+		#offset for 'name=' characters
+		var_loc += len(desired_var)+1
+		new_value = ""
+		while var_loc+1 < len(inp_string):
+			if inp_string[var_loc] == '&':
+				break
+			new_value += inp_string[var_loc]
+			var_loc += 1
+		return new_value
+	else:
+		return None
+
+#function to build a form body of about size bytes, the values are percent encoded text
+def form_body(size):
+	#whole chunks only, a cut escape would not decode
+	chunk = "Caf%C3%A9+Wifi+p%26ss%3Dw0rd+"
+	value = chunk * ((size // len(FIELDS) - 16) // len(chunk))
+	return "&".join([name + "=" + value for name in FIELDS]).encode()
+
+#function to build the bytes of a form post with body
+def form_post(body):
+	head = "POST /configure HTTP/1.1\r\nHost: 192.168.4.1\r\nContent-Type: application/x-www-form-urlencoded\r\nContent-Length: " + str(len(body)) + "\r\n\r\n"
+	return head.encode() + body
+
+#function to read the fields of request the old way (each one looked up in the whole request text)
+def old_lookup(request):
+	text = str(request, 'utf-8')
+	return [get_var_from_string(text, name) for name in FIELDS]
+
+#function to read the fields of the body of request with parse_form
+def new_parse(request):
+	return comms.parse_form(request[request.find(b"\r\n\r\n")+4:])
+
+#function to feed request to an Http_Request in AP_READ_SIZE reads
+def fed(request):
+	parsed = comms.Http_Request()
+	for start in range(0, len(request), commconf.AP_READ_SIZE):
+		parsed.feed(request[start:start+commconf.AP_READ_SIZE])
+	assert parsed.done and parsed.status == 0
+	return parsed.form
+
+#function to get the best time of RUNS calls of func(request), in microseconds
+def best_time(func, request):
+	best = None
+	for i in range(RUNS):
+		start = time.ticks_us()
+		func(request)
+		elapsed = time.ticks_diff(time.ticks_us(), start)
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def main():
+	comms.printline = conftest.quiet
+	commconf.AP_BODY_SIZE = max(SIZES)
+	print()
+	print("body      old lookup   parse_form   feed %d B reads + parse" % commconf.AP_READ_SIZE)
+	for size in SIZES:
+		request = form_post(form_body(size))
+		#both new parsers give the same fields
+		assert new_parse(request) == fed(request)
+		times = [best_time(func, request)/1000 for func in (old_lookup, new_parse, fed)]
+		print("%-9s %7.2f ms   %7.2f ms   %7.2f ms" % (str(size // 1024) + " KB", times[0], times[1], times[2]))
+
+if __name__ == "__main__":
+	main()
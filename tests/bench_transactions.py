@@ -0,0 +1,84 @@
+"""
+Benchmark of the flash writes of a wake cycle (run with "python tests/bench_transactions.py")
+The mutations of a typical wake (5 appointments from the server, a cancellation, an answer, its
+sent status and the sleep time) are made the way FileIO used to make them, written and read back
+after every mutation, and in one transaction, in a temporary directory
+"""
+import os
+import sys
+import tempfile
+import time
+
+#host setup shared with the tests (module names, const, ticks functions)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conftest
+import file_funcs
+from comms import Appointment
+from dev_funcs import Recorded_Time
+from device_files import appointment, make_file_io
+
+#number of appointments already stored before the wake
+STORED = 20
+
+#function to make the mutations of one wake cycle on file_io_inst
+def wake_cycle(file_io_inst):
+	new_appts = []
+	for i in range(5):
+		new_appts.append(Appointment(500+i, [], "2021-04-0" + str(i+1) + "T12:00:00"))
+	file_io_inst.reconcile_appointments(new_appts)
+	file_io_inst.cancel_appointment(100)
+	file_io_inst.new_appointment_answer(101, True, Recorded_Time("2021-03-28T10:00:00.000"), 1)
+	file_io_inst.update_appointment_answer_status(101, True, 1)
+	file_io_inst.update_last_known_time("2021-03-28T10:30:00.000")
+
+#class for a FileIO that writes and reads back its data after every mutation, as FileIO did
+#before the transactions (each mutation rewrote the file and parsed it again)
+class Per_Mutation_FileIO(file_funcs.FileIO):
+	def transaction(self):
+		return No_Transaction()
+
+	def mutate(self, record):
+		super().mutate(record)
+		self.load_local_vars()
+		self.appointments
+
+#class for a with block that does not group writes
+class No_Transaction:
+	def __enter__(self):
+		return None
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+#function to run one wake cycle with a FileIO of the class file_io_class, returns the number of
+#flash writes, the bytes written and the time taken in microseconds
+def bench(file_io_class):
+	appointments = []
+	for i in range(STORED):
+		appointments.append(appointment(100+i, "2021-04-10T12:00:00"))
+	make_file_io(appointments)
+	start = time.ticks_us()
+	file_io_inst = file_io_class()
+	with file_io_inst.transaction():
+		wake_cycle(file_io_inst)
+	elapsed = time.ticks_diff(time.ticks_us(), start)
+	return file_io_inst.write_count, file_io_inst.bytes_written, elapsed
+
+def main():
+	file_funcs.printline = conftest.quiet
+	results = []
+	cwd = os.getcwd()
+	with tempfile.TemporaryDirectory() as work_dir:
+		os.chdir(work_dir)
+		try:
+			results.append(["write per mutation"] + list(bench(Per_Mutation_FileIO)))
+			results.append(["one transaction"] + list(bench(file_funcs.FileIO)))
+		finally:
+			os.chdir(cwd)
+	print()
+	print("wake cycle            writes   bytes written   time us")
+	for name, writes, written, elapsed in results:
+		print("%-20s %7d %15d %9d" % (name, writes, written, elapsed))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,142 @@
+"""
+Host setup for the tests
+The repo root is put on the import path, and on CPython the MicroPython modules the firmware
+imports are mapped to their CPython counterparts, the hardware modules (machine, network) get
+empty stand-ins since the tests pass their own fakes (see fake_modem.py)
+usocket gets a socket with the readinto and write functions of a MicroPython socket, so
+Http_Client can talk to a local server (see mock_server.py), and uzlib a DecompIO over zlib
+"""
+import sys
+import os
+import time
+import types
+import builtins
+import socket
+import zlib
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#function to stand in for micropython.const (a plain value on the host)
+def const(value):
+	return value
+
+#function to get milliseconds from a monotonic clock (time.ticks_ms on the device)
+def ticks_ms():
+	return int(time.monotonic()*1000)
+
+#function to get microseconds from a monotonic clock (time.ticks_us on the device)
+def ticks_us():
+	return int(time.monotonic()*1000000)
+
+#function to add to a ticks value (time.ticks_add on the device)
+def ticks_add(ticks, delta):
+	return ticks + delta
+
+#function to get the difference of two ticks values (time.ticks_diff on the device)
+def ticks_diff(end, start):
+	return end - start
+
+#function to sleep for ms milliseconds (time.sleep_ms on the device)
+def sleep_ms(ms):
+	time.sleep(ms/1000)
+
+#function to drop printed lines (benchmarks replace printline with it)
+def quiet(*args):
+	pass
+
+#class standing in for the machine peripherals the firmware makes (unused by the tests)
+class Hardware:
+	OUT = 1
+	IN = 0
+	PULL_UP = 2
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def value(self, *args):
+		return 0
+
+#class for a host socket that reads and writes like a MicroPython socket
+#(readinto and write return None instead of raising when a non-blocking socket is not ready)
+class Host_Socket(socket.socket):
+	def readinto(self, buf):
+		try:
+			return self.recv_into(buf)
+		except BlockingIOError:
+			return None
+
+	def write(self, data):
+		try:
+			return self.send(data)
+		except BlockingIOError:
+			return None
+
+#class for a host stream that decompresses the stream it reads from, like uzlib.DecompIO
+#(wbits as for zlib: a zlib header, or a gzip header with 16 added)
+class Host_DecompIO:
+	def __init__(self, stream, wbits=0):
+		self.stream = stream
+		self.decomp = zlib.decompressobj(wbits)
+		#decompressed bytes not read yet, and buffer the compressed stream is read into
+		self.out = b""
+		self.raw = bytearray(64)
+		self.eof = False
+
+	#function to read decompressed bytes into buf, returns 0 at the end of the stream
+	def readinto(self, buf):
+		while not self.out and not self.eof:
+			count = self.stream.readinto(self.raw)
+			if not count:
+				self.out = self.decomp.flush()
+				self.eof = True
+				continue
+			try:
+				self.out = self.decomp.decompress(bytes(self.raw[:count]))
+			except zlib.error as e:
+				#uzlib raises OSError for a bad stream
+				raise OSError(22, str(e))
+			self.eof = self.decomp.eof
+		count = min(len(buf), len(self.out))
+		buf[:count] = self.out[:count]
+		self.out = self.out[count:]
+		return count
+
+if sys.implementation.name != "micropython":
+	builtins.const = const
+	for name, host_name in (("ujson", "json"), ("uos", "os"), ("ustruct", "struct"), ("ubinascii", "binascii"),
+			("uselect", "select"), ("uio", "io"), ("uasyncio", "asyncio")):
+		sys.modules.setdefault(name, __import__(host_name))
+	usocket = types.ModuleType("usocket")
+	usocket.socket = Host_Socket
+	usocket.getaddrinfo = socket.getaddrinfo
+	usocket.AF_INET = socket.AF_INET
+	usocket.SOCK_STREAM = socket.SOCK_STREAM
+	sys.modules.setdefault("usocket", usocket)
+	uzlib = types.ModuleType("uzlib")
+	uzlib.DecompIO = Host_DecompIO
+	sys.modules.setdefault("uzlib", uzlib)
+	time.ticks_ms = ticks_ms
+	time.ticks_us = ticks_us
+	time.ticks_add = ticks_add
+	time.ticks_diff = ticks_diff
+	time.sleep_ms = sleep_ms
+	machine = types.ModuleType("machine")
+	machine.UART = machine.Pin = machine.RTC = Hardware
+	sys.modules.setdefault("machine", machine)
+	network = types.ModuleType("network")
+	network.STA_IF = 0
+	network.AP_IF = 1
+	sys.modules.setdefault("network", network)
+
+#fixture that runs a test in an empty temporary directory with the default storage settings,
+#for tests that write section files (see device_files.py)
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+	from config import storage_configuration as storeconf
+	import file_funcs
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setattr(storeconf, "BACKEND", "snapshot")
+	monkeypatch.setattr(storeconf, "APPOINTMENT_FORMAT", "json")
+	monkeypatch.setattr(file_funcs, "printline", print)
+	return tmp_path
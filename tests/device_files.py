@@ -0,0 +1,35 @@
+"""
+Section files of a test device, written to the current (temporary) directory
+"""
+import json
+from file_funcs import FileIO
+
+#time the device last knew, appointments before it have passed
+NOW = "2021-03-28T10:00:00.000"
+
+#function to make an appointment dict, answers is a list of [number, sent]
+def appointment(appt_id, date_time, answers=(), cancelled=False):
+	appt_answers = []
+	for number, sent in answers:
+		appt_answers.append({"answer": True, "time_answered": "2021-03-20T10:00:00.000", "number": number, "sent": sent})
+	return {"appointment_id": appt_id, "appointment_date_time": date_time, "answers": appt_answers, "cancelled": cancelled}
+
+#function to write the section files of a device with the given appointments, returns a FileIO on them
+def make_file_io(appointments):
+	sections = 	{
+					"device_info.json": {"dev_id": "838458", "server_pass": "heyaedin", "firm_version": "1.0", "quiet_hours": {"start_time": "22", "end_time": "7"}},
+					"clock.json": {"last_known_time": NOW},
+					"wifi_params.json": [],
+					"appointments.json": {"gen": 1, "appointments": appointments}
+				}
+	for name in sections:
+		with open(name, 'w') as loc_file:
+			json.dump(sections[name], loc_file)
+	return FileIO()
+
+#function to get the ids of the stored appointments
+def stored_ids(file_io_inst):
+	ids = []
+	for appt in file_io_inst.appointments:
+		ids.append(appt["appointment_id"])
+	return ids
@@ -0,0 +1,71 @@
+"""
+Scripted modem for testing Dev_Cell and At_Modem on the host
+Fake_Uart has the uart interface At_Modem uses (write, any and readinto), each write is checked
+against the next step of a script and answered with the modem output of that step
+"""
+
+#class for a pseudo uart that replays scripted modem output
+#script is a list of (expected, output) steps: expected is the command line the device should
+#write next (without the "\r") or its raw data (None matches any write), output is the text the
+#modem answers with, writes that do not match the next step are recorded and not answered
+class Fake_Uart:
+	def __init__(self, script):
+		self.script = list(script)
+		#every write (as text), and the writes that did not match the script
+		self.sent = []
+		self.unexpected = []
+		#modem output not read yet
+		self.out = bytearray()
+
+	def write(self, data):
+		text = str(bytes(data), 'utf-8')
+		if text.endswith("\r"):
+			text = text[:-1]
+		self.sent.append(text)
+		if self.script and self.script[0][0] in (None, text):
+			self.out += self.script.pop(0)[1].encode()
+		else:
+			self.unexpected.append(text)
+		return len(data)
+
+	def any(self):
+		return len(self.out)
+
+	def readinto(self, buf):
+		count = min(len(buf), len(self.out))
+		buf[:count] = self.out[:count]
+		self.out = self.out[count:]
+		return count
+
+#class for the modem wake pin, records the values it is set to
+class Fake_Pin:
+	def __init__(self):
+		self.values = []
+
+	def value(self, value):
+		self.values.append(value)
+
+#function to get the modem output of a successful command, lines are its information lines
+def ok(*lines):
+	out = ""
+	for line in lines:
+		out += "\r\n" + line + "\r\n"
+	return out + "\r\nOK\r\n"
+
+#function to get the modem output of a failed command
+def error(code=None):
+	if code is None:
+		return "\r\nERROR\r\n"
+	return "\r\n+CME ERROR: " + str(code) + "\r\n"
+
+#steps of a modem that answers and has a sim, up to the registration query
+def start_steps(registration):
+	return 	[
+				("AT", ok()),
+				("ATE0+CMEE=1;+CEREG=1", ok()),
+				("AT+CPIN?", ok("+CPIN: READY")),
+				("AT+CEREG?", ok("+CEREG: 1," + str(registration)))
+			]
+
+#step of the power down the driver sends when it gives up
+POWER_DOWN = ("AT+CPOWD=1", "\r\nNORMAL POWER DOWN\r\n")
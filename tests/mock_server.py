@@ -0,0 +1,108 @@
+"""
+Local http server the tests point Http_Client at, each connection is served by its own thread
+"""
+import json
+import socket
+import struct
+import threading
+
+#handler results that end the connection without a response: CLOSE closes it, RESET makes the
+#client see a connection reset (ECONNRESET)
+CLOSE = "close"
+RESET = "reset"
+
+#class for a request the mock server read (method, path, headers by lower case name, body bytes)
+class Mock_Request:
+	def __init__(self, method, path, headers, body):
+		self.method = method
+		self.path = path
+		self.headers = headers
+		self.body = body
+
+	#function to parse the body as json
+	def json(self):
+		return json.loads(self.body)
+
+#class for a local http server, every request is passed to handler(request) which returns the
+#bytes to send (see response()), CLOSE or RESET, or a list of those that are done in turn
+#requests holds every request read, connections the number of connections accepted
+class Mock_Server:
+	def __init__(self, handler):
+		self.handler = handler
+		self.requests = []
+		self.connections = 0
+		self.sock = socket.socket()
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(("127.0.0.1", 0))
+		self.sock.listen(5)
+		self.port = self.sock.getsockname()[1]
+		self.url = "http://127.0.0.1:" + str(self.port)
+		threading.Thread(target=self.accept, daemon=True).start()
+
+	#function to stop accepting connections
+	def close(self):
+		self.sock.close()
+
+	def accept(self):
+		while True:
+			try:
+				conn, addr = self.sock.accept()
+			except OSError:
+				return
+			self.connections += 1
+			threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+	#function to answer the requests of one connection until it is closed
+	def serve(self, conn):
+		stream = conn.makefile('rb')
+		try:
+			while True:
+				request = read_request(stream)
+				if request is None:
+					return
+				self.requests.append(request)
+				reply = self.handler(request)
+				if not isinstance(reply, list):
+					reply = [reply]
+				for part in reply:
+					if part == RESET:
+						#a zero linger time makes close() send a reset
+						conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+						return
+					if part == CLOSE:
+						return
+					conn.sendall(part)
+		except OSError:
+			pass
+		finally:
+			stream.close()
+			conn.close()
+
+#function to read one request from a connection, returns None if it was closed
+def read_request(stream):
+	line = stream.readline()
+	if not line:
+		return None
+	method, path = line.decode().split(" ")[:2]
+	headers = {}
+	while True:
+		line = stream.readline().decode().strip()
+		if not line:
+			break
+		name, value = line.split(":", 1)
+		headers[name.strip().lower()] = value.strip()
+	body = stream.read(int(headers.get("content-length", "0")))
+	return Mock_Request(method, path, headers, body)
+
+#function to build the bytes of a response, body is bytes or a value sent as json
+#length is the Content-Length sent (the body size if None, a larger one makes a truncated body)
+#encoding is the Content-Encoding sent (None sends none), body must already be encoded with it
+def response(body, status=200, content_type="application/json", length=None, encoding=None):
+	if not isinstance(body, bytes):
+		body = json.dumps(body).encode()
+	if length is None:
+		length = len(body)
+	head = "HTTP/1.1 " + str(status) + " OK\r\nContent-Type: " + content_type + "\r\nContent-Length: " + str(length) + "\r\n"
+	if encoding is not None:
+		head += "Content-Encoding: " + encoding + "\r\n"
+	return (head + "\r\n").encode() + body
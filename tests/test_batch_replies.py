@@ -0,0 +1,72 @@
+"""
+Tests of batched answer posts (send_appointment_replies_post, handle_batch_reply) against a local mock server
+"""
+import json
+import pytest
+import comms
+from config import communication_configuration as commconf
+from mock_server import Mock_Server, response, CLOSE
+
+@pytest.fixture(autouse=True)
+def short_timeouts(monkeypatch):
+	monkeypatch.setattr(commconf, "HTTP_TIMEOUT", 2)
+	monkeypatch.setattr(commconf, "HTTP_COMPRESSION", False)
+	monkeypatch.setattr(comms, "printline", print)
+
+#function to make a message with an answer for every id of ids
+def answers_message(ids):
+	mess = comms.Dev_Message("838458", "heyaedin", 3.7)
+	for appt_id in ids:
+		answers = [{"answer": True, "time_answered": "2021-03-28T10:00:00.000", "number": 1, "sent": False}]
+		mess.include_appointment_answer(comms.Appointment(appt_id, answers, "2021-04-01T12:00:00"))
+	return mess
+
+#function to send the answers of ids in batches to a server that answers with handler
+#returns the [appointment_id, success] results and the server
+def send_batch(handler, ids):
+	server = Mock_Server(handler)
+	try:
+		network = comms.Dev_Network(comms.Http_Client(server.url), "TEST")
+		network.batch_replies = True
+		results = network.send_appointment_replies_post(answers_message(ids))
+		network.http.close()
+	finally:
+		server.close()
+	return results, server
+
+def test_partial_success():
+	results, server = send_batch(lambda request: response({"results": [{"appointment_id": "1", "success": True}, {"appointment_id": "2", "success": False}]}), [1, 2, 3])
+	#3 is not listed in the reply, so it was not accepted
+	assert results == [[1, True], [2, False], [3, False]]
+	assert len(server.requests) == 1
+	assert [answer["appointment_id"] for answer in server.requests[0].json()["answers"]] == [1, 2, 3]
+
+def test_string_and_int_ids_match():
+	results, server = send_batch(lambda request: response({"results": [{"appointment_id": 1, "success": True}, {"appointment_id": "2", "success": True}]}), [1, 2])
+	assert results == [[1, True], [2, True]]
+
+def test_malformed_entries_are_skipped():
+	entries = [{"success": True}, "2", None, [3, True], {"appointment_id": 4}, {"appointment_id": 5, "success": "yes"}, {"appointment_id": 6, "success": True}]
+	results, server = send_batch(lambda request: response({"results": entries}), [1, 2, 3, 4, 5, 6])
+	assert results == [[1, False], [2, False], [3, False], [4, False], [5, False], [6, True]]
+
+@pytest.mark.parametrize("reply", [{"results": "ok"}, {"results": None}, {}, ["results"], "ok"])
+def test_malformed_reply_accepts_nothing(reply):
+	results, server = send_batch(lambda request: response(reply), [1, 2])
+	assert results == [[1, False], [2, False]]
+
+def test_truncated_body_accepts_nothing():
+	body = json.dumps({"results": [{"appointment_id": "1", "success": True}, {"appointment_id": "2", "success": True}]}).encode()
+	results, server = send_batch(lambda request: [response(body[:len(body)-20], length=len(body)), CLOSE], [1, 2])
+	assert results == [[1, False], [2, False]]
+
+def test_answers_are_split_into_batches(monkeypatch):
+	monkeypatch.setattr(commconf, "REPLY_BATCH_SIZE", 2)
+	#the server accepts every answer of each batch
+	def accept_all(request):
+		return response({"results": [{"appointment_id": str(answer["appointment_id"]), "success": True} for answer in request.json()["answers"]]})
+	results, server = send_batch(accept_all, [1, 2, 3, 4])
+	assert results == [[1, True], [2, True], [3, True], [4, True]]
+	assert len(server.requests) == 2
+	#the batches share one kept open connection
+	assert server.connections == 1
@@ -0,0 +1,124 @@
+"""
+Tests of the cellular modem driver (Dev_Cell, At_Modem, Cell_Http_Client) against scripted modems
+"""
+import pytest
+import comms
+from config import communication_configuration as commconf
+from fake_modem import Fake_Uart, Fake_Pin, ok, error, start_steps, POWER_DOWN
+
+#operator of a registration kept in the state cache
+OPERATOR = {"plmn": "310410", "act": 7}
+#command line that sets the power saving timers and starts an automatic network search
+REGISTER_LINE = "AT" + comms.power_saving_command() + ";" + comms.edrx_command() + ";+COPS=0"
+#command line that sets up the bearer
+BEARER_SETUP_LINE = 'AT+SAPBR=3,1,"Contype","GPRS";+SAPBR=3,1,"APN","' + commconf.CELL_APN + '"'
+
+@pytest.fixture(autouse=True)
+def short_timeouts(monkeypatch):
+	monkeypatch.setattr(commconf, "CELL_ENABLED", True)
+	monkeypatch.setattr(commconf, "CELL_PSM", True)
+	monkeypatch.setattr(commconf, "CELL_REGISTER_TIMEOUT", 100)
+	monkeypatch.setattr(commconf, "CELL_HTTP_TIMEOUT", 500)
+	monkeypatch.setattr(comms, "printline", print)
+
+#function to make a Dev_Cell on a scripted modem, returns the Dev_Cell and its Fake_Uart
+def make_cell(script, last_cell=None):
+	uart = Fake_Uart(script)
+	return comms.Dev_Cell(last_cell, uart, Fake_Pin()), uart
+
+def test_no_sim_powers_modem_down():
+	cell, uart = make_cell([("AT", ok()), ("ATE0+CMEE=1;+CEREG=1", ok()), ("AT+CPIN?", error(10)), POWER_DOWN])
+	assert cell.start_cellular() is False
+	assert uart.sent[-1] == "AT+CPOWD=1"
+	assert uart.unexpected == []
+	#the radio manager stops the interface after a failed start, nothing more is sent
+	cell.stop_cellular()
+	assert uart.sent[-1] == "AT+CPOWD=1"
+	assert len(uart.sent) == 4
+
+def test_registration_timeout_powers_modem_down():
+	cell, uart = make_cell(start_steps(2) + [(REGISTER_LINE, ok()), POWER_DOWN])
+	assert cell.start_cellular() is False
+	assert cell.registration == 2
+	assert uart.sent[-1] == "AT+CPOWD=1"
+	assert uart.unexpected == []
+
+def test_registration_urc_then_bearer():
+	cell, uart = make_cell(start_steps(2) + 	[
+													(REGISTER_LINE, ok() + "\r\n+CEREG: 5\r\n"),
+													("AT+COPS=3,2;+COPS?", ok('+COPS: 0,2,"310410",7')),
+													("AT+SAPBR=2,1", ok('+SAPBR: 1,3,"0.0.0.0"')),
+													(BEARER_SETUP_LINE, ok()),
+													("AT+SAPBR=1,1", ok())
+												])
+	assert cell.start_cellular() is True
+	assert cell.registration == 5
+	assert cell.registered_network == OPERATOR
+	assert uart.unexpected == []
+	#in PSM an attached modem is left to sleep on its own
+	count = len(uart.sent)
+	cell.stop_cellular()
+	assert len(uart.sent) == count
+
+def test_cached_operator_used_for_registration():
+	register_line = "AT" + comms.power_saving_command() + ";" + comms.edrx_command() + ';+COPS=4,2,"310410",7'
+	cell, uart = make_cell(start_steps(0) + 	[
+													(register_line, ok() + "\r\n+CEREG: 1\r\n"),
+													("AT+COPS=3,2;+COPS?", ok('+COPS: 1,2,"310410",7')),
+													("AT+SAPBR=2,1", ok('+SAPBR: 1,1,"10.0.0.2"'))
+												], OPERATOR)
+	assert cell.start_cellular() is True
+	assert uart.unexpected == []
+
+def test_bearer_failure_powers_modem_down():
+	cell, uart = make_cell(start_steps(1) + 	[
+													("AT+SAPBR=2,1", ok('+SAPBR: 1,3,"0.0.0.0"')),
+													(BEARER_SETUP_LINE, ok()),
+													("AT+SAPBR=1,1", error()),
+													POWER_DOWN
+												], OPERATOR)
+	assert cell.start_cellular() is False
+	assert uart.sent[-1] == "AT+CPOWD=1"
+	assert uart.unexpected == []
+
+def test_operator_missing_from_cops():
+	cell, uart = make_cell([("AT+COPS=3,2;+COPS?", ok("+COPS: 0"))])
+	assert cell.read_operator() is None
+
+#steps of a started modem with its bearer open
+ATTACHED_STEPS = start_steps(1) + [("AT+SAPBR=2,1", ok('+SAPBR: 1,1,"10.0.0.2"'))]
+#steps of an initial post up to the request (parameters and body are not checked)
+POST_STEPS = 	[
+					("AT+HTTPINIT", ok()),
+					(None, ok()),
+					(None, "\r\nDOWNLOAD\r\n"),
+					(None, ok())
+				]
+
+def test_http_action_error_fails_message():
+	cell, uart = make_cell(ATTACHED_STEPS + POST_STEPS + 	[
+																("AT+HTTPACTION=1", ok() + "\r\n+HTTPACTION: 1,601,0\r\n"),
+																("AT+HTTPTERM", ok())
+															], OPERATOR)
+	assert cell.start_cellular() is True
+	assert cell.send_initial_post(comms.Dev_Message("838458", "pw", 80)) == (False, "FAIL", None)
+	#the failed session is ended so the next message starts a new one
+	assert uart.sent[-1] == "AT+HTTPTERM"
+	assert uart.unexpected == []
+
+def test_initial_post_reads_reply():
+	body = '[{"server_date_time": "2021-03-28T10:00:00.000"}, ' \
+		'{"fields": {"appointment_ID": 100, "appointment_start_date_time": "2021-03-30T12:00:00"}}]'
+	head = "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: " + str(len(body)) + "\r\n"
+	cell, uart = make_cell(ATTACHED_STEPS + POST_STEPS + 	[
+																("AT+HTTPACTION=1", ok() + "\r\n+HTTPACTION: 1,200," + str(len(body)) + "\r\n"),
+																("AT+HTTPHEAD", "\r\n+HTTPHEAD: " + str(len(head)) + "\r\n" + head + "\r\nOK\r\n"),
+																("AT+HTTPREAD=0," + str(len(body)), "\r\n+HTTPREAD: " + str(len(body)) + "\r\n" + body + "\r\nOK\r\n")
+															], OPERATOR)
+	assert cell.start_cellular() is True
+	success, server_date_time, appointments = cell.send_initial_post(comms.Dev_Message("838458", "pw", 80))
+	assert success is True
+	assert server_date_time == "2021-03-28T10:00:00.000"
+	assert [appt.appointment_id for appt in appointments] == [100]
+	assert cell.sync_complete() is True
+	assert uart.unexpected == []
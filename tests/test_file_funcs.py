@@ -0,0 +1,66 @@
+"""
+Tests of the appointment storage in FileIO, run on section files in a temporary directory
+"""
+import os
+import pytest
+import file_funcs
+from config import storage_configuration as storeconf
+from file_funcs import FileIO
+from device_files import appointment, make_file_io, stored_ids
+
+pytestmark = pytest.mark.usefixtures("work_dir")
+
+def test_prune_keeps_upcoming_appointments_over_the_limit(monkeypatch):
+	monkeypatch.setattr(storeconf, "MAX_APPOINTMENTS", 3)
+	upcoming = []
+	for i in range(5):
+		upcoming.append(appointment(100+i, "2021-04-0" + str(i+1) + "T12:00:00"))
+	passed = [appointment(200, "2021-03-01T12:00:00", [[1, False]]), appointment(201, "2021-03-02T12:00:00")]
+	file_io_inst = make_file_io(upcoming + passed)
+	#any appointments write applies the retention policy
+	file_io_inst.mutate(["cancel", 999])
+	#passed appointments go, every upcoming one stays
+	assert stored_ids(file_io_inst) == [100, 101, 102, 103, 104]
+	assert stored_ids(FileIO()) == [100, 101, 102, 103, 104]
+
+def test_prune_drops_oldest_passed_appointments_over_the_limit(monkeypatch):
+	monkeypatch.setattr(storeconf, "MAX_APPOINTMENTS", 3)
+	appointments = [appointment(100, "2021-04-01T12:00:00")]
+	for i in range(4):
+		appointments.append(appointment(200+i, "2021-03-0" + str(i+1) + "T12:00:00", [[1, False]]))
+	file_io_inst = make_file_io(appointments)
+	file_io_inst.mutate(["cancel", 999])
+	assert stored_ids(file_io_inst) == [100, 202, 203]
+	assert file_io_inst.unsent_index == {202: 1, 203: 1}
+
+def test_server_list_over_the_limit_is_stored_once(monkeypatch):
+	monkeypatch.setattr(storeconf, "MAX_APPOINTMENTS", 3)
+	file_io_inst = make_file_io([])
+	server = []
+	for i in range(5):
+		server.append(file_funcs.Appointment(100+i, [], "2021-04-0" + str(i+1) + "T12:00:00"))
+	file_io_inst.reconcile_appointments(server)
+	writes = file_io_inst.write_count
+	digest = file_io_inst.get_sync_digest()
+	#the next sync sends the same list, nothing changes and nothing is written
+	file_io_inst = FileIO()
+	file_io_inst.reconcile_appointments(server)
+	assert file_io_inst.write_count == 0
+	assert file_io_inst.get_sync_digest() == digest
+	assert digest[0] == 5
+	assert writes == 1
+
+def test_format_setting_moves_stored_appointments(monkeypatch):
+	make_file_io([appointment(100, "2021-04-01T12:00:00"), appointment(101, "2021-04-02T12:00:00", [[1, True]])])
+	#switching to packed moves the appointments on the next load
+	monkeypatch.setattr(storeconf, "APPOINTMENT_FORMAT", "packed")
+	assert stored_ids(FileIO()) == [100, 101]
+	assert os.path.exists("appointments.bin") and not os.path.exists("appointments.json")
+	#switching back reads the packed file, and the next write stores json again
+	monkeypatch.setattr(storeconf, "APPOINTMENT_FORMAT", "json")
+	file_io_inst = FileIO()
+	assert stored_ids(file_io_inst) == [100, 101]
+	file_io_inst.cancel_appointment(100)
+	assert os.path.exists("appointments.json") and not os.path.exists("appointments.bin")
+	assert stored_ids(FileIO()) == [100, 101]
+	assert FileIO().find_appointment(101)["answers"][0]["sent"] is True
@@ -0,0 +1,95 @@
+"""
+Tests of the kept open connection of Http_Client against a local mock server
+"""
+import time
+import pytest
+import comms
+from config import communication_configuration as commconf
+from mock_server import Mock_Server, response, CLOSE, RESET
+
+@pytest.fixture(autouse=True)
+def short_timeouts(monkeypatch):
+	monkeypatch.setattr(commconf, "HTTP_TIMEOUT", 1)
+	monkeypatch.setattr(commconf, "HTTP_COMPRESSION", False)
+	monkeypatch.setattr(comms, "printline", print)
+
+#function to make a handler that answers the requests in turn with the replies of script
+#(the last one is used for every later request)
+def scripted(script):
+	def handler(request):
+		if len(script) > 1:
+			return script.pop(0)
+		return script[0]
+	return handler
+
+#function to make two requests over one Http_Client against a server that answers with script
+#returns the client, the server and the result of the second request (or the OSError it raised)
+def two_requests(script):
+	server = Mock_Server(scripted(script))
+	http = comms.Http_Client(server.url)
+	try:
+		assert http.request("POST", "/first", '{"n": 1}')[0] == 200
+		try:
+			status, content_type, body = http.request("POST", "/second", '{"n": 2}')
+			result = [status, bytes(body)]
+		except OSError as e:
+			result = e
+	finally:
+		http.close()
+		server.close()
+	return http, server, result
+
+def test_requests_share_the_connection():
+	http, server, result = two_requests([response({"ok": True})])
+	assert result == [200, b'{"ok": true}']
+	assert server.connections == 1
+	assert len(server.requests) == 2
+
+def test_resend_when_kept_open_connection_was_closed():
+	#the server closes the connection after its first response
+	http, server, result = two_requests([[response({"ok": 1}), CLOSE], response({"ok": 2})])
+	assert result == [200, b'{"ok": 2}']
+	assert server.connections == 2
+	assert [request.path for request in server.requests] == ["/first", "/second"]
+
+def test_resend_when_kept_open_connection_is_reset():
+	#the server resets the kept open connection when the second request arrives
+	http, server, result = two_requests([response({"ok": 1}), RESET, response({"ok": 2})])
+	assert result == [200, b'{"ok": 2}']
+	assert server.connections == 2
+	assert [request.path for request in server.requests] == ["/first", "/second", "/second"]
+
+def test_no_resend_after_timeout():
+	def slow(request):
+		if request.path == "/second":
+			time.sleep(1.5)
+			return CLOSE
+		return response({"ok": 1})
+	server = Mock_Server(slow)
+	http = comms.Http_Client(server.url)
+	try:
+		http.request("POST", "/first", "{}")
+		with pytest.raises(OSError):
+			http.request("POST", "/second", "{}")
+	finally:
+		http.close()
+		server.close()
+	#the server may have acted on the request, it is not sent again
+	assert [request.path for request in server.requests] == ["/first", "/second"]
+
+def test_no_resend_after_response_started():
+	#part of the status line arrives before the reset
+	http, server, result = two_requests([response({"ok": 1}), [b"HTTP/1.1 2", RESET], response({"ok": 2})])
+	assert isinstance(result, OSError)
+	assert [request.path for request in server.requests] == ["/first", "/second"]
+
+def test_no_resend_on_new_connection():
+	server = Mock_Server(scripted([RESET, response({"ok": 1})]))
+	http = comms.Http_Client(server.url)
+	try:
+		with pytest.raises(OSError):
+			http.request("POST", "/first", "{}")
+	finally:
+		http.close()
+		server.close()
+	assert len(server.requests) == 1
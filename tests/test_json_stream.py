@@ -0,0 +1,57 @@
+"""
+Tests of the streaming json reader and writer (json_stream.py)
+"""
+import io
+import json
+import pytest
+from json_stream import Json_Reader, Json_Writer
+
+#function to write value with a Json_Writer and read it back with a Json_Reader
+#buf_size is small so values are split over several buffer fills
+def round_trip(value, buf_size=8):
+	stream = io.BytesIO()
+	writer = Json_Writer(stream, buf_size=buf_size)
+	writer.dump(value)
+	writer.close()
+	stream.seek(0)
+	return Json_Reader(stream, buf_size=buf_size).load()
+
+#function to parse json text with a Json_Reader
+def read(text, buf_size=8):
+	return Json_Reader(io.BytesIO(text.encode()), buf_size=buf_size).load()
+
+@pytest.mark.parametrize("value", [
+	{"gen": 1, "appointments": [{"id": 100, "cancelled": False, "answers": [], "time": None}]},
+	[1, -2, 3.5, 1e-3, True, False, None, "", [], {}],
+	"tab\tnew line\nquote\" backslash\\ slash/",
+	"Café Wifi ünïcödé",
+	"\U0001F600 smile",
+	"emoji at the end \U0001F44D",
+	{"\U0001F600": "\U0001F600\U0001F601"}
+])
+def test_round_trip(value):
+	assert round_trip(value) == value
+
+def test_round_trip_matches_json_module():
+	value = {"name": "Docco \U0001F3E5", "notes": ["aé", "中文"]}
+	text = json.dumps(value)
+	assert read(text) == json.loads(text) == value
+
+def test_surrogate_pair_escape_is_one_character():
+	assert read('"\\ud83d\\ude00"') == "\U0001F600"
+	assert read('"a\\uD83D\\uDE00b"') == "a\U0001F600b"
+
+@pytest.mark.parametrize("buf_size", [1, 2, 3, 5, 7, 13])
+def test_surrogate_pair_split_over_fills(buf_size):
+	assert read('["x\\ud83d\\ude00y", 1]', buf_size) == ["x\U0001F600y", 1]
+
+@pytest.mark.parametrize("text, expected", [
+	('"\\ud83d"', "\uFFFD"),
+	('"\\ud83dx"', "\uFFFDx"),
+	('"\\ude00"', "\uFFFD"),
+	('"\\ud83d\\n"', "\uFFFD\n"),
+	('"\\ud83d\\u0041"', "\uFFFDA"),
+	('"\\ud83d\\ud83d\\ude00"', "\uFFFD\U0001F600")
+])
+def test_lone_surrogate_is_replaced(text, expected):
+	assert read(text) == expected
@@ -0,0 +1,83 @@
+"""
+Tests of the appointment sync (initial post and reconcile) against a local mock server
+"""
+import pytest
+import comms
+from config import communication_configuration as commconf
+from device_files import appointment, make_file_io, stored_ids
+from mock_server import Mock_Server, response, CLOSE
+
+pytestmark = pytest.mark.usefixtures("work_dir")
+
+#server time of the replies
+SERVER_TIME = "2021-03-28T10:05:00.000"
+
+@pytest.fixture(autouse=True)
+def short_timeouts(monkeypatch):
+	monkeypatch.setattr(commconf, "HTTP_TIMEOUT", 2)
+	monkeypatch.setattr(commconf, "HTTP_COMPRESSION", False)
+	monkeypatch.setattr(comms, "printline", print)
+
+#function to build an initial post reply listing appointments (ids), sync is "full" or "delta"
+def sync_reply(ids, sync="full", cancelled=()):
+	reply = [{"server_date_time": SERVER_TIME, "sync": sync}]
+	for appt_id in ids:
+		reply.append({"fields": {"appointment_ID": appt_id, "appointment_start_date_time": "2021-04-01T12:00:00", "cancelled": appt_id in cancelled}})
+	return reply
+
+#function to run the sync part of a wake (as in main.py) against a server that sends reply
+#returns the FileIO the appointments were stored with
+def run_sync(file_io_inst, reply):
+	server = Mock_Server(lambda request: reply)
+	try:
+		network = comms.Dev_Network(comms.Http_Client(server.url), "TEST")
+		mess = comms.Dev_Message(file_io_inst.dev_id, file_io_inst.server_pass, 3.7)
+		mess.include_sync_cursor(file_io_inst.get_sync_cursor(), file_io_inst.get_sync_digest())
+		success, datetime, appt_data = network.send_initial_post(mess)
+		assert success
+		with file_io_inst.transaction():
+			listed = file_io_inst.reconcile_appointments(appt_data)
+			if network.sync_complete():
+				if network.sync_full():
+					file_io_inst.remove_unlisted_appointments(listed)
+				file_io_inst.set_sync_cursor(datetime)
+		network.http.close()
+	finally:
+		server.close()
+	return file_io_inst
+
+#function to make the stored appointments of the tests: 100 and 101 upcoming, 102 with an
+#unsent answer, 103 cancelled
+def stored_appointments():
+	return 	[
+				appointment(100, "2021-04-01T12:00:00"),
+				appointment(101, "2021-04-01T12:00:00"),
+				appointment(102, "2021-04-01T12:00:00", [[1, False]]),
+				appointment(103, "2021-04-01T12:00:00", cancelled=True)
+			]
+
+def test_full_reply_removes_unlisted_appointments():
+	file_io_inst = run_sync(make_file_io(stored_appointments()), response(sync_reply([100, 104])))
+	#102 stays until its answer is sent
+	assert sorted(stored_ids(file_io_inst)) == [100, 102, 104]
+	assert file_io_inst.get_sync_cursor() == SERVER_TIME
+	assert file_io_inst.unsent_index == {102: 1}
+
+def test_full_reply_matches_server_digest_afterwards():
+	server_ids = [100, 101, 104]
+	file_io_inst = run_sync(make_file_io([appointment(100, "2021-04-01T12:00:00"), appointment(105, "2021-04-01T12:00:00")]), response(sync_reply(server_ids)))
+	expected = make_file_io([appointment(appt_id, "2021-04-01T12:00:00") for appt_id in server_ids])
+	assert file_io_inst.get_sync_digest() == expected.get_sync_digest()
+
+def test_delta_reply_keeps_unlisted_appointments():
+	file_io_inst = run_sync(make_file_io(stored_appointments()), response(sync_reply([101, 104], "delta", cancelled=[101])))
+	assert sorted(stored_ids(file_io_inst)) == [100, 101, 102, 103, 104]
+	assert file_io_inst.find_appointment(101)["cancelled"] is True
+
+def test_broken_off_full_reply_removes_nothing():
+	body = comms.ujson.dumps(sync_reply([100, 104])).encode()
+	#the connection closes half way through the second appointment
+	reply = [response(body[:len(body)-40], length=len(body)), CLOSE]
+	file_io_inst = run_sync(make_file_io(stored_appointments()), reply)
+	assert sorted(stored_ids(file_io_inst)) == [100, 101, 102, 103]
+	assert file_io_inst.get_sync_cursor() is None